@@ -0,0 +1,210 @@
+import glob
+import os
+import time as tm
+import numpy as np
+from profiling import timings
+from PyQt5 import QtCore
+from frameprocessing import FrameProcessor
+from fwhm import c
+from spectrum import InternAxis
+from spectrumio import ReadSpectrum
+
+
+class RingBuffer:
+    # Preallocated frame store. The writer fills a slot and only then bumps count,
+    # so readers never need a lock: they copy the newest slot and check that the
+    # writer did not lap them while copying.
+
+    def __init__(self, capacity, pixels):
+        self.capacity = capacity
+        self.frames = np.zeros((capacity, pixels))
+        self.timestamps = np.zeros(capacity)
+        self.count = 0
+
+    def Push(self, values, timestamp):
+        slot = self.count % self.capacity
+        self.frames[slot] = values
+        self.timestamps[slot] = timestamp
+        self.count += 1
+
+    def Latest(self, out):
+        while True:
+            seq = self.count - 1
+            if seq < 0:
+                return None
+            slot = seq % self.capacity
+            out[:] = self.frames[slot]
+            timestamp = self.timestamps[slot]
+            if self.count - seq < self.capacity:
+                return seq, timestamp
+
+
+class AcquisitionWorker(QtCore.QThread):
+    # Reads frames from a seabreeze-like device as fast as it delivers them.
+    # frameReady is emitted only when the GUI has picked up the previous frame,
+    # so slow rendering skips frames instead of queueing them. The ring keeps the
+    # raw frames; the dark-subtracted, averaged and corrected frames from
+    # processor go to a short second ring that Latest reads. An exception in the
+    # read loop (device unplugged, tracker or processor failure) ends the thread;
+    # it is kept in exception and sent with error.
+    frameReady = QtCore.pyqtSignal(int)
+    error = QtCore.pyqtSignal(object)
+
+    def __init__(self, device, capacity=512, parent=None):
+        QtCore.QThread.__init__(self, parent)
+        self.device = device
+        self.wavelengths = InternAxis(device.wavelengths(), getattr(device, 'serial_number', None))
+        self.ring = RingBuffer(capacity, len(self.wavelengths))
+        self.processor = FrameProcessor(len(self.wavelengths))
+        self.processed = RingBuffer(4, len(self.wavelengths))
+        # Set to a tracking.Tracker to get per-frame metrics on this thread
+        self.tracker = None
+        self._running = False
+        self._pending = False
+        self._integrationTime = None
+        self.integrationTime = None
+        self.exception = None
+
+    def SetIntegrationTime(self, micros):
+        # Applied from the reader thread between two frames
+        self._integrationTime = int(micros)
+
+    def run(self):
+        self._running = True
+        try:
+            self._ReadLoop()
+        except Exception as error:
+            # Escaping QThread.run would abort the whole application
+            self._running = False
+            self.exception = error
+            self.error.emit(error)
+
+    def _ReadLoop(self):
+        while self._running:
+            if self._integrationTime is not None:
+                self.device.integration_time_micros(self._integrationTime)
+                self.integrationTime = self._integrationTime
+                self._integrationTime = None
+            start = tm.perf_counter()
+            values = self.device.intensities()
+            arrival = tm.perf_counter()
+            timings.Record('usb read', start, arrival)
+            timestamp = tm.time()
+            self.ring.Push(values, timestamp)
+            processed = self.processor.Process(values)
+            self.processed.Push(processed, timestamp)
+            timings.Record('frame processing', arrival)
+            tracker = self.tracker
+            if tracker is not None:
+                tracker.Update(processed, self.ring.count - 1, timestamp, arrival)
+                timings.Record('tracking', arrival)
+            if not self._pending:
+                self._pending = True
+                self.frameReady.emit(self.ring.count - 1)
+
+    def Stop(self):
+        self._running = False
+        self.wait()
+
+    def Latest(self, out):
+        self._pending = False
+        return self.processed.Latest(out)
+
+
+class ReplaySpectrometer:
+    # Stand-in for seabreeze.spectrometers.Spectrometer that replays spectra from
+    # text files. rate is in frames per second, None replays as fast as possible.
+
+    def __init__(self, files=None, rate=10.0, noise=0.0):
+        if files is None:
+            files = sorted(glob.glob(os.path.join('calibrationData', 'avantes-*.txt')))
+        data = [ReadSpectrum(file) for file in files]
+        self._wavelengths = data[0][:, 0]
+        self._frames = np.array([np.interp(self._wavelengths, d[:, 0], d[:, 1]) for d in data])
+        self.rate = rate
+        self.noise = noise
+        self.serial_number = 'REPLAY'
+        self.model = 'Replay'
+        self._index = 0
+        self._next = None
+        self._rng = np.random.default_rng()
+
+    def __str__(self):
+        return '<ReplaySpectrometer %d files>' % len(self._frames)
+
+    def wavelengths(self):
+        return self._wavelengths.copy()
+
+    def integration_time_micros(self, micros):
+        if not micros > 0:
+            raise ValueError('Integration time must be positive, not %s us' % micros)
+        self.rate = 1e6 / micros
+
+    def intensities(self, correct_dark_counts=False, correct_nonlinearity=False):
+        if self.rate:
+            now = tm.perf_counter()
+            if self._next is None or self._next < now:
+                self._next = now
+            tm.sleep(self._next - now)
+            self._next += 1 / self.rate
+        frame = self._frames[self._index % len(self._frames)].copy()
+        self._index += 1
+        if self.noise:
+            frame += self.noise * self._rng.standard_normal(len(frame))
+        return frame
+
+    def close(self):
+        pass
+
+
+class MockSpectrometer:
+    # Synthetic seabreeze-like device for testing without hardware: a Gaussian
+    # pulse spectrum of the given FWHM (fs), seen through a Gaussian detector
+    # sensitivity, on top of a dark level with optional noise.
+
+    def __init__(self, start=400.0, stop=900.0, pixels=2048, center=800.0, duration=15.0,
+                 sensitivityCenter=None, sensitivityWidth=None, dark=0.01, noise=0.0,
+                 rate=20.0, serial='MOCK'):
+        self._wavelengths = np.linspace(start, stop, pixels)
+        if sensitivityCenter is None:
+            sensitivityCenter = (start + stop) / 2
+        if sensitivityWidth is None:
+            sensitivityWidth = (stop - start) / 2
+        w = 2*np.pi*c/self._wavelengths
+        dw = 4*np.log(2) / duration
+        spectrum = np.exp(-4*np.log(2) * ((w - 2*np.pi*c/center) / dw)**2) / self._wavelengths**2
+        self.spectrum = spectrum / np.max(spectrum)
+        self.sensitivity = np.exp(-((self._wavelengths - sensitivityCenter) / sensitivityWidth)**2)
+        self.dark = dark
+        self.noise = noise
+        self.rate = rate
+        self.serial_number = serial
+        self.model = 'Mock'
+        self._next = None
+        self._rng = np.random.default_rng()
+
+    def __str__(self):
+        return '<MockSpectrometer %s %.0f-%.0f nm>' % (self.serial_number, self._wavelengths[0], self._wavelengths[-1])
+
+    def wavelengths(self):
+        return self._wavelengths.copy()
+
+    def integration_time_micros(self, micros):
+        if not micros > 0:
+            raise ValueError('Integration time must be positive, not %s us' % micros)
+        self.rate = 1e6 / micros
+
+    def intensities(self, correct_dark_counts=False, correct_nonlinearity=False):
+        if self.rate:
+            now = tm.perf_counter()
+            if self._next is None or self._next < now:
+                self._next = now
+            tm.sleep(self._next - now)
+            self._next += 1 / self.rate
+        frame = self.spectrum * self.sensitivity + self.dark
+        if self.noise:
+            frame = frame + self.noise * self._rng.standard_normal(len(frame))
+        return frame
+
+    def close(self):
+        pass
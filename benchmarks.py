@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time as tm
+import numpy as np
+import calibration
+import smoothing
+from decimation import FrequencyBinner, MinMaxBinner
+from fwhm import CalculateFWHM, CalculateFWHMBatch, CalculateFWHMUniform, c
+from spectrumio import ReadSpectrum, WriteSpectrum
+
+sizes = (1024, 4096, 16384)
+
+
+def SyntheticSpectrum(pixels, shape='gauss', duration=20.0, center=800.0, span=(600.0, 1000.0)):
+    # Transform-limited spectrum of a pulse with the given intensity FWHM (fs),
+    # sampled per wavelength on a detector-like axis. Returns wavelength, intensity.
+    wavelength = np.linspace(span[0], span[1], pixels)
+    w = 2*np.pi*c/wavelength
+    w0 = 2*np.pi*c/center
+    if shape == 'gauss':
+        dw = 4*np.log(2) / duration
+        spectrum = np.exp(-4*np.log(2) * ((w - w0) / dw)**2)
+    else:
+        # sech^2(t/T) pulse: FWHM = 2 acosh(sqrt 2) T, spectrum sech^2(pi T (w-w0) / 2)
+        T = duration / (2*np.arccosh(np.sqrt(2)))
+        spectrum = 1 / np.cosh(np.pi*T*(w - w0) / 2)**2
+    return wavelength, spectrum * 2*np.pi*c / wavelength**2
+
+
+def LegacyFWHM(wavelength, intensity):
+    # CalculateFWHM as it was in main.py
+    freq = 2*np.pi*c/wavelength
+    dw = (freq[0]-freq[1])
+    newFreq = np.arange(-10*freq[0], 10*freq[0], dw)
+    wSpec = np.interp(newFreq, np.flip(freq), np.flip(intensity*(wavelength**2 /(2*np.pi*c))), left=1e-30, right=1e-30)
+    pulse = np.fft.fftshift(np.fft.ifft(np.sqrt(np.abs(wSpec))))
+    pulse = np.abs(pulse) ** 2 / np.max(np.abs(pulse) ** 2)
+    time = np.fft.fftshift(np.fft.fftfreq(len(pulse), dw/(2*np.pi)))
+    izqPulse = np.abs(pulse[0:int(len(pulse)/2)]-0.5)
+    izqTime = time[0:int(len(pulse)/2)]
+    derPulse = np.abs(pulse[int(len(pulse)/2):len(pulse)]-0.5)
+    derTime = time[int(len(pulse)/2):]
+    minIzqPulse = np.where(izqPulse == np.min(izqPulse))[0]
+    minDerPulse = np.where(derPulse == np.min(derPulse))[0]
+    return (derTime[minDerPulse] - izqTime[minIzqPulse])[0]
+
+
+def LegacyFWHMRealTime(wavelength, intensity):
+    # CalculateFWHM as it was in main_realTime.py
+    freq = 2*np.pi*c/wavelength
+    dw = (freq[0]-freq[-1])/len(freq)
+    newFreq = np.arange(0, 50*freq[0], dw)
+    wSpec = np.interp(newFreq, np.flip(freq), np.flip(intensity*(wavelength**2 /(2*np.pi*c))), left=1e-10, right=1e-10)
+    pulse = np.fft.fftshift(np.fft.ifft(np.sqrt(np.abs(wSpec))))
+    pulse = np.abs(pulse)**2 / np.max(np.abs(pulse)**2)
+    time = np.fft.fftshift(np.fft.fftfreq(len(pulse), dw/(2*np.pi)))
+    izqPulse = np.abs(pulse[0:int(len(pulse)/2)]-0.5)
+    izqTime = time[0:int(len(pulse)/2)]
+    derPulse = np.abs(pulse[int(len(pulse)/2):len(pulse)]-0.5)
+    derTime = time[int(len(pulse)/2):]
+    minIzqPulse = np.where(izqPulse == np.min(izqPulse))[0]
+    minDerPulse = np.where(derPulse == np.min(derPulse))[0]
+    return (derTime[minDerPulse] - izqTime[minIzqPulse])[0]
+
+
+def Time(function, repeat=7, budget=0.2):
+    # Median seconds per call; calls are batched so fast routines are timed above
+    # the timer resolution, and the whole measurement stays near the budget
+    function()
+    start = tm.perf_counter()
+    function()
+    single = tm.perf_counter() - start
+    number = max(1, int(0.01 / max(single, 1e-9)))
+    repeat = max(3, min(repeat, int(budget / max(single * number, 1e-9))))
+    times = []
+    for _ in range(repeat):
+        start = tm.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((tm.perf_counter() - start) / number)
+    return float(np.median(times))
+
+
+def Run(sizes=sizes, durations=(10.0, 30.0, 100.0), legacy=True):
+    results = []
+
+    def Record(name, pixels, seconds, error=None, note=''):
+        results.append({'name': name, 'pixels': pixels, 'ms': seconds * 1e3, 'error': error})
+        line = '%-28s %6d %10.3f ms' % (name, pixels, seconds * 1e3)
+        if error is not None:
+            line += '   max FWHM error %6.2f %%' % error
+        print(line + note)
+
+    fwhmRoutines = [('CalculateFWHM', CalculateFWHM)]
+    if legacy:
+        fwhmRoutines += [('legacy main.py', LegacyFWHM), ('legacy main_realTime.py', LegacyFWHMRealTime)]
+
+    theo = np.column_stack(SyntheticSpectrum(441, span=(300.0, 1100.0), duration=5.0))
+    for pixels in sizes:
+        for name, routine in fwhmRoutines:
+            errors = []
+            for shape in ('gauss', 'sech2'):
+                for duration in durations:
+                    wavelength, intensity = SyntheticSpectrum(pixels, shape, duration)
+                    errors.append(abs(routine(wavelength, intensity) / duration - 1) * 100)
+            wavelength, intensity = SyntheticSpectrum(pixels)
+            Record(name, pixels, Time(lambda: routine(wavelength, intensity), repeat=3), max(errors))
+
+        wavelength, intensity = SyntheticSpectrum(pixels)
+        stack = intensity * (1 + 0.01*np.random.default_rng(0).random((64, pixels)))
+        Record('CalculateFWHMBatch (64 rows)', pixels, Time(lambda: CalculateFWHMBatch(wavelength, stack)) / 64)
+
+        specCal = np.column_stack((wavelength, intensity + 0.1))
+        Record('CalculateResponse', pixels, Time(lambda: calibration.CalculateResponse(specCal, theo)))
+        Record('savgol smoothing', pixels, Time(lambda: calibration.SmoothSpectrum(intensity)))
+        Record('box smoothing', pixels, Time(lambda: calibration.SmoothResponse(intensity, 'box')))
+        SmoothingBackends(Record, pixels, stack)
+        Decimation(Record, pixels, stack, durations)
+        Record('SuperGaussianFilter', pixels, Time(lambda: calibration.SuperGaussianFilter(wavelength, 800, 50, 4)))
+
+        spectrum = np.column_stack((wavelength, intensity))
+        with tempfile.TemporaryDirectory() as folder:
+            text = os.path.join(folder, 'spectrum.txt')
+            binary = os.path.join(folder, 'spectrum.npy')
+            Record('WriteSpectrum (text)', pixels, Time(lambda: WriteSpectrum(text, spectrum)))
+            Record('np.savetxt', pixels, Time(lambda: np.savetxt(text, spectrum, '%.2f')))
+            Record('ReadSpectrum (text)', pixels, Time(lambda: ReadSpectrum(text)))
+            Record('np.loadtxt', pixels, Time(lambda: np.loadtxt(text)))
+            WriteSpectrum(binary, spectrum)
+            Record('ReadSpectrum (npy)', pixels, Time(lambda: ReadSpectrum(binary)))
+    return results
+
+
+def SmoothingBackends(Record, pixels, stack):
+    # Every backend of narrow and wide filters on one spectrum and on a stack,
+    # per spectrum, with the one 'auto' picks and its largest deviation from
+    # the direct backend; scipy's savgol_filter is the reference for speed
+    from scipy.signal import savgol_filter
+    for rows in (1, len(stack)):
+        data = stack[:rows]
+        Record('scipy savgol_filter (%d)' % rows, pixels, Time(lambda: savgol_filter(data, 21, 3, axis=-1)) / rows)
+        for smoother in (smoothing.Savgol(21, 3), smoothing.Box(11), smoothing.Savgol(101, 3), smoothing.Box(101)):
+            chosen = smoother.Fastest(data)
+            reference = smoother(data, 'direct')
+            for backend in smoother.Backends():
+                deviation = np.max(np.abs(smoother(data, backend) - reference)) / np.max(np.abs(reference))
+                note = '   deviation %.0e%s' % (deviation, '   <- auto' if backend == chosen else '')
+                Record('%s %s (%d)' % (smoother.key, backend, rows), pixels,
+                       Time(lambda: smoother(data, backend)) / rows, note=note)
+
+
+def Decimation(Record, pixels, stack, durations):
+    # Min/max binning for a 1000 px wide plot, and the FWHM of spectra rebinned
+    # onto 512 uniform frequency bins, on one spectrum and per row of a stack
+    wavelength, intensity = SyntheticSpectrum(pixels)
+    binner = MinMaxBinner(wavelength, 1000)
+    Record('MinMaxBinner (1000 bins)', pixels, Time(lambda: binner(intensity)), note='   %d points' % len(binner.x))
+    rebin = FrequencyBinner(wavelength, 512)
+    errors = []
+    for shape in ('gauss', 'sech2'):
+        for duration in durations:
+            spectrum = SyntheticSpectrum(pixels, shape, duration)[1]
+            errors.append(abs(CalculateFWHMUniform(rebin.frequency, rebin(spectrum)) / duration - 1) * 100)
+    Record('FrequencyBinner+FWHM', pixels,
+           Time(lambda: CalculateFWHMUniform(rebin.frequency, rebin(intensity))), max(errors))
+    Record('FrequencyBinner+FWHM (64)', pixels,
+           Time(lambda: CalculateFWHMUniform(rebin.frequency, rebin(stack))) / 64)
+
+
+def Compare(results, baseline, tolerance=0.25):
+    # Names and sizes whose time grew by more than tolerance versus the baseline run
+    reference = {(r['name'], r['pixels']): r['ms'] for r in baseline}
+    regressions = []
+    for r in results:
+        before = reference.get((r['name'], r['pixels']))
+        if before and r['ms'] > before * (1 + tolerance):
+            regressions.append((r['name'], r['pixels'], before, r['ms']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time and check the numerical routines on synthetic spectra.')
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(sizes), help='detector sizes in pixels')
+    parser.add_argument('--no-legacy', action='store_true', help='skip the old FWHM implementations')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file from a previous --save to check for regressions')
+    args = parser.parse_args(argv)
+
+    results = Run(args.sizes, legacy=not args.no_legacy)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = Compare(results, json.load(f))
+        for name, pixels, before, after in regressions:
+            print('REGRESSION %s (%d px): %.3f ms -> %.3f ms' % (name, pixels, before, after))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import os
+import numpy as np
+from fwhm import CalculateFWHM, CalculateFWHMBatch
+from spectrumio import WriteSpectrum
+from resample import Resample
+from smoothing import Box, Savgol
+
+calibrationDir = 'calibrationData'
+# Lamp data sheet used when defaultFiles.txt does not name one
+defaultTheoretical = '1409074-ISP30-NIR'
+
+
+def ReadDefaultFiles(directory=calibrationDir):
+    # key:value lines of defaultFiles.txt as a dict; tolerates Windows line
+    # endings, blank lines and a missing file
+    defaults = {}
+    try:
+        with open(os.path.join(directory, 'defaultFiles.txt'), 'r') as f:
+            for line in f:
+                key, sep, value = line.partition(':')
+                if sep and value.strip():
+                    defaults[key.strip().lower()] = value.strip()
+    except OSError:
+        pass
+    return defaults
+
+
+def readDefaultNames(directory=calibrationDir):
+    # Lamp and theoretical spectrum file names. Without an experimental entry
+    # the newest calibration of the library is used.
+    defaults = ReadDefaultFiles(directory)
+    expName = defaults.get('experimental')
+    if expName is None:
+        from calibrationlibrary import CalibrationLibrary
+        newest = CalibrationLibrary(directory).Newest()
+        if newest is None:
+            raise OSError('No default calibration in ' + directory)
+        expName = newest['name']
+    return expName, defaults.get('theoretical', defaultTheoretical)
+
+
+def CalculateResponse(specCal, theoCal):
+    interpTheoCal = Resample(theoCal[:, 0], theoCal[:, 1], specCal[:, 0])
+    R = np.divide(np.abs(specCal[:, 1]),
+                  np.abs(interpTheoCal),
+                  out=np.zeros(len(interpTheoCal)),
+                  where=interpTheoCal != 0)
+    R = R / np.max(R)
+    return interpTheoCal, R, InverseResponse(R)
+
+
+def InverseResponse(R):
+    return np.divide(1, R, out=np.zeros(len(R)), where=R != 0)
+
+
+# Filters behind the response smoothing choices; the key of each filter goes
+# into the response cache key
+responseSmoothers = {'savgol': Savgol(21, 3), 'box': Box(11)}
+
+
+def SmoothResponse(R, smoothing='savgol'):
+    return responseSmoothers[smoothing](R)
+
+
+def SmoothSpectrum(intensity):
+    # Works on single spectra and on (spectra x pixels) stacks
+    return Savgol(21, 3)(intensity)
+
+
+def SuperGaussianFilter(wavelength, center, width, exponent):
+    return np.exp(-((wavelength - center) / width) ** exponent)
+
+
+def CalibrateSpectrum(intensity, multiplyR, filter=None):
+    # Same scaling as the calibrator window: the filtered spectrum is normalised
+    # before the filter is applied, the unfiltered one is returned as corrected
+    calibrated = intensity * multiplyR
+    if filter is not None:
+        calibrated = filter * (calibrated / np.max(calibrated))
+    return calibrated
+
+
+def CalibrateStack(intensities, multiplyR, filter=None, smooth=False, normalise=False):
+    # Row-wise version of SmoothSpectrum + CalibrateSpectrum for an
+    # (N spectra x N pixels) matrix sharing one wavelength axis
+    intensities = np.asarray(intensities, dtype=float)
+    if smooth:
+        intensities = SmoothSpectrum(intensities)
+    calibrated = intensities * multiplyR
+    if filter is not None:
+        calibrated /= np.max(calibrated, axis=1, keepdims=True)
+        calibrated *= filter
+    if normalise:
+        calibrated /= np.max(calibrated, axis=1, keepdims=True)
+    return calibrated
+
+
+def CalibratedName(filename, ext='.txt'):
+    return os.path.splitext(filename)[0] + '_calibrated' + ext
+
+
+def ExportSpectrum(filename, wavelength, intensity, fmt='%.2f'):
+    spec = np.stack((wavelength, intensity)).T
+    WriteSpectrum(filename, spec, fmt)
+
+
+def ComputeResponse(specCal, theoCal, smoothing=None):
+    # smoothing is None, 'savgol' or 'box'
+    interpTheoCal, R, multiplyR = CalculateResponse(specCal, theoCal)
+    if smoothing is not None:
+        R = SmoothResponse(R, smoothing)
+        multiplyR = InverseResponse(R)
+    return {'specCal': specCal, 'theoCal': theoCal, 'interpTheoCal': interpTheoCal,
+            'R': R, 'multiplyR': multiplyR}
+
+
+class Calibration:
+    # Everything needed to calibrate spectra measured on the calibration axis.
+    # Instances are small and picklable, so they can be handed to worker processes.
+
+    def __init__(self, response):
+        self.wavelength = response['specCal'][:, 0]
+        self.interpTheoCal = response['interpTheoCal']
+        self.R = response['R']
+        self.multiplyR = response['multiplyR']
+        self.filterParameters = None
+        self.smooth = False
+
+    def SetFilter(self, center, width, exponent):
+        self.filterParameters = (center, width, int(exponent))
+
+    def ResponseFor(self, wavelength):
+        # Spectra measured on another axis get the response interpolated onto it
+        return Resample(self.wavelength, self.multiplyR, wavelength)
+
+    def Process(self, spectrum):
+        wavelength = spectrum[:, 0]
+        intensity = spectrum[:, 1]
+        if self.smooth:
+            intensity = SmoothSpectrum(intensity)
+        filter = None
+        if self.filterParameters is not None:
+            filter = SuperGaussianFilter(wavelength, *self.filterParameters)
+        calibrated = CalibrateSpectrum(intensity, self.ResponseFor(wavelength), filter)
+        return calibrated, CalculateFWHM(wavelength, calibrated)
+
+    def ProcessSet(self, spectra):
+        # spectrum.SpectrumSet version of ProcessStack
+        return self.ProcessStack(spectra.wavelength, spectra.intensities)
+
+    def ProcessStack(self, wavelength, intensities):
+        filter = None
+        if self.filterParameters is not None:
+            filter = SuperGaussianFilter(wavelength, *self.filterParameters)
+        calibrated = CalibrateStack(intensities, self.ResponseFor(wavelength), filter, smooth=self.smooth)
+        return calibrated, CalculateFWHMBatch(wavelength, calibrated)
@@ -0,0 +1,222 @@
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import warnings
+import numpy as np
+from calibration import ReadDefaultFiles, calibrationDir, defaultTheoretical
+from resample import Resample
+from responsecache import FileHash, ResponseCache
+
+# Every response is also kept on this fixed grid (NaN outside its range), so
+# all calibrations can be compared as one matrix without reading them again
+driftGrid = np.arange(200.0, 2500.0, 0.5)
+indexVersion = 1
+
+# Day, month and year in names such as avantes-18_01_22.txt
+_datePattern = re.compile(r'(?<!\d)(\d{1,2})[_.-](\d{1,2})[_.-](\d{4}|\d{2})(?!\d)')
+
+
+def ParseDate(filename):
+    # Date in a file name, None if there is none
+    name = os.path.basename(filename)
+    match = _datePattern.search(name)
+    if match is None:
+        return None
+    day, month, year = (int(group) for group in match.groups())
+    try:
+        return datetime.date(year + 2000 if year < 100 else year, month, day)
+    except ValueError:
+        return None
+
+
+def SpectrumDate(filename):
+    # Measurement date of a spectrum: from its name if it has one, else its modification time
+    return ParseDate(filename) or datetime.date.fromtimestamp(os.path.getmtime(filename))
+
+
+def _Device(filename):
+    # Name part before the date, e.g. avantes
+    name = os.path.basename(filename)
+    return name[:_datePattern.search(name).start()].strip(' -_') or 'unknown'
+
+
+class CalibrationLibrary:
+    # Dated lamp spectra of a calibration directory, scanned once into an index
+    # kept next to the response cache: date, device, wavelength range, checksum
+    # and response cache key per file, plus every response on driftGrid. Later
+    # scans only read files whose size or modification time changed, and the
+    # responses themselves come from the ResponseCache .npz files.
+
+    def __init__(self, directory=calibrationDir, theoretical=None, responseCache=None):
+        self.directory = directory
+        if theoretical is None:
+            theoretical = os.path.join(directory, ReadDefaultFiles(directory).get('theoretical', defaultTheoretical))
+        self.theoretical = theoretical
+        self.responses = responseCache or ResponseCache(os.path.join(directory, '.cache'))
+        self.indexName = os.path.join(self.responses.directory, 'library')
+        self.entries = []
+        self.matrix = np.empty((0, len(driftGrid)), dtype=np.float32)
+        self.Refresh()
+
+    def _Load(self):
+        try:
+            with open(self.indexName + '.json', 'r') as f:
+                index = json.load(f)
+            matrix = np.load(self.indexName + '.npy')
+        except (OSError, ValueError):
+            return {}
+        if index.get('version') != indexVersion or len(index['entries']) != len(matrix):
+            return {}
+        return {entry['name']: (entry, row) for entry, row in zip(index['entries'], matrix)}
+
+    def _Save(self):
+        try:
+            os.makedirs(self.responses.directory, exist_ok=True)
+            np.save(self.indexName + '.tmp.npy', self.matrix)
+            with open(self.indexName + '.tmp.json', 'w') as f:
+                json.dump({'version': indexVersion, 'entries': self.entries}, f, indent=1)
+            os.replace(self.indexName + '.tmp.npy', self.indexName + '.npy')
+            os.replace(self.indexName + '.tmp.json', self.indexName + '.json')
+        except OSError:
+            pass
+
+    def Refresh(self):
+        previous = self._Load()
+        theoretical = FileHash(self.theoretical)
+        entries = []
+        rows = []
+        changed = False
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if ParseDate(name) is None or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entry, row = previous.pop(name, (None, None))
+            if entry is None or (entry['size'], entry['mtime'], entry['theoretical']) != (
+                    stat.st_size, stat.st_mtime_ns, theoretical):
+                try:
+                    entry, row = self._Index(path, stat, theoretical)
+                except (OSError, ValueError, IndexError) as error:
+                    warnings.warn('%s skipped: %s' % (path, error))
+                    continue
+                changed = True
+            entries.append(entry)
+            rows.append(row)
+        order = sorted(range(len(entries)), key=lambda i: (entries[i]['date'], entries[i]['name']))
+        self.entries = [entries[i] for i in order]
+        self.matrix = np.array([rows[i] for i in order], dtype=np.float32).reshape(-1, len(driftGrid))
+        if changed or previous:
+            self._Save()
+
+    def _Index(self, path, stat, theoretical):
+        response = self.responses.Get(path, self.theoretical)
+        wavelength = response['specCal'][:, 0]
+        low, high = float(np.min(wavelength)), float(np.max(wavelength))
+        row = np.full(len(driftGrid), np.nan, dtype=np.float32)
+        inside = (driftGrid >= low) & (driftGrid <= high)
+        row[inside] = Resample(wavelength, response['R'], driftGrid[inside])
+        entry = {'name': os.path.basename(path), 'date': ParseDate(path).isoformat(), 'device': _Device(path),
+                 'range': [low, high], 'pixels': len(wavelength), 'checksum': FileHash(path),
+                 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'theoretical': theoretical,
+                 'response': self.responses.Key(path, self.theoretical)}
+        return entry, row
+
+    def __len__(self):
+        return len(self.entries)
+
+    def Path(self, entry):
+        return os.path.join(self.directory, entry['name'])
+
+    def Response(self, entry):
+        return self.responses.Get(self.Path(entry), self.theoretical)
+
+    def Newest(self, device=None):
+        entries = [entry for entry in self.entries if device is None or entry['device'] == device]
+        return entries[-1] if entries else None
+
+    def Nearest(self, when, device=None, wavelength=None):
+        # Calibration closest in time to when (a date or datetime). Only
+        # calibrations of device and overlapping the wavelength axis are
+        # considered when there are any; ties go to the later one.
+        if not self.entries:
+            return None
+        if isinstance(when, datetime.datetime):
+            when = when.date()
+        candidates = np.arange(len(self.entries))
+        if device is not None:
+            same = [i for i in candidates if self.entries[i]['device'] == device]
+            candidates = np.array(same or candidates)
+        if wavelength is not None and len(wavelength):
+            low, high = np.min(wavelength), np.max(wavelength)
+            overlapping = [i for i in candidates
+                           if self.entries[i]['range'][0] < high and self.entries[i]['range'][1] > low]
+            candidates = np.array(overlapping or candidates)
+        dates = np.array([self.entries[i]['date'] for i in candidates], dtype='datetime64[D]')
+        distance = np.abs(dates - np.datetime64(when, 'D')).astype(int)
+        # Entries are sorted by date, so the last of the closest is the later one
+        return self.entries[candidates[len(distance) - 1 - np.argmin(distance[::-1])]]
+
+    def Drift(self, device=None, reference=0, threshold=0.05):
+        # Response of every calibration of device relative to the reference one
+        # (an index into them, oldest first), on the wavelengths all of them
+        # cover where the reference response is above threshold of its maximum.
+        # trend is the least-squares relative change per year at each wavelength.
+        devices = sorted({entry['device'] for entry in self.entries})
+        if device is None:
+            if len(devices) != 1:
+                raise ValueError('Choose one device of %s' % ', '.join(devices) if devices else 'No calibrations')
+            device = devices[0]
+        chosen = [i for i, entry in enumerate(self.entries) if entry['device'] == device]
+        if not chosen:
+            raise ValueError('No calibrations of ' + device)
+        responses = self.matrix[chosen].astype(float)
+        base = responses[reference]
+        covered = np.all(np.isfinite(responses), axis=0)
+        covered[covered] = base[covered] > threshold * np.max(base[covered])
+        responses = responses[:, covered]
+        relative = responses / responses[reference] - 1
+        dates = np.array([self.entries[i]['date'] for i in chosen], dtype='datetime64[D]')
+        years = (dates - dates[0]).astype(float) / 365.25
+        years -= np.mean(years)
+        mean = np.mean(responses, axis=0)
+        spread = np.dot(years, years)
+        trend = np.dot(years, responses - mean) / (spread * mean) if spread else np.zeros(len(mean))
+        return {'names': [self.entries[i]['name'] for i in chosen], 'dates': dates,
+                'wavelength': driftGrid[covered], 'relative': relative,
+                'rms': np.sqrt(np.mean(relative ** 2, axis=1)), 'max': np.max(np.abs(relative), axis=1),
+                'trend': trend}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Index dated lamp calibrations, pick the nearest one to a '
+                                                 'spectrum and report response drift.')
+    parser.add_argument('spectra', nargs='*', help='spectra to find the nearest calibration for')
+    parser.add_argument('--directory', default=calibrationDir, help='calibration directory')
+    parser.add_argument('--device', help='only consider calibrations of this device')
+    parser.add_argument('--drift', action='store_true', help='report response drift between calibrations')
+    args = parser.parse_args(argv)
+
+    library = CalibrationLibrary(args.directory)
+    for entry in library.entries:
+        print('%s  %-10s %-28s %7.1f-%7.1f nm  %5d px  %s'
+              % (entry['date'], entry['device'], entry['name'], entry['range'][0], entry['range'][1],
+                 entry['pixels'], entry['checksum'][:12]))
+    for filename in args.spectra:
+        nearest = library.Nearest(SpectrumDate(filename), args.device)
+        print('%s\t%s' % (filename, library.Path(nearest) if nearest else 'no calibration'))
+    if args.drift:
+        drift = library.Drift(args.device)
+        print('Drift against %s over %.0f-%.0f nm:' % (drift['names'][0], drift['wavelength'][0],
+                                                       drift['wavelength'][-1]))
+        for name, date, rms, worst in zip(drift['names'], drift['dates'], drift['rms'], drift['max']):
+            print('%s  %-28s rms %6.2f %%  max %6.2f %%' % (date, name, rms * 100, worst * 100))
+        print('Trend: median %.2f %%/year, largest %.2f %%/year'
+              % (np.median(np.abs(drift['trend'])) * 100, np.max(np.abs(drift['trend'])) * 100))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
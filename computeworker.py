@@ -0,0 +1,97 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5 import QtCore
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Job:
+    # One submitted computation. Long jobs call Check between steps so that a
+    # superseded job stops early instead of running to the end.
+
+    def __init__(self, lane, onResult=None, onError=None):
+        self.lane = lane
+        self.onResult = onResult
+        self.onError = onError
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def Cancel(self):
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def Check(self):
+        if self._cancelled.is_set():
+            raise Cancelled()
+
+
+class ComputeWorker(QtCore.QObject):
+    # Runs function(job, *args) on a thread pool and hands the result back on
+    # the GUI thread through a queued signal. Jobs go in named lanes: a new job
+    # supersedes the one in flight on its lane, which is cancelled, and only
+    # the newest job of a lane ever delivers a result, so the GUI never shows
+    # results for parameters it has already changed.
+    finished = QtCore.pyqtSignal(str, object)
+    failed = QtCore.pyqtSignal(str, object)
+    # Emitted from pool threads, delivered on the thread the worker lives in
+    _done = QtCore.pyqtSignal(object, object, object)
+
+    def __init__(self, workers=2, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='compute')
+        self.current = {}
+        self._done.connect(self._Deliver)
+
+    def Submit(self, lane, function, *args, onResult=None, onError=None):
+        previous = self.current.get(lane)
+        if previous is not None:
+            previous.Cancel()
+        job = Job(lane, onResult, onError)
+        self.current[lane] = job
+        job.future = self.pool.submit(self._Run, job, function, args)
+        return job
+
+    def _Run(self, job, function, args):
+        try:
+            job.Check()
+            result = function(job, *args)
+        except Cancelled:
+            return
+        except Exception as error:
+            # Any failure is passed to the GUI thread rather than lost in the pool
+            self._done.emit(job, None, error)
+            return
+        self._done.emit(job, result, None)
+
+    def _Deliver(self, job, result, error):
+        if self.current.get(job.lane) is not job or job.cancelled:
+            return
+        del self.current[job.lane]
+        if error is not None:
+            if job.onError is not None:
+                job.onError(error)
+            self.failed.emit(job.lane, error)
+        else:
+            if job.onResult is not None:
+                job.onResult(result)
+            self.finished.emit(job.lane, result)
+
+    def Busy(self, lane=None):
+        return lane in self.current if lane is not None else bool(self.current)
+
+    def Cancel(self, lane):
+        job = self.current.pop(lane, None)
+        if job is not None:
+            job.Cancel()
+
+    def Shutdown(self):
+        for lane in list(self.current):
+            self.Cancel(lane)
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,91 @@
+import numpy as np
+from fwhm import c
+from resample import Resampler
+
+# Spectra reduced before they are drawn or stored: cropped to a region of
+# interest given in nm, binned to the screen width for display, or rebinned
+# onto a uniform frequency grid for the pulse duration. Every binner
+# precomputes its layout for one wavelength axis and then works on single
+# spectra or (spectra x pixels) stacks.
+
+
+def RoiSlice(wavelength, roi=None):
+    # Pixels of a monotonic axis between the two wavelengths of roi (nm), as a
+    # slice so cropping is a view; None keeps the whole axis
+    if roi is None:
+        return slice(None)
+    low, high = min(roi), max(roi)
+    inside = np.flatnonzero((wavelength >= low) & (wavelength <= high))
+    if not len(inside):
+        raise ValueError('No pixels between %g and %g nm' % (low, high))
+    return slice(inside[0], inside[-1] + 1)
+
+
+class MinMaxBinner:
+    # Display decimation to at most two points per bin: the minimum and the
+    # maximum of the bin, in the order they occur. With one bin per screen pixel
+    # column the line looks the same as the full one, narrow peaks and spikes
+    # included. The x values are the first and last wavelength of each bin, so
+    # they do not change from frame to frame.
+
+    def __init__(self, wavelength, bins, roi=None):
+        wavelength = np.asarray(wavelength, dtype=float)
+        self.bins = bins
+        self.crop = RoiSlice(wavelength, roi)
+        axis = wavelength[self.crop]
+        pixels = len(axis)
+        # Below two pixels per bin there is nothing to gain
+        self.size = -(-pixels // bins) if pixels > 2 * bins else 1
+        count = -(-pixels // self.size)
+        self.pad = count * self.size - pixels
+        if self.size == 1:
+            self.x = axis
+        else:
+            last = np.minimum(np.arange(1, count + 1) * self.size, pixels) - 1
+            self.x = np.column_stack((axis[::self.size], axis[last])).ravel()
+
+    def __call__(self, values):
+        values = np.asarray(values)[..., self.crop]
+        if self.size == 1:
+            return values
+        if self.pad:
+            # The last bin is filled up with its last value, which changes neither extreme
+            values = np.concatenate((values, np.repeat(values[..., -1:], self.pad, axis=-1)), axis=-1)
+        blocks = values.reshape(values.shape[:-1] + (-1, self.size))
+        low = np.argmin(blocks, axis=-1)
+        high = np.argmax(blocks, axis=-1)
+        order = np.stack((np.minimum(low, high), np.maximum(low, high)), axis=-1)
+        return np.take_along_axis(blocks, order, axis=-1).reshape(values.shape[:-1] + (-1,))
+
+
+class FrequencyBinner:
+    # Rebins spectra from a wavelength axis onto points uniform angular
+    # frequency bins (rad/fs), conserving the energy of every bin: the running
+    # integral over wavelength is interpolated at the bin edges and differenced.
+    # The result is the spectral density per unit frequency, which already
+    # includes the wavelength to frequency Jacobian, so fwhm.CalculateFWHMUniform
+    # takes it as it is. points defaults to the number of pixels in the ROI.
+
+    def __init__(self, wavelength, points=None, roi=None):
+        wavelength = np.asarray(wavelength, dtype=float)
+        self.crop = RoiSlice(wavelength, roi)
+        axis = wavelength[self.crop]
+        points = points or len(axis)
+        edges = np.linspace(2*np.pi*c / np.max(axis), 2*np.pi*c / np.min(axis), points + 1)
+        self.frequency = 0.5 * (edges[1:] + edges[:-1])
+        self.step = edges[1] - edges[0]
+        self._edges = Resampler(axis, 2*np.pi*c / edges)
+        # Negative on axes that go down in wavelength, so the running integral
+        # grows with wavelength either way
+        self._halfWidths = 0.5 * np.diff(axis)
+        self._scale = 1.0 / self.step
+
+    def __call__(self, values):
+        values = np.asarray(values, dtype=float)[..., self.crop]
+        integral = np.zeros(values.shape)
+        np.cumsum((values[..., 1:] + values[..., :-1]) * self._halfWidths, axis=-1, out=integral[..., 1:])
+        atEdges = self._edges(integral)
+        # Frequency edges go up, so their wavelengths go down
+        density = atEdges[..., :-1] - atEdges[..., 1:]
+        density *= self._scale
+        return density
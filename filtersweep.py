@@ -0,0 +1,133 @@
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from fwhm import CalculateFWHMBatch
+from spectrumio import ReadSpectrum
+
+
+def Evaluate(wavelength, spectrum, parameters):
+    # Transmitted energy fraction and transform-limited FWHM for each
+    # (center, width, exponent) row, all candidates of the block in one batch
+    parameters = np.atleast_2d(parameters)
+    center, width, exponent = parameters[:, 0:1], parameters[:, 1:2], parameters[:, 2:3]
+    step = np.gradient(wavelength)
+    filtered = np.exp(-((wavelength - center) / width) ** exponent) * spectrum
+    energy = (filtered @ step) / (spectrum @ step)
+    return energy, CalculateFWHMBatch(wavelength, filtered)
+
+
+def Grid(centers, widths, exponents):
+    return np.array(np.meshgrid(centers, widths, exponents, indexing='ij'), dtype=float).reshape(3, -1).T
+
+
+def ParetoFront(energy, fwhm):
+    # Indices of the candidates no other candidate beats on both shorter pulse
+    # and higher transmitted energy, ordered by pulse duration
+    valid = np.flatnonzero(np.isfinite(fwhm) & (energy > 0))
+    order = valid[np.lexsort((-energy[valid], fwhm[valid]))]
+    best = np.maximum.accumulate(energy[order])
+    keep = np.concatenate(([True], best[1:] > best[:-1]))
+    return order[keep]
+
+
+_block = None
+_memory = None
+
+
+def _Attach(name, shape):
+    global _block, _memory
+    _memory = SharedMemory(name=name)
+    _block = np.ndarray(shape, dtype=float, buffer=_memory.buf)
+
+
+def _EvaluateChunk(parameters):
+    return Evaluate(_block[0], _block[1], parameters)
+
+
+def Sweep(wavelength, spectrum, parameters, workers=None, chunk=64):
+    # Evaluates every parameter row across a process pool. The spectrum lives in
+    # shared memory so only the small parameter blocks are pickled per task.
+    parameters = np.atleast_2d(parameters)
+    memory = SharedMemory(create=True, size=2 * len(wavelength) * 8)
+    try:
+        block = np.ndarray((2, len(wavelength)), dtype=float, buffer=memory.buf)
+        block[0] = wavelength
+        block[1] = spectrum
+        chunks = [parameters[i:i + chunk] for i in range(0, len(parameters), chunk)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_Attach,
+                                 initargs=(memory.name, block.shape)) as pool:
+            results = list(pool.map(_EvaluateChunk, chunks))
+        del block
+    finally:
+        memory.close()
+        memory.unlink()
+    energy = np.concatenate([r[0] for r in results])
+    fwhm = np.concatenate([r[1] for r in results])
+    return energy, fwhm
+
+
+def Optimise(wavelength, spectrum, start, exponents=(2, 4, 6, 8), minEnergy=0.5, targetFWHM=None):
+    # Nelder-Mead over (center, width) for each even exponent. Minimises the
+    # pulse duration, or the distance to targetFWHM, while keeping at least
+    # minEnergy of the spectrum; returns (center, width, exponent), energy, FWHM.
+    from scipy.optimize import minimize
+
+    def Cost(x, exponent):
+        if x[1] <= 0:
+            return np.inf
+        energy, fwhm = Evaluate(wavelength, spectrum, [x[0], x[1], exponent])
+        if not np.isfinite(fwhm[0]):
+            return np.inf
+        cost = fwhm[0] if targetFWHM is None else (fwhm[0] - targetFWHM) ** 2
+        return cost + 1e3 * max(0.0, minEnergy - energy[0])
+
+    best = None
+    for exponent in exponents:
+        result = minimize(Cost, start, args=(exponent,), method='Nelder-Mead')
+        if best is None or result.fun < best[0]:
+            best = (result.fun, (result.x[0], result.x[1], exponent))
+    parameters = best[1]
+    energy, fwhm = Evaluate(wavelength, spectrum, parameters)
+    return parameters, energy[0], fwhm[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Search super-Gaussian filter parameters for a calibrated spectrum.')
+    parser.add_argument('spectrum', help='calibrated spectrum file')
+    parser.add_argument('--centers', nargs=3, type=float, metavar=('START', 'STOP', 'N'))
+    parser.add_argument('--widths', nargs=3, type=float, metavar=('START', 'STOP', 'N'))
+    parser.add_argument('--exponents', nargs='+', type=int, default=[2, 4, 6, 8])
+    parser.add_argument('--optimise', action='store_true', help='Nelder-Mead search instead of a grid')
+    parser.add_argument('--min-energy', type=float, default=0.5)
+    parser.add_argument('--target', type=float, help='target FWHM in fs for --optimise')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    spectrum = ReadSpectrum(args.spectrum)
+    wavelength, intensity = spectrum[:, 0], np.abs(spectrum[:, 1])
+    if args.optimise:
+        peak = wavelength[np.argmax(intensity)]
+        start = (peak, (wavelength[-1] - wavelength[0]) / 4)
+        (center, width, exponent), energy, fwhm = Optimise(wavelength, intensity, start, args.exponents,
+                                                            args.min_energy, args.target)
+        print('center %.2f nm  width %.2f nm  exponent %d  energy %.3f  FWHM %.2f fs'
+              % (center, width, exponent, energy, fwhm))
+        return 0
+
+    span = wavelength.max() - wavelength.min()
+    centers = args.centers or (wavelength.min(), wavelength.max(), 21)
+    widths = args.widths or (0.02 * span, 0.5 * span, 20)
+    centers = np.linspace(centers[0], centers[1], int(centers[2]))
+    widths = np.linspace(widths[0], widths[1], int(widths[2]))
+    parameters = Grid(centers, widths, args.exponents)
+    energy, fwhm = Sweep(wavelength, intensity, parameters, workers=args.workers)
+    print('center\twidth\texponent\tenergy\tFWHM (fs)')
+    for i in ParetoFront(energy, fwhm):
+        print('%.2f\t%.2f\t%d\t%.4f\t%.2f' % (parameters[i, 0], parameters[i, 1], parameters[i, 2], energy[i], fwhm[i]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
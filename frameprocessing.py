@@ -0,0 +1,117 @@
+import threading
+import numpy as np
+
+
+class FrameProcessor:
+    # Streaming pre-processing for live frames: dark capture and subtraction,
+    # boxcar (running sum) or exponential averaging and response correction.
+    # All buffers are preallocated, Process works in place and returns the same
+    # output array every time. Settings can be changed from any thread; they are
+    # applied by the acquisition thread before the next frame.
+
+    def __init__(self, pixels, maxAverage=100):
+        self.pixels = pixels
+        self.maxAverage = maxAverage
+        self.dark = np.zeros(pixels)
+        self.darkValid = False
+        self.subtractDark = False
+        self.average = 1
+        self.alpha = None
+        self.response = None
+        self.frames = 0
+        self.out = np.zeros(pixels)
+        self._work = np.zeros(pixels)
+        self._history = np.zeros((maxAverage, pixels))
+        self._sum = np.zeros(pixels)
+        self._ema = np.zeros(pixels)
+        self._darkSum = np.zeros(pixels)
+        self._darkFrames = 0
+        self._darkTarget = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _Request(self, **settings):
+        with self._lock:
+            self._pending.update(settings)
+
+    def CaptureDark(self, frames=10):
+        self._Request(captureDark=int(frames))
+
+    def SetSubtractDark(self, subtract):
+        self._Request(subtractDark=bool(subtract))
+
+    def SetAverage(self, frames):
+        # Boxcar over the last frames frames
+        self._Request(average=int(min(max(frames, 1), self.maxAverage)), alpha=None)
+
+    def SetExponentialAverage(self, alpha):
+        # ema = (1 - alpha) * ema + alpha * frame, alpha=None returns to boxcar
+        self._Request(alpha=alpha)
+
+    def SetResponse(self, response):
+        self._Request(response=None if response is None else np.array(response, dtype=float))
+
+    @property
+    def capturingDark(self):
+        return self._darkTarget > 0 or 'captureDark' in self._pending
+
+    def _Apply(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if 'captureDark' in pending:
+            self._darkSum[:] = 0
+            self._darkFrames = 0
+            self._darkTarget = pending['captureDark']
+        if 'subtractDark' in pending:
+            self.subtractDark = pending['subtractDark']
+        if 'average' in pending:
+            self.average = pending['average']
+        if 'alpha' in pending:
+            self.alpha = pending['alpha']
+        if 'response' in pending:
+            self.response = pending['response']
+        if 'average' in pending or 'alpha' in pending:
+            self.frames = 0
+            self._sum[:] = 0
+
+    def Process(self, frame):
+        if self._pending:
+            self._Apply()
+
+        if self._darkTarget:
+            self._darkSum += frame
+            self._darkFrames += 1
+            if self._darkFrames == self._darkTarget:
+                np.divide(self._darkSum, self._darkFrames, out=self.dark)
+                self.darkValid = True
+                self._darkTarget = 0
+
+        work = self._work
+        if self.subtractDark and self.darkValid:
+            np.subtract(frame, self.dark, out=work)
+        else:
+            work[:] = frame
+
+        if self.alpha is not None:
+            if self.frames == 0:
+                self._ema[:] = work
+            else:
+                work -= self._ema
+                work *= self.alpha
+                self._ema += work
+            self.out[:] = self._ema
+        else:
+            slot = self.frames % self.average
+            if slot == 0 and self.frames:
+                # Rebuild the running sum once per cycle so rounding errors cannot build up
+                np.sum(self._history[:self.average], axis=0, out=self._sum)
+            if self.frames >= self.average:
+                self._sum -= self._history[slot]
+            self._history[slot] = work
+            self._sum += work
+            np.multiply(self._sum, 1 / min(self.frames + 1, self.average), out=self.out)
+        self.frames += 1
+
+        if self.response is not None:
+            self.out *= self.response
+        return self.out
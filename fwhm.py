@@ -0,0 +1,157 @@
+import numpy as np
+from resample import Resampler
+
+c = 3e2  # Speed of light in nm/fs, so frequencies are in rad/fs and times in fs
+
+
+class FWHMEngine:
+    # Transform-limited pulse duration from a spectrum given on a wavelength axis.
+    # The spectrum is resampled onto a uniform frequency grid that only covers its
+    # own bandwidth and is zero-padded to an FFT-friendly length. The carrier is
+    # dropped, which does not change |E(t)|^2. Grids and buffers are kept between
+    # calls and only rebuilt when the wavelength axis changes.
+
+    def __init__(self, timeResolution=None, padFactor=4):
+        self.timeResolution = timeResolution  # Target time step in fs, None = padFactor only
+        self.padFactor = padFactor
+        self.time = None
+        self._key = None
+
+    def _Prepare(self, wavelength):
+        key = (len(wavelength), hash(wavelength.tobytes()))
+        if key == self._key:
+            return
+        freq = 2*np.pi*c/wavelength
+        points = len(freq)
+        dw = (np.max(freq) - np.min(freq)) / (points - 1)
+        self._Allocate(points, dw)
+
+        # Precomputed gather, so whole stacks of spectra are resampled at once
+        self._resampler = Resampler(freq, np.min(freq) + dw*np.arange(points))
+        self._jacobian = wavelength**2 / (2*np.pi*c)
+        self._scaled = np.empty(points)
+        self._amplitude = np.empty(points)
+        self._scratch = np.empty(points)
+        self._key = key
+
+    def _PrepareUniform(self, frequency):
+        key = ('uniform', len(frequency), hash(frequency.tobytes()))
+        if key == self._key:
+            return
+        points = len(frequency)
+        dw = abs(frequency[-1] - frequency[0]) / (points - 1)
+        if not np.allclose(np.abs(np.diff(frequency)), dw, rtol=1e-6, atol=0):
+            raise ValueError('Frequency axis is not uniform')
+        self._Allocate(points, dw)
+        self._key = key
+
+    def _Allocate(self, points, dw):
+        # scipy is imported on first use, it is slow to load and not needed to start the GUI
+        from scipy.fft import next_fast_len
+        size = self.padFactor * points
+        if self.timeResolution:
+            size = max(size, int(np.ceil(2*np.pi / (dw*self.timeResolution))))
+        size = next_fast_len(size)
+        self._field = np.zeros(size)
+        self._power = np.empty(size)
+        self._halfPower = np.empty(size//2 + 1)
+        self._points = points
+        self.dt = 2*np.pi / (size*dw)
+        self.time = (np.arange(size) - size//2) * self.dt
+
+    def _Amplitude(self, intensity):
+        return np.sqrt(self._resampler(np.abs(intensity * self._jacobian)))
+
+    def _Fill(self, wavelength, intensity):
+        wavelength = np.asarray(wavelength, dtype=float)
+        intensity = np.asarray(intensity, dtype=float)
+        self._Prepare(wavelength)
+        # Single spectra go through preallocated buffers, only the FFT allocates.
+        # The zero padding after the first points samples is never written.
+        np.multiply(intensity, self._jacobian, out=self._scaled)
+        np.abs(self._scaled, out=self._scaled)
+        self._resampler.Into(self._scaled, self._amplitude, self._scratch)
+        np.sqrt(self._amplitude, out=self._field[:self._points])
+
+    def _Power(self, wavelength, intensity):
+        # |E(t)|^2 over the whole time window, in FFT order
+        self._Fill(wavelength, intensity)
+        from scipy.fft import ifft
+        np.abs(ifft(self._field), out=self._power)
+        np.square(self._power, out=self._power)
+        return self._power
+
+    def _HalfPower(self, wavelength, intensity):
+        # The spectral amplitude is real, so the t >= 0 half of |E(t)|^2 comes
+        # from a real FFT at half the cost (its scale does not matter for widths)
+        self._Fill(wavelength, intensity)
+        from scipy.fft import rfft
+        np.abs(rfft(self._field), out=self._halfPower)
+        np.square(self._halfPower, out=self._halfPower)
+        return self._halfPower
+
+    def _Widths(self, power):
+        # power holds |E(t)|^2 for t >= 0. It is symmetric around t = 0 where it
+        # peaks, so the FWHM is twice the first half-maximum crossing.
+        rows = np.arange(len(power))
+        half = 0.5 * power[:, 0]
+        below = power < half[:, None]
+        k = np.argmax(below, axis=1)
+        found = below[rows, k]
+        k = np.maximum(k, 1)
+        before = power[rows, k - 1]
+        after = power[rows, k]
+        fraction = np.divide(before - half, before - after, out=np.zeros(len(power)), where=found)
+        return np.where(found, 2 * (k - 1 + fraction) * self.dt, np.nan)
+
+    def __call__(self, wavelength, intensity):
+        power = self._HalfPower(wavelength, intensity)
+        return self._Widths(power[None, :])[0]
+
+    def Batch(self, wavelength, intensities):
+        # FWHM of every row of an (N spectra x N pixels) stack with a single FFT
+        wavelength = np.asarray(wavelength, dtype=float)
+        intensities = np.atleast_2d(np.asarray(intensities, dtype=float))
+        self._Prepare(wavelength)
+        field = np.zeros((len(intensities), len(self._field)))
+        field[:, :self._points] = self._Amplitude(intensities)
+        from scipy.fft import rfft
+        power = rfft(field, axis=1, overwrite_x=True, workers=-1)
+        power = power.real**2 + power.imag**2
+        return self._Widths(power)
+
+    def Uniform(self, frequency, densities):
+        # FWHM of every row of spectral densities already on a uniform frequency
+        # grid, e.g. from decimation.FrequencyBinner: no resampling and no Jacobian
+        frequency = np.asarray(frequency, dtype=float)
+        densities = np.atleast_2d(np.asarray(densities, dtype=float))
+        self._PrepareUniform(frequency)
+        field = np.zeros((len(densities), len(self._field)))
+        np.sqrt(np.abs(densities), out=field[:, :self._points])
+        from scipy.fft import rfft
+        power = rfft(field, axis=1, overwrite_x=True, workers=-1)
+        power = power.real**2 + power.imag**2
+        return self._Widths(power)
+
+    def Pulse(self, wavelength, intensity):
+        power = self._Power(wavelength, intensity)
+        pulse = np.fft.fftshift(power)
+        return self.time, pulse / np.max(pulse)
+
+
+_engine = FWHMEngine()
+
+
+def CalculateFWHM(wavelength, intensity):
+    return _engine(wavelength, intensity)
+
+
+def CalculateFWHMBatch(wavelength, intensities):
+    return _engine.Batch(wavelength, intensities)
+
+
+def CalculateFWHMUniform(frequency, density):
+    # Same as CalculateFWHM for spectra rebinned onto a uniform frequency grid;
+    # one width for one spectrum, an array of widths for a stack
+    widths = _engine.Uniform(frequency, density)
+    return widths[0] if np.ndim(density) == 1 else widths
@@ -1,14 +1,21 @@
-import matplotlib.pyplot as plt
+import time as tm
+startTime = tm.perf_counter()
+import sys
+import traceback
 from PyQt5.QtWidgets import *
-from PyQt5.uic import loadUi
 from PyQt5 import QtCore, QtGui
 import numpy as np
-from tkinter import Tk
-from tkinter.filedialog import askopenfilename
-from scipy.signal import savgol_filter
-import psutil
 import warnings
-import time as tm
+import calibration
+from calibration import ReadDefaultFiles
+from decimation import RoiSlice
+from responsecache import ResponseCache
+from spectrum import Spectrum
+from calibrationlibrary import CalibrationLibrary, SpectrumDate
+from pipeline import SpectrumPipeline
+from startup import LoadUi, StartupProfiler
+from computeworker import ComputeWorker
+from statuspanel import InstallRoiPanel, InstallStatusPanel
 warnings.filterwarnings("error")
 # from PyQt5 import QtWidgets
 # from matplotlib.figure import Figure
@@ -39,81 +46,57 @@ matplotlib.use('QT5Agg')
 #         self.setLayout(self.vbl)
 
 
-def readDefaultNames():
-    f = open('calibrationData\defaultFiles.txt', 'r')
-    expName = f.readline().split(":")[1]
-    expName = expName.split("\n")[0]
-    theoName = f.readline().split(":")[1]
-    f.close()
-    return expName, theoName
-
-
-def LoadFile(filename=None, field=None):
-    if filename is None:
-        Tk().withdraw()
-        filename = askopenfilename()
-    file = np.loadtxt(filename)
-    if field:
-        field.setText(filename)
-    return file
-
-
-def CalculateFWHM(wavelength, intensity):
-
-    c = 3e2
-    freq = 2*np.pi*c/wavelength
-    dw = (freq[0]-freq[1])
-    newFreq = np.arange(-10*freq[0], 10*freq[0], dw)
-    wSpec = np.interp(newFreq, np.flip(freq), np.flip(intensity*(wavelength**2 /(2*np.pi*c))), left=1e-30, right=1e-30)
-    pulse = np.fft.fftshift(np.fft.ifft(np.sqrt(np.abs(wSpec))))
-    pulse = np.abs(pulse) ** 2 / np.max(np.abs(pulse) ** 2)
-
-    try:
-        time = np.fft.fftshift(np.fft.fftfreq(len(pulse), dw/(2*np.pi)))
-
-        izqPulse = np.abs(pulse[0:int(len(pulse)/2)]-0.5)
-        izqTime = time[0:int(len(pulse)/2)]
-        derPulse = np.abs(pulse[int(len(pulse)/2):len(pulse)]-0.5)
-        derTime = time[int(len(pulse)/2):]
-
-
-        minIzqPulse = np.where(izqPulse == np.min(izqPulse))[0]
-        minDerPulse = np.where(derPulse == np.min(derPulse))[0]
-
-        return derTime[minDerPulse] - izqTime[minIzqPulse]
-
-    except RuntimeWarning:
-        return 'Error'
+def AskFilename():
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilename
+    Tk().withdraw()
+    return askopenfilename()
 
 
 class CalibratorApp(QMainWindow):
+    # Emitted with the file names and the response once a calibration is in use
+    responseLoaded = QtCore.pyqtSignal(object, object)
 
     def __init__(self, UI):
         QMainWindow.__init__(self)
-        loadUi(UI, self)
+        LoadUi(UI, self)
         self.show()
         self.specButton.clicked.connect(self.loadSpectrum)
         self.smoothSpecButton.clicked.connect(self.SmoothSpec)
         self.exportButton.clicked.connect(self.ExportSpec)
 
-        if psutil.cpu_count() < 4:
-            self.smoothButton.clicked.connect(self.SmoothSignalCalibration_LowResources)
-        else:
-            self.smoothButton.clicked.connect(self.SmoothSignalCalibration)
+        # Same filter on every machine, smoothing picks the fastest way to apply it
+        self.smoothButton.clicked.connect(self.SmoothSignalCalibration)
 
         self.filterCheckButton.toggled.connect(self.ToggleFilter)
         self.centerText.editingFinished.connect(self.UpdatePlot)
         self.widthText.editingFinished.connect(self.UpdatePlot)
         self.exponentText.editingFinished.connect(self.UpdatePlot)
-
-        expName, theoName = readDefaultNames()
-
-        try:
-            self.expText.setText('calibrationData/' + expName)
-            self.specCal = LoadFile(filename=self.expText.text())
-            self.theoCal = LoadFile(filename=self.theoText.text())
-        except:
-            pass
+        # Redraw while typing, once the user pauses
+        self.plotTimer = QtCore.QTimer(self)
+        self.plotTimer.setSingleShot(True)
+        self.plotTimer.setInterval(150)
+        self.plotTimer.timeout.connect(self.UpdatePlot)
+        self.centerText.textEdited.connect(self.plotTimer.start)
+        self.widthText.textEdited.connect(self.plotTimer.start)
+        self.exponentText.textEdited.connect(self.plotTimer.start)
+        self.expButton.clicked.connect(lambda: self.LoadCalibration(self.expText))
+        self.theoLoad.clicked.connect(lambda: self.LoadCalibration(self.theoText))
+
+        # Without a default lamp spectrum the newest one of the calibration
+        # library is used, once the library has been indexed in the background
+        expName = ReadDefaultFiles().get('experimental')
+        self.expText.setText('calibrationData/' + expName if expName else '')
+        self.responseCache = ResponseCache()
+        # Loading, smoothing, the spectrum pipeline and export run here, so the
+        # event loop only ever draws
+        self.compute = ComputeWorker(parent=self)
+        # Indexed on the loader thread; picks the calibration for each loaded
+        # spectrum until one is chosen by hand
+        self.library = None
+        self.autoCalibration = True
+        self.specCal = []
+        self.theoCal = []
 
         self.finalSpec = []
         self.expSpec = []
@@ -123,54 +106,143 @@ class CalibratorApp(QMainWindow):
         self.multiplyR = []
         self.calibratedSpec = []
         self.filter = []
+        self.filterParameters = None
+        self.pipeline = SpectrumPipeline()
         self.FWHM = []
-        try:
-            self.CalculateResponse()
-        except:
-            pass
+        # The default calibration is read once the window is on screen
+        QtCore.QTimer.singleShot(0, self.RequestResponse)
+        self.statusPanel = InstallStatusPanel(self)
+        self.roiPanel = InstallRoiPanel(self)
+        self.roiPanel.changed.connect(self.SetRoi)
 
     def loadSpectrum(self):
-        try:
-            spectrum = LoadFile(field=self.specText)
-            self.expSpec = spectrum
-            self.expSpec_mod = spectrum
-            self.finalSpec = spectrum
-            self.specFrame.setFrameStyle(QFrame.NoFrame)
+        filename = AskFilename()
+        if not filename:
+            return
+        self.specText.setText(filename)
+        self.compute.Submit('load', lambda job, name: Spectrum.Load(name), filename,
+                            onResult=self.SpectrumLoaded, onError=self.SpectrumFailed)
+
+    def SpectrumLoaded(self, spectrum):
+        # Copies share the data until edited, the loaded spectrum stays untouched.
+        # A smoothing of the previous spectrum must not replace this one.
+        self.compute.Cancel('smooth')
+        self.expSpec = spectrum
+        self.expSpec_mod = spectrum.Copy()
+        self.finalSpec = spectrum.Copy()
+        self.ChooseCalibration(spectrum, self.specText.text())
+        self.specFrame.setFrameStyle(QFrame.NoFrame)
+        self.UpdatePlot()
+        self.smoothSpecButton.setEnabled(True)
+        self.filterCheckButton.setEnabled(True)
+        self.exportButton.setEnabled(True)
+
+    def SpectrumFailed(self, error):
+        self.specText.setText("Wrong file format")
+        self.ShowError('Spectrum not loaded', error)
+
+    def RequestResponse(self):
+        if self.library is None and not self.compute.Busy('library'):
+            # Built once on its own lane, so later loads do not supersede it
+            self.compute.Submit('library', lambda job: CalibrationLibrary(responseCache=self.responseCache),
+                                onResult=self.LibraryLoaded,
+                                onError=lambda error: self.ShowError('Calibration library not loaded', error))
+        names = (self.expText.text(), self.theoText.text())
+        if not names[0]:
+            # LibraryLoaded picks the lamp spectrum once the library is there
+            if self.library is not None:
+                self.ShowError('Calibration not loaded', OSError('No calibration spectra'))
+            return
+        # A request for other files supersedes one still loading
+        self.compute.Submit('response', self._LoadResponse, *names,
+                            onResult=lambda response: self.ResponseLoaded(names, response),
+                            onError=lambda error: self.ShowError('Calibration not loaded', error))
+
+    def _LoadResponse(self, job, expName, theoName):
+        return self.responseCache.Get(expName, theoName)
+
+    def LibraryLoaded(self, library):
+        self.library = library
+        if not self.expText.text():
+            newest = library.Newest()
+            if newest is None:
+                self.ShowError('Calibration not loaded', OSError('No calibration spectra in ' + library.directory))
+                return
+            self.expText.setText(library.Path(newest))
+            self.RequestResponse()
+        # A spectrum loaded meanwhile gets its calibration now
+        if len(self.expSpec):
+            self.ChooseCalibration(self.expSpec, self.specText.text())
+
+    def ResponseLoaded(self, names, response):
+        self.SetResponse(response)
+        if len(self.finalSpec):
             self.UpdatePlot()
-            CalculateFWHM(spectrum[:, 0], spectrum[:, 1])
-            self.smoothSpecButton.setEnabled(True)
-            self.filterCheckButton.setEnabled(True)
-            self.exportButton.setEnabled(True)
-
-        except:
-            self.specText.setText("Wrong file format")
-            pass
-
-    def CalculateResponse(self):
-        self.interpTheoCal = np.interp(self.specCal[:, 0], self.theoCal[:, 0], self.theoCal[:, 1])
-        self.R = np.divide(np.abs(self.specCal[:, 1]),
-                           np.abs(self.interpTheoCal),
-                           where=self.interpTheoCal != 0)
-        self.R = self.R / np.max(self.R)
-        self.multiplyR = np.divide(1, self.R, where=self.R != 0)
+        self.responseLoaded.emit(names, response)
+
+    def ChooseCalibration(self, spectrum, filename):
+        # Switches to the lamp spectrum measured closest in time to the spectrum
+        if not self.autoCalibration or self.library is None:
+            return
+        try:
+            nearest = self.library.Nearest(SpectrumDate(filename), wavelength=spectrum.wavelength)
+        except OSError:
+            return
+        if nearest is not None and self.library.Path(nearest) != self.expText.text():
+            self.expText.setText(self.library.Path(nearest))
+            self.statusBar().showMessage('Using calibration ' + nearest['name'] + ', nearest in time', 8000)
+            self.RequestResponse()
+
+    def ShowError(self, message, error):
+        # Failures go to the status bar and the console instead of being dropped
+        self.statusBar().showMessage('%s: %s' % (message, error), 8000)
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+    def SetResponse(self, response):
+        # Nor a smoothing of the previous response this one
+        self.compute.Cancel('smoothResponse')
+        self.specCal = Spectrum.FromArray(response['specCal'])
+        self.theoCal = Spectrum.FromArray(response['theoCal'])
+        self.interpTheoCal = response['interpTheoCal']
+        self.R = response['R']
+        self.multiplyR = response['multiplyR']
         self.UpdateCalPlot()
 
-    def SuperGaussianFilter(self):
+    def LoadCalibration(self, field):
+        filename = AskFilename()
+        if filename:
+            field.setText(filename)
+            if field is self.expText:
+                self.autoCalibration = False
+            self.RequestResponse()
+
+    def FilterParameters(self):
+        # (center, width, exponent), or None with the filter off
+        if not self.filterCheckButton.isChecked():
+            return None
         try:
             self.filterCounter = 1
             center = float(self.centerText.text())
             width = float(self.widthText.text())
             exponent = int(self.exponentText.text())
-            self.filter = np.exp(-((self.expSpec[:, 0] - center) / width) ** exponent)
-        except:
-            pass
+            self.filterParameters = (center, width, exponent)
+        except ValueError:
+            # Keeps the previous filter while a field is being edited
+            self.statusBar().showMessage('Invalid filter parameters', 3000)
+        return self.filterParameters
 
     def SmoothSpec(self):
-        try:
-            self.finalSpec[:, 1] = savgol_filter(self.finalSpec[:, 1], 21, 3)
-            self.UpdatePlot()
-        except:
-            pass
+        # Clicks made while a smoothing runs are merged into it
+        if not len(self.finalSpec):
+            return
+        self.compute.Submit('smooth', lambda job, spectrum:
+                            spectrum.WithIntensity(calibration.SmoothSpectrum(spectrum.intensity)),
+                            self.finalSpec, onResult=self.SpectrumSmoothed,
+                            onError=lambda error: self.ShowError('Smoothing failed', error))
+
+    def SpectrumSmoothed(self, spectrum):
+        self.finalSpec = spectrum
+        self.UpdatePlot()
 
     def ToggleFilter(self):
         if self.filterCheckButton.isChecked():
@@ -184,82 +256,114 @@ class CalibratorApp(QMainWindow):
 
         self.UpdatePlot()
     def SmoothSignalCalibration(self):
-        try:
-            self.R = savgol_filter(self.R, 21, 3)
-            self.multiplyR = np.divide(1, self.R, where=self.R != 0)
-        except:
-            pass
-        self.UpdateCalPlot()
-
-    def SmoothSignalCalibration_LowResources(self):
-        boxPoints = 10
-        box = np.ones(boxPoints) / boxPoints
-        self.R = np.convolve(self.R, box, mode='same')
-        self.multiplyR = np.divide(1, self.R, where=self.R != 0)
+        if not len(self.R):
+            return
+        self.compute.Submit('smoothResponse', lambda job, R: calibration.SmoothResponse(R), self.R,
+                            onResult=self.ResponseSmoothed,
+                            onError=lambda error: self.ShowError('Smoothing failed', error))
+
+    def ResponseSmoothed(self, R):
+        self.R = R
+        self.multiplyR = calibration.InverseResponse(self.R)
         self.UpdateCalPlot()
 
     def ExportSpec(self):
-        try:
-            specNew, wavelength, norm = self.UpdatePlot()
-            tm.sleep(0.5)
-            spec = np.stack((wavelength, specNew*norm)).T
-            np.savetxt(self.specText.text().split('.')[0]+'_calibrated.txt', spec,'%.2f')
-            self.exportLabel.setText('Saved!')
-        except:
-            self.exportLabel.setText('Try again')
+        if not len(self.finalSpec):
+            return
+        self.exportLabel.setText('Saving...')
+        self.compute.Submit('export', self._Export, calibration.CalibratedName(self.specText.text()),
+                            self._Parameters(), np.max(self.expSpec.intensity), self.roiPanel.Roi(),
+                            onResult=lambda filename: self.exportLabel.setText('Saved!'),
+                            onError=self.ExportFailed)
+
+    def _Export(self, job, filename, params, norm, roi):
+        results = self.pipeline.Evaluate(params, ('wavelength', 'calibrated'), job.Check)
+        job.Check()
+        crop = RoiSlice(results['wavelength'], roi)
+        calibration.ExportSpectrum(filename, results['wavelength'][crop], results['calibrated'][crop] * norm,
+                                   '%.2f')
+        return filename
+
+    def SetRoi(self, roi):
+        # Spectrum plots are cut to the ROI, the calibration plot is not
+        self.specPlot.canvas.SetRoi(roi)
+        self.UpdatePlot()
+
+    def ExportFailed(self, error):
+        self.exportLabel.setText('Try again')
+        self.ShowError('Export failed', error)
+
+    def _Parameters(self):
+        params = {'spectrum': self.finalSpec, 'filter': self.FilterParameters()}
+        if len(self.specCal):
+            params['calWavelength'] = self.specCal.wavelength
+            params['multiplyR'] = self.multiplyR
+        return params
 
     def UpdatePlot(self):
+        # Computed on the compute pool and drawn by DrawSpectrum; an edit made
+        # meanwhile supersedes this one. Only the stages downstream of whatever
+        # changed are recomputed.
         self.exportLabel.setText(' ')
-        try:
-            plotSpec = self.finalSpec[:, 1] * self.multiplyR
-        except:
-            plotSpec = np.abs(self.finalSpec[:, 1]) / np.max(self.finalSpec[:, 1])
-        self.specPlot.canvas.ax.clear()
-        self.specPlot.canvas.ax.plot(self.expSpec[:, 0], np.abs(self.expSpec[:, 1]) / np.max(self.expSpec[:, 1]))
-        if self.filterCheckButton.isChecked():
-            self.SuperGaussianFilter()
-            plotSpec = self.filter*(plotSpec/np.max(plotSpec))
-            self.specPlot.canvas.ax.plot(self.finalSpec[:, 0], (plotSpec/np.max(plotSpec)))
-            self.specPlot.canvas.ax.plot(self.finalSpec[:, 0], self.filter)
+        if not len(self.finalSpec):
+            return
+        self.compute.Submit('spectrum', self._Evaluate, self._Parameters(),
+                            ('wavelength', 'raw', 'normalised', 'filterCurve', 'fwhm'),
+                            onResult=self.DrawSpectrum,
+                            onError=lambda error: self.ShowError('Calculation failed', error))
+
+    def _Evaluate(self, job, params, names):
+        return self.pipeline.Evaluate(params, names, job.Check)
+
+    def DrawSpectrum(self, results):
+        wavelength = results['wavelength']
+        self.filter = results['filterCurve']
+        canvas = self.specPlot.canvas
+        canvas.SetLine('raw', wavelength, results['raw'], color='C0')
+        canvas.SetLine('calibrated', wavelength, results['normalised'], color='C1')
+        if self.filter is not None:
+            canvas.SetLine('filter', wavelength, self.filter, color='C2')
         else:
-            self.specPlot.canvas.ax.plot(self.finalSpec[:, 0], (plotSpec/ np.max(plotSpec)))
-        self.specPlot.canvas.ax.axes.get_xaxis().set_visible(True)
-        self.specPlot.canvas.ax.axes.get_yaxis().set_visible(True)
-        self.specPlot.canvas.ax.set_frame_on(True)
-        self.specPlot.canvas.ax.axes.set_xlabel('Wavelength (nm)')
-        self.specPlot.canvas.ax.axes.set_ylabel('Intensity (a.u.)')
-        self.specPlot.canvas.draw()
-        self.FWHM = CalculateFWHM(self.finalSpec[:, 0], plotSpec)
-        self.fwhmText.setText(str(np.round(self.FWHM[0], 2)))
-
-        return plotSpec, np.reshape(self.expSpec[:, 0], (len(plotSpec),)), np.max(self.expSpec[:, 1])
+            canvas.RemoveLine('filter')
+        canvas.SetLabels('Wavelength (nm)', 'Intensity (a.u.)')
+        canvas.Refresh()
+        self.FWHM = results['fwhm']
+        self.fwhmText.setText(str(np.round(self.FWHM, 2)))
+
+    def closeEvent(self, event):
+        self.compute.Shutdown()
+        QMainWindow.closeEvent(self, event)
 
     def UpdateCalPlot(self):
-        self.calPlot.canvas.ax.clear()
-        self.calPlot.canvas.ax.plot(self.specCal[:, 0], self.R / np.max(self.R))
-        self.calPlot.canvas.ax.axes.get_xaxis().set_visible(True)
-        self.calPlot.canvas.ax.axes.get_yaxis().set_visible(True)
-        self.calPlot.canvas.ax.set_frame_on(True)
-        self.calPlot.canvas.ax.axes.set_xlabel('Wavelength (nm)')
-        self.calPlot.canvas.ax.axes.set_ylabel('Intensity (a.u.)')
+        self.calPlot.canvas.SetLine('response', self.specCal.wavelength, self.R / np.max(self.R))
+        self.calPlot.canvas.SetLabels('Wavelength (nm)', 'Intensity (a.u.)')
         self.calFrame.setFrameStyle(QFrame.NoFrame)
-        self.calPlot.canvas.draw()
-
-
-app = QApplication([])
-
-if app.desktop().screen().height() < 720:
-    window = CalibratorApp(UI='FL_ui_mini.ui')
-    window.setWindowFlags(QtCore.Qt.WindowMinimizeButtonHint | QtCore.Qt.WindowCloseButtonHint)
-    window.setWindowIcon(QtGui.QIcon("images/program_icon_square128.ico"))
-    window.setWindowTitle("Spectrum calibrator")
-    window.showMaximized()
-else:
-    window = CalibratorApp(UI='FL_ui.ui')
-    window.setFixedSize(window.size())
-    window.setWindowFlags(QtCore.Qt.WindowMinimizeButtonHint | QtCore.Qt.WindowCloseButtonHint)
-    window.setWindowIcon(QtGui.QIcon("images/program_icon_square128.ico"))
-    window.setWindowTitle("Spectrum calibrator")
-    window.show()
-
-app.exec_()
+        self.calPlot.canvas.Refresh()
+
+
+if __name__ == '__main__':
+    profiler = None
+    if '--profile-startup' in sys.argv:
+        profiler = StartupProfiler(startTime)
+        profiler.Mark('imports')
+    app = QApplication([])
+
+    if app.desktop().screen().height() < 720:
+        window = CalibratorApp(UI='FL_ui_mini.ui')
+        window.setWindowFlags(QtCore.Qt.WindowMinimizeButtonHint | QtCore.Qt.WindowCloseButtonHint)
+        window.setWindowIcon(QtGui.QIcon("images/program_icon_square128.ico"))
+        window.setWindowTitle("Spectrum calibrator")
+        window.showMaximized()
+    else:
+        window = CalibratorApp(UI='FL_ui.ui')
+        window.setFixedSize(window.size())
+        window.setWindowFlags(QtCore.Qt.WindowMinimizeButtonHint | QtCore.Qt.WindowCloseButtonHint)
+        window.setWindowIcon(QtGui.QIcon("images/program_icon_square128.ico"))
+        window.setWindowTitle("Spectrum calibrator")
+        window.show()
+    if profiler is not None:
+        profiler.Mark('window built')
+        profiler.Watch(window)
+        window.responseLoaded.connect(lambda names, response: profiler.Mark('calibration loaded'))
+
+    app.exec_()
@@ -0,0 +1,112 @@
+import argparse
+import glob
+import os
+import sys
+import time as tm
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from calibration import Calibration, CalibratedName, ExportSpectrum, readDefaultNames, calibrationDir
+from calibrationlibrary import CalibrationLibrary, SpectrumDate
+from responsecache import ResponseCache
+from spectrumio import ReadSpectrum
+
+_calibrations = None
+_options = None
+
+
+def _InitWorker(calibrations, options):
+    global _calibrations, _options
+    _calibrations = calibrations
+    _options = options
+
+
+def _ProcessFile(task):
+    filename, key = task
+    try:
+        spectrum = ReadSpectrum(filename, sidecar=_options.sidecar)
+        calibrated, fwhm = _calibrations[key].Process(spectrum)
+        ExportSpectrum(CalibratedName(filename, '.' + _options.format), spectrum[:, 0],
+                       calibrated * np.max(spectrum[:, 1]))
+        return filename, fwhm, None
+    except Exception as error:
+        return filename, np.nan, str(error)
+
+
+def AddCalibrationArguments(parser):
+    expName, theoName = readDefaultNames()
+    parser.add_argument('--experimental', default=os.path.join(calibrationDir, expName),
+                        help='measured lamp spectrum')
+    parser.add_argument('--theoretical', default=os.path.join(calibrationDir, theoName),
+                        help='theoretical lamp spectrum')
+    parser.add_argument('--smooth-response', choices=['savgol', 'box'],
+                        help='smooth the instrument response before use')
+    parser.add_argument('--smooth', action='store_true', help='savgol-smooth every spectrum')
+    parser.add_argument('--filter', nargs=3, type=float, metavar=('CENTER', 'WIDTH', 'EXPONENT'),
+                        help='apply a super-Gaussian filter')
+
+
+def CalibrationFromArguments(args, experimental=None):
+    response = ResponseCache().Get(experimental or args.experimental, args.theoretical, args.smooth_response)
+    calibration = Calibration(response)
+    calibration.smooth = args.smooth
+    if args.filter:
+        calibration.SetFilter(*args.filter)
+    return calibration
+
+
+def ParseArguments(argv=None):
+    parser = argparse.ArgumentParser(description='Calibrate spectra without the GUI.')
+    parser.add_argument('spectra', nargs='+', help='spectrum files or glob patterns')
+    AddCalibrationArguments(parser)
+    parser.add_argument('--format', choices=['txt', 'npy', 'npz'], default='txt',
+                        help='format of the calibrated output files')
+    parser.add_argument('--sidecar', action='store_true',
+                        help='keep a binary .npy copy next to each text spectrum for faster reloads')
+    parser.add_argument('--nearest', action='store_true',
+                        help='calibrate each spectrum with the lamp spectrum of the library closest in time')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = ParseArguments(argv)
+    files = []
+    for pattern in args.spectra:
+        files.extend(sorted(glob.glob(pattern)) or [pattern])
+    files = [file for file in files if not os.path.splitext(file)[0].endswith('_calibrated')
+             and not file.endswith('.txt.npy')]
+
+    # Calibration per file, keyed by lamp spectrum so each is built once
+    if args.nearest:
+        library = CalibrationLibrary(os.path.dirname(args.experimental) or '.', args.theoretical)
+        if not len(library):
+            print('No dated calibrations in ' + library.directory, file=sys.stderr)
+            return 1
+        tasks = [(file, library.Path(library.Nearest(SpectrumDate(file)))) for file in files]
+    else:
+        tasks = [(file, args.experimental) for file in files]
+    calibrations = {key: CalibrationFromArguments(args, key) for key in sorted({key for file, key in tasks})}
+
+    workers = args.workers or os.cpu_count()
+    chunksize = max(1, len(files) // (4 * workers))
+    start = tm.perf_counter()
+    errors = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_InitWorker,
+                             initargs=(calibrations, args)) as pool:
+        for (filename, fwhm, error), (_, key) in zip(pool.map(_ProcessFile, tasks, chunksize=chunksize), tasks):
+            if error:
+                errors += 1
+                print('%s\tError: %s' % (filename, error), file=sys.stderr)
+            elif args.nearest:
+                print('%s\t%.2f\t%s' % (filename, fwhm, os.path.basename(key)))
+            else:
+                print('%s\t%.2f' % (filename, fwhm))
+    elapsed = tm.perf_counter() - start
+
+    print('Processed %d files (%d errors) in %.2f s, %.1f files/s'
+          % (len(files), errors, elapsed, len(files) / elapsed), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
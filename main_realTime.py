@@ -1,115 +1,103 @@
+import time as tm
+startTime = tm.perf_counter()
 from PyQt5.QtWidgets import *
 from PyQt5.QtWidgets import QSystemTrayIcon
-from PyQt5.uic import loadUi
 from PyQt5 import QtCore, QtGui
 import numpy as np
-from tkinter import Tk
-from tkinter.filedialog import askopenfilename
-from scipy.signal import savgol_filter
-from scipy.fft import fftshift, ifft, fftfreq
-from seabreeze.spectrometers import Spectrometer, list_devices
-
-import psutil
+import calibration
+from calibration import ReadDefaultFiles
+from decimation import RoiSlice
+from responsecache import ResponseCache
+from spectrum import Spectrum
+from calibrationlibrary import CalibrationLibrary, SpectrumDate
+from resample import Resample
+from pipeline import SpectrumPipeline
+from acquisition import AcquisitionWorker, ReplaySpectrometer
+from recorder import Recorder
+from startup import LoadUi, StartupProfiler
+from computeworker import ComputeWorker
+from statuspanel import InstallRoiPanel, InstallStatusPanel, InstallTrackingPanel
+from profiling import Measure
+
+import os
+import sys
+import traceback
 import warnings
-import time as tm
 import matplotlib
-import matplotlib.pyplot as plt
 
 warnings.filterwarnings("error")
 # Ensure using PyQt5 backend
 matplotlib.use('QT5Agg')
 
 
-def readDefaultNames():
-    f = open('calibrationData\defaultFiles.txt', 'r')
-    expName = f.readline().split(":")[1]
-    expName = expName.split("\n")[0]
-    theoName = f.readline().split(":")[1]
-    f.close()
-    return expName, theoName
-
-
-def LoadFile(filename=None, field=None):
-    if filename is None:
-        Tk().withdraw()
-        filename = askopenfilename()
-    file = np.loadtxt(filename)
-    if field:
-        field.setText(filename)
-    return file
-
-
-def CalculateFWHM(wavelength, intensity):
-
-    c = 3e2
-    freq = 2*np.pi*c/wavelength
-
-    dw = (freq[0]-freq[-1])/len(freq)
-    newFreq = np.arange(0, 50*freq[0], dw)
-    wSpec = np.interp(newFreq, np.flip(freq), np.flip(intensity*(wavelength**2 /(2*np.pi*c))), left=1e-10, right=1e-10)
-    pulse = np.fft.fftshift(np.fft.ifft(np.sqrt(np.abs(wSpec))))
-    pulse = np.abs(pulse)**2 / np.max(np.abs(pulse)**2)
-
-
-    try:
-        time = np.arange(-np.pi/dw, np.pi/dw, 2*np.pi*50*freq[0])
-        time = np.fft.fftshift(np.fft.fftfreq(len(pulse), dw/(2*np.pi)))
-
-        izqPulse = np.abs(pulse[0:int(len(pulse)/2)]-0.5)
-        izqTime = time[0:int(len(pulse)/2)]
-        derPulse = np.abs(pulse[int(len(pulse)/2):len(pulse)]-0.5)
-        derTime = time[int(len(pulse)/2):]
-
-        minIzqPulse = np.where(izqPulse == np.min(izqPulse))[0]
-        minDerPulse = np.where(derPulse == np.min(derPulse))[0]
-
-        return derTime[minDerPulse] - izqTime[minIzqPulse]
-
-    except RuntimeWarning:
-        return 'Error'
-
-def SmoothSpec(spec, boxPoints):
-    # boxPoints = 10
-    box = np.ones(boxPoints) / boxPoints
-    smoothSpec = np.convolve(spec, box, mode='same')
-    return smoothSpec
+def AskFilename():
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilename
+    Tk().withdraw()
+    return askopenfilename()
 
 
 class CalibratorApp(QMainWindow):
+    # Emitted with the file names and the response once a calibration is in use
+    responseLoaded = QtCore.pyqtSignal(object, object)
 
     def __init__(self, UI):
         QMainWindow.__init__(self)
-        loadUi(UI, self)
+        LoadUi(UI, self)
         self.show()
         self.specButton.clicked.connect(self.loadSpectrum)
         self.smoothSpecButton.clicked.connect(self.SmoothSpec)
         self.exportButton.clicked.connect(self.ExportSpec)
 
-        if psutil.cpu_count() < 16:
-            self.smoothButton.clicked.connect(self.SmoothSignalCalibration_LowResources)
-        else:
-            self.smoothButton.clicked.connect(self.SmoothSignalCalibration)
+        # Same filter on every machine, smoothing picks the fastest way to apply it
+        self.smoothButton.clicked.connect(self.SmoothSignalCalibration)
 
         self.filterCheckButton.toggled.connect(self.ToggleFilter)
         self.centerText.editingFinished.connect(self.UpdatePlot)
         self.widthText.editingFinished.connect(self.UpdatePlot)
         self.exponentText.editingFinished.connect(self.UpdatePlot)
+        # Redraw while typing, once the user pauses
+        self.plotTimer = QtCore.QTimer(self)
+        self.plotTimer.setSingleShot(True)
+        self.plotTimer.setInterval(150)
+        self.plotTimer.timeout.connect(self.UpdatePlot)
+        self.centerText.textEdited.connect(self.plotTimer.start)
+        self.widthText.textEdited.connect(self.plotTimer.start)
+        self.exponentText.textEdited.connect(self.plotTimer.start)
+        self.expButton.clicked.connect(lambda: self.LoadCalibration(self.expText))
+        self.theoLoad.clicked.connect(lambda: self.LoadCalibration(self.theoText))
         self.scanButton.clicked.connect(self.GetDevices)
         self.usbMenu.textActivated.connect(self.SelectDevice)
+        self.playButtonRT.clicked.connect(self.StartAcquisition)
+        self.pauseButtonRT.clicked.connect(self.StopAcquisition)
+        self.acctimeTextRT.editingFinished.connect(self.SetIntegrationTime)
+        self.saveButtonRT.clicked.connect(self.ToggleRecording)
+        self.bgndButtonRT.clicked.connect(self.TakeDark)
+        self.deleteCheckRT.toggled.connect(self.ConfigureProcessor)
+        self.calibrateCheckRT.toggled.connect(self.ConfigureProcessor)
+        self.boxcarBox.valueChanged.connect(self.ConfigureProcessor)
 
         # self.smoothButtonRT.setToolTip('Smooth spectrum')
-        self.saveButtonRT.setToolTip('Save spectrum')
+        self.saveButtonRT.setToolTip('Record spectra')
         self.bgndButtonRT.setToolTip('Take dark spectrum')
-
-
-        expName, theoName = readDefaultNames()
-
-        try:
-            self.expText.setText('calibrationData/' + expName)
-            self.specCal = LoadFile(filename=self.expText.text())
-            self.theoCal = LoadFile(filename=self.theoText.text())
-        except:
-            pass
+        self.playButtonRT.setToolTip('Start acquisition')
+        self.pauseButtonRT.setToolTip('Pause acquisition')
+
+
+        # Without a default lamp spectrum the newest one of the calibration
+        # library is used, once the library has been indexed in the background
+        expName = ReadDefaultFiles().get('experimental')
+        self.expText.setText('calibrationData/' + expName if expName else '')
+        self.responseCache = ResponseCache()
+        # Loading, smoothing, the spectrum pipeline and export run here, so the
+        # event loop only ever draws
+        self.compute = ComputeWorker(parent=self)
+        # Indexed on the loader thread; picks the calibration for each loaded
+        # spectrum until one is chosen by hand
+        self.library = None
+        self.autoCalibration = True
+        self.specCal = []
+        self.theoCal = []
 
         self.finalSpec = []
         self.expSpec = []
@@ -119,56 +107,162 @@ class CalibratorApp(QMainWindow):
         self.multiplyR = []
         self.calibratedSpec = []
         self.filter = []
+        self.filterParameters = None
+        self.pipeline = SpectrumPipeline()
         self.FWHM = []
 
         self.devices = []
-        try:
-            self.CalculateResponse()
-        except:
-            pass
+        self.usb = []
+        self.worker = None
+        self.recorder = None
+        # Port or Unix socket path given with --serve, see spectrumserver.py
+        self.serveAddress = None
+        self.server = None
+        self.liveFrame = []
+        # Last accepted integration time, put back when an invalid one is typed
+        self.integrationTimeText = ''
+        # The default calibration is read once the window is on screen
+        QtCore.QTimer.singleShot(0, self.RequestResponse)
+        self.statusPanel = InstallStatusPanel(self)
+        self.trackingPanel = InstallTrackingPanel(self)
+        self.roiPanel = InstallRoiPanel(self)
+        self.roiPanel.changed.connect(self.SetRoi)
+        # While tracking, the plot is redrawn at most this often so the reader
+        # thread keeps the CPU for the per-frame metrics
+        self.trackingDrawInterval = 0.1
+        self.lastDraw = 0
+        self.drawTimer = QtCore.QTimer(self)
+        self.drawTimer.setSingleShot(True)
+        self.drawTimer.timeout.connect(self.DrawFrame)
 
     def loadSpectrum(self):
-        try:
-            spectrum = LoadFile(field=self.specText)
-            self.expSpec = spectrum
-            self.expSpec_mod = spectrum
-            self.finalSpec = spectrum
-            self.specFrame.setFrameStyle(QFrame.NoFrame)
+        filename = AskFilename()
+        if not filename:
+            return
+        self.specText.setText(filename)
+        self.compute.Submit('load', lambda job, name: Spectrum.Load(name), filename,
+                            onResult=self.SpectrumLoaded, onError=self.SpectrumFailed)
+
+    def SpectrumLoaded(self, spectrum):
+        # Copies share the data until edited, the loaded spectrum stays untouched.
+        # A smoothing of the previous spectrum must not replace this one.
+        self.compute.Cancel('smooth')
+        self.expSpec = spectrum
+        self.expSpec_mod = spectrum.Copy()
+        self.finalSpec = spectrum.Copy()
+        self.ChooseCalibration(spectrum, self.specText.text())
+        self.specFrame.setFrameStyle(QFrame.NoFrame)
+        self.UpdatePlot()
+        self.smoothSpecButton.setEnabled(True)
+        self.filterCheckButton.setEnabled(True)
+        self.exportButton.setEnabled(True)
+
+    def SpectrumFailed(self, error):
+        self.specText.setText("Wrong file format")
+        self.ShowError('Spectrum not loaded', error)
+
+    def RequestResponse(self):
+        if self.library is None and not self.compute.Busy('library'):
+            # Built once on its own lane, so later loads do not supersede it
+            self.compute.Submit('library', lambda job: CalibrationLibrary(responseCache=self.responseCache),
+                                onResult=self.LibraryLoaded,
+                                onError=lambda error: self.ShowError('Calibration library not loaded', error))
+        names = (self.expText.text(), self.theoText.text())
+        if not names[0]:
+            # LibraryLoaded picks the lamp spectrum once the library is there
+            if self.library is not None:
+                self.ShowError('Calibration not loaded', OSError('No calibration spectra'))
+            return
+        # A request for other files supersedes one still loading
+        self.compute.Submit('response', self._LoadResponse, *names,
+                            onResult=lambda response: self.ResponseLoaded(names, response),
+                            onError=lambda error: self.ShowError('Calibration not loaded', error))
+
+    def _LoadResponse(self, job, expName, theoName):
+        return self.responseCache.Get(expName, theoName)
+
+    def LibraryLoaded(self, library):
+        self.library = library
+        if not self.expText.text():
+            newest = library.Newest()
+            if newest is None:
+                self.ShowError('Calibration not loaded', OSError('No calibration spectra in ' + library.directory))
+                return
+            self.expText.setText(library.Path(newest))
+            self.RequestResponse()
+        # A spectrum loaded meanwhile gets its calibration now
+        if len(self.expSpec):
+            self.ChooseCalibration(self.expSpec, self.specText.text())
+
+    def ResponseLoaded(self, names, response):
+        self.SetResponse(response)
+        if len(self.finalSpec):
             self.UpdatePlot()
-            CalculateFWHM(spectrum[:, 0], spectrum[:, 1])
-            self.smoothSpecButton.setEnabled(True)
-            self.filterCheckButton.setEnabled(True)
-            self.exportButton.setEnabled(True)
-
-        except:
-            self.specText.setText("Wrong file format")
-            pass
-
-    def CalculateResponse(self):
-        self.interpTheoCal = np.interp(self.specCal[:, 0], self.theoCal[:, 0], self.theoCal[:, 1])
-        self.R = np.divide(np.abs(self.specCal[:, 1]),
-                           np.abs(self.interpTheoCal),
-                           where=self.interpTheoCal != 0)
-        self.R = self.R / np.max(self.R)
-        self.multiplyR = np.divide(1, self.R, where=self.R != 0)
+        self.responseLoaded.emit(names, response)
+
+    def ChooseCalibration(self, spectrum, filename):
+        # Switches to the lamp spectrum measured closest in time to the spectrum
+        if not self.autoCalibration or self.library is None:
+            return
+        try:
+            nearest = self.library.Nearest(SpectrumDate(filename), wavelength=spectrum.wavelength)
+        except OSError:
+            return
+        if nearest is not None and self.library.Path(nearest) != self.expText.text():
+            self.expText.setText(self.library.Path(nearest))
+            self.statusBar().showMessage('Using calibration ' + nearest['name'] + ', nearest in time', 8000)
+            self.RequestResponse()
+
+    def ShowError(self, message, error):
+        # Failures go to the status bar and the console instead of being dropped
+        self.statusBar().showMessage('%s: %s' % (message, error), 8000)
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+    def SetResponse(self, response):
+        # Nor a smoothing of the previous response this one
+        self.compute.Cancel('smoothResponse')
+        self.specCal = Spectrum.FromArray(response['specCal'])
+        self.theoCal = Spectrum.FromArray(response['theoCal'])
+        self.interpTheoCal = response['interpTheoCal']
+        self.R = response['R']
+        self.multiplyR = response['multiplyR']
         self.UpdateCalPlot()
 
-    def SuperGaussianFilter(self):
+    def LoadCalibration(self, field):
+        filename = AskFilename()
+        if filename:
+            field.setText(filename)
+            if field is self.expText:
+                self.autoCalibration = False
+            self.RequestResponse()
+
+    def FilterParameters(self):
+        # (center, width, exponent), or None with the filter off
+        if not self.filterCheckButton.isChecked():
+            return None
         try:
             self.filterCounter = 1
             center = float(self.centerText.text())
             width = float(self.widthText.text())
             exponent = int(self.exponentText.text())
-            self.filter = np.exp(-((self.expSpec[:, 0] - center) / width) ** exponent)
-        except:
-            pass
+            self.filterParameters = (center, width, exponent)
+        except ValueError:
+            # Keeps the previous filter while a field is being edited
+            self.statusBar().showMessage('Invalid filter parameters', 3000)
+        return self.filterParameters
 
     def SmoothSpec(self):
-        try:
-            self.finalSpec[:, 1] = savgol_filter(self.finalSpec[:, 1], 21, 3)
-            self.UpdatePlot()
-        except:
-            pass
+        # Clicks made while a smoothing runs are merged into it
+        if not len(self.finalSpec):
+            return
+        self.compute.Submit('smooth', lambda job, spectrum:
+                            spectrum.WithIntensity(calibration.SmoothSpectrum(spectrum.intensity)),
+                            self.finalSpec, onResult=self.SpectrumSmoothed,
+                            onError=lambda error: self.ShowError('Smoothing failed', error))
+
+    def SpectrumSmoothed(self, spectrum):
+        self.finalSpec = spectrum
+        self.UpdatePlot()
 
     def ToggleFilter(self):
         if self.filterCheckButton.isChecked():
@@ -182,126 +276,296 @@ class CalibratorApp(QMainWindow):
 
         self.UpdatePlot()
     def SmoothSignalCalibration(self):
-        try:
-            self.R = savgol_filter(self.R, 21, 3)
-            self.multiplyR = np.divide(1, self.R, where=self.R != 0)
-        except:
-            pass
-        self.UpdateCalPlot()
-
-    def SmoothSignalCalibration_LowResources(self):
-        boxPoints = 10
-        box = np.ones(boxPoints) / boxPoints
-        self.R = np.convolve(self.R, box, mode='same')
-        self.multiplyR = np.divide(1, self.R, where=self.R != 0)
+        if not len(self.R):
+            return
+        self.compute.Submit('smoothResponse', lambda job, R: calibration.SmoothResponse(R), self.R,
+                            onResult=self.ResponseSmoothed,
+                            onError=lambda error: self.ShowError('Smoothing failed', error))
+
+    def ResponseSmoothed(self, R):
+        self.R = R
+        self.multiplyR = calibration.InverseResponse(self.R)
         self.UpdateCalPlot()
 
     def ExportSpec(self):
-        try:
-            specNew, wavelength, norm = self.UpdatePlot()
-            tm.sleep(0.5)
-            spec = np.stack((wavelength, specNew*norm)).T
-            np.savetxt(self.specText.text().split('.')[0]+'_calibrated.txt', spec,'%.4f')
-            self.exportLabel.setText('Saved!')
-        except:
-            self.exportLabel.setText('Try again')
+        if not len(self.finalSpec):
+            return
+        self.exportLabel.setText('Saving...')
+        self.compute.Submit('export', self._Export, calibration.CalibratedName(self.specText.text()),
+                            self._Parameters(), np.max(self.expSpec.intensity), self.roiPanel.Roi(),
+                            onResult=lambda filename: self.exportLabel.setText('Saved!'),
+                            onError=self.ExportFailed)
+
+    def _Export(self, job, filename, params, norm, roi):
+        results = self.pipeline.Evaluate(params, ('wavelength', 'calibrated'), job.Check)
+        job.Check()
+        crop = RoiSlice(results['wavelength'], roi)
+        calibration.ExportSpectrum(filename, results['wavelength'][crop], results['calibrated'][crop] * norm,
+                                   '%.4f')
+        return filename
+
+    def SetRoi(self, roi):
+        # Spectrum plots are cut to the ROI, the calibration plot is not
+        self.specPlot.canvas.SetRoi(roi)
+        self.realtimePlot.canvas.SetRoi(roi)
+        self.UpdatePlot()
+
+    def ExportFailed(self, error):
+        self.exportLabel.setText('Try again')
+        self.ShowError('Export failed', error)
 
     def GetDevices(self):
-        self.devices = list_devices()
+        # seabreeze loads the USB backends, only done when devices are scanned
+        try:
+            from seabreeze.spectrometers import list_devices
+            self.devices = list_devices()
+        except ImportError:
+            self.devices = []
         if self.devices:
             list = ['Select device']
             for device in self.devices:
                 list.append(str(device))
         else:
             list = ['No device available']
+        list.append('Replay calibration files')
         self.usbMenu.clear()
         self.usbMenu.addItems(list)
 
     def SelectDevice(self):
+        self.StopAcquisition()
         value = self.usbMenu.currentIndex() - 1
-        if value > -1:
+        if value == len(self.devices):
+            self.usb = ReplaySpectrometer()
+        elif value > -1:
             try:
+                from seabreeze.spectrometers import Spectrometer
                 self.usb = Spectrometer(self.devices[value])
-            except:
-                pass
+            except Exception as error:
+                # seabreeze raises its own errors for busy or unplugged devices
+                self.usb = []
+                self.ShowError('Device not opened', error)
         else:
             self.usb = []
 
         try:
             self.GetSpectrum()
             self.realtimeFrame.setFrameStyle(QFrame.NoFrame)
-        except:
-            self.realtimePlot.canvas.ax.clear()
-            self.realtimePlot.canvas.draw()
+        except Exception as error:
+            self.realtimePlot.canvas.Clear()
+            if self.usb:
+                self.ShowError('No spectrum from device', error)
 
     def GetSpectrum(self):
         wavelengths = self.usb.wavelengths()
-        intensities = self.usb.intensities()
-        self.realtimePlot.canvas.ax.plot(wavelengths, intensities)
-        self.realtimePlot.canvas.ax.axes.get_xaxis().set_visible(True)
-        self.realtimePlot.canvas.ax.axes. get_yaxis().set_visible(True)
-        self.realtimePlot.canvas.ax.set_frame_on(True)
-        self.realtimePlot.canvas.ax.axes.set_xlabel('Wavelength (nm)')
-        self.realtimePlot.canvas.ax.axes.set_ylabel('Intensity (a.u.)')
-        self.realtimePlot.canvas.draw()
+        with Measure('usb read'):
+            intensities = self.usb.intensities()
+        self.realtimePlot.canvas.SetLine('live', wavelengths, intensities)
+        self.realtimePlot.canvas.SetLabels('Wavelength (nm)', 'Intensity (a.u.)')
+        self.realtimePlot.canvas.Refresh()
+
+    def StartAcquisition(self):
+        if not self.usb or self.worker is not None:
+            return
+        self.worker = AcquisitionWorker(self.usb)
+        self.liveFrame = np.empty(len(self.worker.wavelengths))
+        self.worker.frameReady.connect(self.DrawFrame)
+        self.worker.error.connect(self.AcquisitionFailed)
+        self.realtimePlot.canvas.ShowFPS()
+        self.SetIntegrationTime()
+        self.ConfigureProcessor()
+        self.trackingPanel.Apply(self.worker)
+        self.worker.start()
+        if self.serveAddress:
+            self.StartServer()
+
+    def StartServer(self):
+        from spectrumserver import SpectrumServer
+        try:
+            if self.serveAddress.isdigit():
+                self.server = SpectrumServer(self.worker, port=int(self.serveAddress)).Start()
+            else:
+                self.server = SpectrumServer(self.worker, path=self.serveAddress).Start()
+            self.statusBar().showMessage('Streaming spectra on ' + self.serveAddress, 8000)
+        except OSError as error:
+            self.ShowError('Spectrum server not started', error)
+
+    def StopAcquisition(self):
+        self.StopRecording()
+        if self.server is not None:
+            self.server.Stop()
+            self.server = None
+        if self.worker is not None:
+            self.worker.Stop()
+            self.worker = None
+            self.trackingPanel.Apply(None)
+
+    def AcquisitionFailed(self, error):
+        # The reader thread has ended; stopping closes any recording in progress
+        self.StopAcquisition()
+        self.ShowError('Acquisition stopped', error)
+
+    def ToggleRecording(self):
+        if self.recorder is not None:
+            self.StopRecording()
+            return
+        if self.worker is None:
+            return
+        multiplyR = None
+        if self.calibrateCheckRT.isChecked() and len(self.multiplyR):
+            multiplyR = Resample(self.specCal.wavelength, self.multiplyR, self.worker.wavelengths)
+        path = os.path.join('recordings', tm.strftime('%Y%m%d_%H%M%S'))
+        try:
+            self.recorder = Recorder(self.worker, path, multiplyR=multiplyR, roi=self.roiPanel.Roi())
+        except ValueError as error:
+            self.ShowError('Recording not started', error)
+            return
+        self.recorder.start()
+        self.saveButtonRT.setToolTip('Stop recording (' + path + ')')
+
+    def StopRecording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.Stop()
+            self.saveButtonRT.setToolTip('Record spectra')
+            if recorder.exception is not None:
+                self.ShowError('Recording stopped', recorder.exception)
+
+    def SetIntegrationTime(self):
+        text = self.acctimeTextRT.text().strip()
+        if not text:
+            return
+        # seabreeze devices report their range, the others accept from 1 us
+        low, high = getattr(self.usb, 'integration_time_micros_limits', None) or (1, np.inf)
+        try:
+            micros = float(text) * 1e3
+            if not low <= micros <= high:
+                raise ValueError('%s ms is outside %g-%g ms' % (text, low / 1e3, high / 1e3))
+        except ValueError as error:
+            self.ShowError('Integration time not set', error)
+            self.acctimeTextRT.setText(self.integrationTimeText)
+            return
+        self.integrationTimeText = text
+        if self.worker is not None:
+            self.worker.SetIntegrationTime(micros)
+        elif self.usb:
+            self.usb.integration_time_micros(int(micros))
+
+    def TakeDark(self):
+        # Averaged over at least ten frames, taken by the reader thread
+        if self.worker is not None:
+            self.worker.processor.CaptureDark(max(10, self.boxcarBox.value()))
+
+    def ConfigureProcessor(self):
+        if self.worker is None:
+            return
+        processor = self.worker.processor
+        processor.SetSubtractDark(self.deleteCheckRT.isChecked())
+        processor.SetAverage(self.boxcarBox.value())
+        response = None
+        if self.calibrateCheckRT.isChecked() and len(self.multiplyR):
+            response = Resample(self.specCal.wavelength, self.multiplyR, self.worker.wavelengths)
+        processor.SetResponse(response)
+
+    def DrawFrame(self):
+        if self.worker is None:
+            return
+        wait = self.lastDraw + self.trackingDrawInterval - tm.perf_counter()
+        if self.trackingPanel.Tracking() and wait > 0:
+            # The worker keeps its frame pending, so no signals pile up meanwhile
+            if not self.drawTimer.isActive():
+                self.drawTimer.start(int(wait * 1e3) + 1)
+            return
+        if self.recorder is not None and not self.recorder.is_alive():
+            # The recorder ended on an error
+            self.StopRecording()
+        if self.worker.Latest(self.liveFrame) is None:
+            return
+        self.lastDraw = tm.perf_counter()
+        self.realtimePlot.canvas.SetLine('live', self.worker.wavelengths, self.liveFrame)
+        self.realtimePlot.canvas.SetLabels('Wavelength (nm)', 'Intensity (a.u.)')
+        self.realtimePlot.canvas.Refresh()
+
+    def closeEvent(self, event):
+        self.StopAcquisition()
+        self.compute.Shutdown()
+        QMainWindow.closeEvent(self, event)
+
+    def _Parameters(self):
+        params = {'spectrum': self.finalSpec, 'filter': self.FilterParameters()}
+        if len(self.specCal):
+            params['calWavelength'] = self.specCal.wavelength
+            params['multiplyR'] = self.multiplyR
+        return params
 
     def UpdatePlot(self):
+        # Computed on the compute pool and drawn by DrawSpectrum; an edit made
+        # meanwhile supersedes this one. Only the stages downstream of whatever
+        # changed are recomputed.
         self.exportLabel.setText(' ')
-        try:
-            plotSpec = self.finalSpec[:, 1] * self.multiplyR
-        except:
-            plotSpec = np.abs(self.finalSpec[:, 1]) / np.max(self.finalSpec[:, 1])
-        self.specPlot.canvas.ax.clear()
-        self.specPlot.canvas.ax.plot(self.expSpec[:, 0], np.abs(self.expSpec[:, 1]) / np.max(self.expSpec[:, 1]))
-        if self.filterCheckButton.isChecked():
-            self.SuperGaussianFilter()
-            plotSpec = self.filter*(plotSpec/np.max(plotSpec))
-            self.specPlot.canvas.ax.plot(self.finalSpec[:, 0], (plotSpec/np.max(plotSpec)))
-            self.specPlot.canvas.ax.plot(self.finalSpec[:, 0], self.filter)
+        if not len(self.finalSpec):
+            return
+        self.compute.Submit('spectrum', self._Evaluate, self._Parameters(),
+                            ('wavelength', 'raw', 'normalised', 'filterCurve', 'fwhm'),
+                            onResult=self.DrawSpectrum,
+                            onError=lambda error: self.ShowError('Calculation failed', error))
+
+    def _Evaluate(self, job, params, names):
+        return self.pipeline.Evaluate(params, names, job.Check)
+
+    def DrawSpectrum(self, results):
+        wavelength = results['wavelength']
+        self.filter = results['filterCurve']
+        canvas = self.specPlot.canvas
+        canvas.SetLine('raw', wavelength, results['raw'], color='C0')
+        canvas.SetLine('calibrated', wavelength, results['normalised'], color='C1')
+        if self.filter is not None:
+            canvas.SetLine('filter', wavelength, self.filter, color='C2')
         else:
-            self.specPlot.canvas.ax.plot(self.finalSpec[:, 0], (plotSpec/ np.max(plotSpec)))
-        self.specPlot.canvas.ax.axes.get_xaxis().set_visible(True)
-        self.specPlot.canvas.ax.axes.get_yaxis().set_visible(True)
-        self.specPlot.canvas.ax.set_frame_on(True)
-        self.specPlot.canvas.ax.axes.set_xlabel('Wavelength (nm)')
-        self.specPlot.canvas.ax.axes.set_ylabel('Intensity (a.u.)')
-        self.specPlot.canvas.draw()
-        self.FWHM = CalculateFWHM(self.finalSpec[:, 0], plotSpec)
-        self.fwhmText.setText(str(np.round(self.FWHM[0], 2)))
-
-        return plotSpec, np.reshape(self.expSpec[:, 0], (len(plotSpec),)), np.max(self.expSpec[:, 1])
+            canvas.RemoveLine('filter')
+        canvas.SetLabels('Wavelength (nm)', 'Intensity (a.u.)')
+        canvas.Refresh()
+        self.FWHM = results['fwhm']
+        self.fwhmText.setText(str(np.round(self.FWHM, 2)))
 
     def UpdateCalPlot(self):
-        self.calPlot.canvas.ax.clear()
-        self.calPlot.canvas.ax.plot(self.specCal[:, 0], self.R / np.max(self.R))
-        self.calPlot.canvas.ax.axes.get_xaxis().set_visible(True)
-        self.calPlot.canvas.ax.axes.get_yaxis().set_visible(True)
-        self.calPlot.canvas.ax.set_frame_on(True)
-        self.calPlot.canvas.ax.axes.set_xlabel('Wavelength (nm)')
-        self.calPlot.canvas.ax.axes.set_ylabel('Intensity (a.u.)')
+        self.calPlot.canvas.SetLine('response', self.specCal.wavelength, self.R / np.max(self.R))
+        self.calPlot.canvas.SetLabels('Wavelength (nm)', 'Intensity (a.u.)')
         self.calFrame.setFrameStyle(QFrame.NoFrame)
-        self.calPlot.canvas.draw()
-
-
-app = QApplication([])
-
-if app.desktop().screen().height() < 720:
-    window = CalibratorApp(UI='FL_ui_mini.ui')
-    window.setWindowFlags(QtCore.Qt.WindowMinimizeButtonHint | QtCore.Qt.WindowCloseButtonHint)
-    window.showMaximized()
-else:
-    window = CalibratorApp(UI='FL_realTime_ui.ui')
-    window.setFixedSize(window.size())
-    window.setWindowFlags(QtCore.Qt.WindowMinimizeButtonHint | QtCore.Qt.WindowCloseButtonHint)
-    window.show()
-
-
-app_icon = QtGui.QIcon()
-app_icon.addFile('images/program_icon_square16.png', QtCore.QSize(16, 16))
-app_icon.addFile('images/program_icon_square32.png', QtCore.QSize(32, 32))
-app_icon.addFile('images/program_icon_square64.png', QtCore.QSize(64, 64))
-app_icon.addFile('images/program_icon_square128.png', QtCore.QSize(128, 128))
-app_icon.addFile('images/program_icon_square256.png', QtCore.QSize(256, 256))
-app.setWindowIcon(app_icon)
-
-app.exec_()
+        self.calPlot.canvas.Refresh()
+        self.ConfigureProcessor()
+
+
+if __name__ == '__main__':
+    profiler = None
+    if '--profile-startup' in sys.argv:
+        profiler = StartupProfiler(startTime)
+        profiler.Mark('imports')
+    serveAddress = None
+    if '--serve' in sys.argv[:-1]:
+        serveAddress = sys.argv[sys.argv.index('--serve') + 1]
+    app = QApplication([])
+
+    if app.desktop().screen().height() < 720:
+        window = CalibratorApp(UI='FL_ui_mini.ui')
+        window.setWindowFlags(QtCore.Qt.WindowMinimizeButtonHint | QtCore.Qt.WindowCloseButtonHint)
+        window.showMaximized()
+    else:
+        window = CalibratorApp(UI='FL_realTime_ui.ui')
+        window.setFixedSize(window.size())
+        window.setWindowFlags(QtCore.Qt.WindowMinimizeButtonHint | QtCore.Qt.WindowCloseButtonHint)
+        window.show()
+    window.serveAddress = serveAddress
+    if profiler is not None:
+        profiler.Mark('window built')
+        profiler.Watch(window)
+        window.responseLoaded.connect(lambda names, response: profiler.Mark('calibration loaded'))
+
+    app_icon = QtGui.QIcon()
+    app_icon.addFile('images/program_icon_square16.png', QtCore.QSize(16, 16))
+    app_icon.addFile('images/program_icon_square32.png', QtCore.QSize(32, 32))
+    app_icon.addFile('images/program_icon_square64.png', QtCore.QSize(64, 64))
+    app_icon.addFile('images/program_icon_square128.png', QtCore.QSize(128, 128))
+    app_icon.addFile('images/program_icon_square256.png', QtCore.QSize(256, 256))
+    app.setWindowIcon(app_icon)
+
+    app.exec_()
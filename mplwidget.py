@@ -1,9 +1,13 @@
 # Imports
+from collections import deque
+import time as tm
+import numpy as np
 from PyQt5 import QtWidgets
+from profiling import Timed
+from decimation import MinMaxBinner
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as Canvas
 import matplotlib
-import matplotlib.pyplot as plt
 
 # Ensure using PyQt5 backend
 matplotlib.use('QT5Agg')
@@ -19,6 +23,144 @@ class MplCanvas(Canvas):
         Canvas.setSizePolicy(self, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
         Canvas.updateGeometry(self)
 
+        # Persistent lines are animated: a full draw only renders the static background,
+        # which is cached and restored before blitting the lines on top of it
+        self.lines = {}
+        self.fps = 0.0
+        self.fpsText = None
+        self._background = None
+        self._fullDraw = True
+        self._labels = None
+        self._frameTimes = deque(maxlen=30)
+        # Lines are cut to the ROI (nm) and binned to the canvas width before
+        # they reach matplotlib, so drawing cost does not grow with the detector
+        self.roi = None
+        self._binners = {}
+        self.mpl_connect('draw_event', self._OnDraw)
+
+    def _OnDraw(self, event):
+        self._background = self.copy_from_bbox(self.fig.bbox)
+        self._DrawLines()
+
+    def _DrawLines(self):
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+        if self.fpsText is not None:
+            self.ax.draw_artist(self.fpsText)
+
+    def SetLabels(self, xlabel, ylabel):
+        if self._labels == (xlabel, ylabel):
+            return
+        self._labels = (xlabel, ylabel)
+        self.ax.axes.get_xaxis().set_visible(True)
+        self.ax.axes.get_yaxis().set_visible(True)
+        self.ax.set_frame_on(True)
+        self.ax.axes.set_xlabel(xlabel)
+        self.ax.axes.set_ylabel(ylabel)
+        self._fullDraw = True
+
+    def ShowFPS(self, show=True):
+        if show and self.fpsText is None:
+            self.fpsText = self.ax.text(0.98, 0.95, '', transform=self.ax.transAxes,
+                                        ha='right', va='top', animated=True)
+        elif not show and self.fpsText is not None:
+            self.fpsText.remove()
+            self.fpsText = None
+        self._fullDraw = True
+
+    def _Binner(self, key, x):
+        # One binner per line, rebuilt when its axis, the ROI or the width changes
+        bins = max(1, int(self.width() * self.devicePixelRatioF()))
+        source, binner = self._binners.get(key, (None, None))
+        if binner is not None and binner.bins == bins and (source is x or (
+                len(source) == len(x) and np.array_equal(source, x))):
+            return binner
+        try:
+            binner = MinMaxBinner(x, bins, self.roi)
+        except ValueError:
+            # Lines outside the ROI are shown whole
+            binner = MinMaxBinner(x, bins)
+        self._binners[key] = (x, binner)
+        return binner
+
+    def SetRoi(self, roi):
+        # Applies to the lines set from now on
+        if roi != self.roi:
+            self.roi = roi
+            self._binners = {}
+            self._fullDraw = True
+
+    def SetLine(self, key, x, y, **kwargs):
+        binner = self._Binner(key, x)
+        x, y = binner.x, binner(y)
+        line = self.lines.get(key)
+        if line is None:
+            self.lines[key] = self.ax.plot(x, y, animated=True, **kwargs)[0]
+            self._fullDraw = True
+        elif len(line.get_xdata()) != len(x) or not np.array_equal(line.get_xdata(), x):
+            line.set_data(x, y)
+            self._fullDraw = True
+        else:
+            line.set_ydata(y)
+
+    def RemoveLine(self, key):
+        self._binners.pop(key, None)
+        line = self.lines.pop(key, None)
+        if line is not None:
+            line.remove()
+            self._fullDraw = True
+
+    def Clear(self):
+        self.ax.clear()
+        self.lines = {}
+        self._binners = {}
+        self.fpsText = None
+        self._labels = None
+        self.ax.axes.get_xaxis().set_visible(False)
+        self.ax.axes.get_yaxis().set_visible(False)
+        self.ax.set_frame_on(False)
+        self._fullDraw = True
+        self.draw()
+
+    def _UpdateLimits(self):
+        # Only rescale when the data leaves the view or shrinks to less than half of it,
+        # so noisy live frames do not force a full redraw every time
+        xmin, xmax, ymin, ymax = np.inf, -np.inf, np.inf, -np.inf
+        for line in self.lines.values():
+            x, y = line.get_xdata(), line.get_ydata()
+            xmin, xmax = min(xmin, np.min(x)), max(xmax, np.max(x))
+            ymin, ymax = min(ymin, np.min(y)), max(ymax, np.max(y))
+        if not (np.isfinite(ymin) and np.isfinite(ymax)):
+            return
+        bottom, top = self.ax.get_ylim()
+        if (xmin, xmax) != self.ax.get_xlim():
+            self.ax.set_xlim(xmin, xmax)
+            self._fullDraw = True
+        if ymin < bottom or ymax > top or (ymax - ymin) < 0.5 * (top - bottom):
+            margin = 0.05 * (ymax - ymin) or 1.0
+            self.ax.set_ylim(ymin - margin, ymax + margin)
+            self._fullDraw = True
+
+    @Timed('draw')
+    def Refresh(self):
+        if self.lines:
+            self._UpdateLimits()
+
+        now = tm.perf_counter()
+        self._frameTimes.append(now)
+        if len(self._frameTimes) > 1:
+            self.fps = (len(self._frameTimes) - 1) / (now - self._frameTimes[0])
+        if self.fpsText is not None:
+            self.fpsText.set_text('%.1f fps' % self.fps)
+
+        if self._fullDraw or self._background is None:
+            self._fullDraw = False
+            self.draw()
+        else:
+            self.restore_region(self._background)
+            self._DrawLines()
+            self.blit(self.fig.bbox)
+
 # Matplotlib widget
 class MplWidget(QtWidgets.QWidget):
     def __init__(self, parent=None):
@@ -26,4 +168,4 @@ class MplWidget(QtWidgets.QWidget):
         self.canvas = MplCanvas()                  # Create canvas object
         self.vbl = QtWidgets.QVBoxLayout()         # Set box for plotting
         self.vbl.addWidget(self.canvas)
-        self.setLayout(self.vbl)
\ No newline at end of file
+        self.setLayout(self.vbl)
@@ -0,0 +1,300 @@
+import argparse
+import multiprocessing as mp
+import sys
+import time as tm
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from acquisition import MockSpectrometer, ReplaySpectrometer, RingBuffer
+from resample import Resample, Resampler
+
+
+class SharedRingBuffer(RingBuffer):
+    # RingBuffer laid out in one shared memory block (count, timestamps, frames)
+    # so a reader process can publish frames that other processes read lock-free.
+    # name=None creates the block, otherwise an existing one is attached.
+
+    def __init__(self, capacity, pixels, name=None):
+        size = 8 * (1 + capacity + capacity * pixels)
+        self.memory = SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.memory.name
+        self.capacity = capacity
+        self._count = np.ndarray(1, dtype=np.int64, buffer=self.memory.buf)
+        self.timestamps = np.ndarray(capacity, dtype=float, buffer=self.memory.buf, offset=8)
+        self.frames = np.ndarray((capacity, pixels), dtype=float, buffer=self.memory.buf,
+                                 offset=8 * (1 + capacity))
+        if name is None:
+            self._count[0] = 0
+
+    @property
+    def count(self):
+        return int(self._count[0])
+
+    @count.setter
+    def count(self, value):
+        self._count[0] = value
+
+    def Close(self, unlink=False):
+        del self._count, self.timestamps, self.frames
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+def OpenDevice(spec):
+    # spec is ('seabreeze', serial), ('mock', kwargs) or ('replay', kwargs); it is
+    # opened inside the reader process, as USB handles cannot be shared
+    kind, argument = spec
+    if kind == 'mock':
+        return MockSpectrometer(**argument)
+    if kind == 'replay':
+        return ReplaySpectrometer(**argument)
+    from seabreeze.spectrometers import Spectrometer
+    return Spectrometer.from_serial_number(argument)
+
+
+def DeviceName(spec):
+    kind, argument = spec
+    return argument if kind == 'seabreeze' else argument.get('serial', kind)
+
+
+def _ReadDevice(spec, connection, stop, integrationTime):
+    try:
+        device = OpenDevice(spec)
+        wavelengths = np.asarray(device.wavelengths(), dtype=float)
+    except Exception as error:
+        connection.send(error)
+        return
+    connection.send(wavelengths)
+    name, capacity = connection.recv()
+    ring = SharedRingBuffer(capacity, len(wavelengths), name)
+    applied = None
+    try:
+        while not stop.is_set():
+            micros = integrationTime.value
+            if micros and micros != applied:
+                device.integration_time_micros(int(micros))
+                applied = micros
+            ring.Push(device.intensities(), tm.time())
+    except Exception as error:
+        # Reported to the parent, which would otherwise keep using the last frame
+        try:
+            connection.send(error)
+        except Exception:
+            connection.send(RuntimeError('%s: %s' % (type(error).__name__, error)))
+    finally:
+        ring.Close()
+        device.close()
+
+
+class MultiDeviceAcquisition:
+    # One reader process per device, each publishing into its own shared ring.
+    # wavelengths[i] and rings[i] belong to specs[i]. Failed returns the errors
+    # of reader processes that stopped on their own.
+
+    def __init__(self, specs, capacity=256):
+        self.specs = list(specs)
+        self.capacity = capacity
+        self.wavelengths = []
+        self.rings = []
+        self._processes = []
+        self._integrationTimes = []
+        self._connections = []
+        self.errors = {}
+        self._context = mp.get_context('spawn')
+        self._stop = self._context.Event()
+
+    def Start(self):
+        # A new event, so a stopped acquisition can be started again
+        self._stop = self._context.Event()
+        self.errors = {}
+        try:
+            for spec in self.specs:
+                local, remote = self._context.Pipe()
+                integrationTime = self._context.Value('d', 0.0)
+                process = self._context.Process(target=_ReadDevice, daemon=True,
+                                                args=(spec, remote, self._stop, integrationTime))
+                process.start()
+                self._processes.append(process)
+                self._integrationTimes.append(integrationTime)
+                self._connections.append(local)
+                wavelengths = local.recv()
+                if isinstance(wavelengths, Exception):
+                    raise wavelengths
+                ring = SharedRingBuffer(self.capacity, len(wavelengths))
+                self.wavelengths.append(wavelengths)
+                self.rings.append(ring)
+                local.send((ring.name, self.capacity))
+        except Exception:
+            self.Stop()
+            raise
+
+    def SetIntegrationTime(self, micros, index=None):
+        for i, value in enumerate(self._integrationTimes):
+            if index is None or i == index:
+                value.value = micros
+
+    def Latest(self, index, out):
+        return self.rings[index].Latest(out)
+
+    def Failed(self):
+        # Errors by device index, for readers that sent one or exited
+        if self._stop.is_set():
+            return self.errors
+        for i, (connection, process) in enumerate(zip(self._connections, self._processes)):
+            if i in self.errors:
+                continue
+            try:
+                if connection.poll():
+                    self.errors[i] = connection.recv()
+            except (EOFError, OSError):
+                pass
+            if i not in self.errors and not process.is_alive():
+                self.errors[i] = RuntimeError('reader process exited with code %s' % process.exitcode)
+        return self.errors
+
+    def Stop(self):
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for ring in self.rings:
+            ring.Close(unlink=True)
+        self._processes = []
+        self.rings = []
+        self.wavelengths = []
+        self._integrationTimes = []
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+
+
+class Stitcher:
+    # Merges spectra from several devices onto one axis. Each device's frame is
+    # corrected with its inverse response, resampled, and blended with weights
+    # proportional to the device sensitivity R, so in overlapping ranges the more
+    # sensitive device dominates. With matchOverlap each device is also scaled by
+    # the least-squares factor that best matches the devices before it in the
+    # overlap, as the responses are each normalised to their own maximum.
+
+    def __init__(self, axes, responses=None, target=None, matchOverlap=True):
+        axes = [np.asarray(axis, dtype=float) for axis in axes]
+        if responses is None:
+            responses = [None] * len(axes)
+        if target is None:
+            step = min(np.median(np.abs(np.diff(axis))) for axis in axes)
+            start = min(axis.min() for axis in axes)
+            stop = max(axis.max() for axis in axes)
+            target = start + step * np.arange(int(np.floor((stop - start) / step)) + 1)
+        self.wavelength = np.asarray(target, dtype=float)
+        self.matchOverlap = matchOverlap
+        # Devices are merged from the shortest wavelength up
+        self.order = np.argsort([axis.min() for axis in axes])
+        self._resamplers = []
+        self._gains = []
+        self._weights = []
+        for axis, R in zip(axes, responses):
+            inside = (self.wavelength >= axis.min()) & (self.wavelength <= axis.max())
+            if R is None:
+                gain = np.ones(len(axis))
+                weight = inside.astype(float)
+            else:
+                R = np.asarray(R, dtype=float)
+                gain = np.divide(1, R, out=np.zeros(len(R)), where=R > 0)
+                weight = np.clip(Resample(axis, R, self.wavelength), 0, None) * inside
+            self._resamplers.append(Resampler(axis, self.wavelength))
+            self._gains.append(gain)
+            self._weights.append(weight)
+        self.scales = np.ones(len(axes))
+        self._sum = np.zeros(len(self.wavelength))
+        self._norm = np.zeros(len(self.wavelength))
+
+    def __call__(self, frames):
+        self._sum[:] = 0
+        self._norm[:] = 0
+        for i in self.order:
+            corrected = self._resamplers[i](frames[i] * self._gains[i])
+            weight = self._weights[i]
+            if self.matchOverlap and self._norm.any():
+                overlap = weight * (self._norm > 0)
+                merged = np.divide(self._sum, self._norm, out=np.zeros(len(self._sum)), where=self._norm > 0)
+                denominator = np.sum(overlap * corrected**2)
+                if denominator > 0:
+                    self.scales[i] = np.sum(overlap * merged * corrected) / denominator
+            corrected *= self.scales[i] * weight
+            self._sum += corrected
+            self._norm += weight
+        return np.divide(self._sum, self._norm, out=np.zeros(len(self._sum)), where=self._norm > 0)
+
+
+def ResponseOn(response, wavelengths):
+    # Sensitivity R of a ResponseCache entry, on a device wavelength axis
+    return Resample(response['specCal'][:, 0], response['R'], wavelengths)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Acquire from several spectrometers at once and stitch their spectra.')
+    parser.add_argument('--serial', nargs='+', default=[], help='seabreeze serial numbers')
+    parser.add_argument('--mock', type=int, default=0, help='number of mock devices with overlapping ranges')
+    parser.add_argument('--calibration', nargs=2, action='append', metavar=('EXPERIMENTAL', 'THEORETICAL'),
+                        help='response files for each device, in order')
+    parser.add_argument('--integration', type=float, help='integration time in ms')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--output', help='file for the last stitched spectrum')
+    args = parser.parse_args(argv)
+
+    specs = [('seabreeze', serial) for serial in args.serial]
+    for i in range(args.mock):
+        start = 400.0 + 350.0 * i
+        specs.append(('mock', dict(start=start, stop=start + 450.0, serial='MOCK%d' % i)))
+    if not specs:
+        parser.error('no devices, use --serial or --mock')
+
+    acquisition = MultiDeviceAcquisition(specs)
+    acquisition.Start()
+    try:
+        if args.integration:
+            acquisition.SetIntegrationTime(args.integration * 1e3)
+        responses = None
+        if args.calibration:
+            from responsecache import ResponseCache
+            cache = ResponseCache()
+            responses = [ResponseOn(cache.Get(*files), axis)
+                         for files, axis in zip(args.calibration, acquisition.wavelengths)]
+        elif args.mock and not args.serial:
+            # Mock devices know their own sensitivity
+            responses = [MockSpectrometer(**spec[1]).sensitivity for spec in specs]
+        stitcher = Stitcher(acquisition.wavelengths, responses)
+        frames = [np.empty(len(axis)) for axis in acquisition.wavelengths]
+        start = tm.perf_counter()
+        stitched = 0
+        newest = None
+        while tm.perf_counter() - start < args.seconds:
+            failed = acquisition.Failed()
+            if failed:
+                for i, error in failed.items():
+                    print('%s failed: %s' % (DeviceName(specs[i]), error), file=sys.stderr)
+                return 1
+            latest = [acquisition.Latest(i, frame) for i, frame in enumerate(frames)]
+            # Only new frames count, not the same ones polled again
+            seqs = tuple(None if entry is None else entry[0] for entry in latest)
+            if None not in seqs and seqs != newest:
+                spectrum = stitcher(frames)
+                stitched += 1
+                newest = seqs
+            tm.sleep(0.01)
+        elapsed = tm.perf_counter() - start
+        for spec, ring in zip(specs, acquisition.rings):
+            print('%-24s %6d frames  %7.1f frames/s' % (DeviceName(spec), ring.count, ring.count / elapsed))
+        print('stitched %d spectra on %d points, %.1f-%.1f nm' % (stitched, len(stitcher.wavelength),
+                                                                 stitcher.wavelength[0], stitcher.wavelength[-1]))
+        if args.output and stitched:
+            from spectrumio import WriteSpectrum
+            WriteSpectrum(args.output, np.column_stack((stitcher.wavelength, spectrum)))
+    finally:
+        acquisition.Stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import threading
+import numpy as np
+from profiling import Measure
+from calibration import SuperGaussianFilter
+from fwhm import CalculateFWHM
+from resample import Resample
+from spectrum import Spectrum
+
+
+def _Same(a, b):
+    if isinstance(a, Spectrum) and isinstance(b, Spectrum):
+        return a.Shares(b)
+    if a is b:
+        return True
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return (isinstance(a, np.ndarray) and isinstance(b, np.ndarray)
+                and a.shape == b.shape and np.array_equal(a, b))
+    return a == b
+
+
+class Pipeline:
+    # Graph of cached stages. Each stage is a function of named inputs, which are
+    # either parameters set with Set or other stages. Changing a parameter only
+    # drops the cached results that depend on it; Get recomputes what is missing.
+
+    def __init__(self):
+        self._params = {}
+        self._stages = {}
+        self._dependents = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.evaluations = {}
+
+    def AddStage(self, name, function, *inputs):
+        self._stages[name] = (function, inputs)
+        for source in inputs:
+            self._dependents.setdefault(source, []).append(name)
+        self.evaluations[name] = 0
+
+    def Set(self, name, value):
+        if name in self._params and _Same(self._params[name], value):
+            return False
+        # Arrays are copied so that later in-place edits by the caller are seen as
+        # changes; read-only ones (interned axes, Spectrum intensities) cannot change.
+        # Spectra are kept as copies sharing their buffer: Edit on the caller's
+        # spectrum then copies it first, and Shares sees the new buffer.
+        if isinstance(value, np.ndarray) and value.flags.writeable:
+            value = value.copy()
+        elif isinstance(value, Spectrum):
+            value = value.Copy()
+        self._params[name] = value
+        self._Invalidate(name)
+        return True
+
+    def _Invalidate(self, name):
+        for dependent in self._dependents.get(name, []):
+            if self._cache.pop(dependent, self) is not self:
+                self._Invalidate(dependent)
+
+    def Get(self, name, check=None):
+        # check, if given, is called before each stage is computed and may raise
+        # to abandon the evaluation; finished stages stay cached
+        if name in self._params:
+            return self._params[name]
+        if name not in self._cache:
+            function, inputs = self._stages[name]
+            arguments = [self.Get(source, check) for source in inputs]
+            if check is not None:
+                check()
+            with Measure(name):
+                self._cache[name] = function(*arguments)
+            self.evaluations[name] += 1
+        return self._cache[name]
+
+    def Evaluate(self, params, names, check=None):
+        # Sets params and returns the named results as one consistent dict. Safe
+        # to call from worker threads: evaluations run one at a time.
+        with self._lock:
+            if check is not None:
+                check()
+            for name, value in params.items():
+                self.Set(name, value)
+            return {name: self.Get(name, check) for name in names}
+
+
+def _Corrected(intensity, response):
+    if response is None:
+        return np.abs(intensity) / np.max(intensity)
+    return intensity * response
+
+
+def _Calibrated(corrected, filterCurve):
+    if filterCurve is None:
+        return corrected
+    return filterCurve * (corrected / np.max(corrected))
+
+
+def SpectrumPipeline():
+    # load -> response correction -> filter -> normalise -> FWHM, as used by the
+    # calibrator windows. Parameters: spectrum (a spectrum.Spectrum), calWavelength,
+    # multiplyR and filter, the latter being (center, width, exponent) or None.
+    pipeline = Pipeline()
+    pipeline.AddStage('wavelength', lambda spectrum: spectrum.wavelength, 'spectrum')
+    pipeline.AddStage('intensity', lambda spectrum: spectrum.intensity, 'spectrum')
+    pipeline.AddStage('raw', lambda intensity: np.abs(intensity) / np.max(intensity), 'intensity')
+    pipeline.AddStage('response',
+                      lambda calWavelength, multiplyR, wavelength:
+                      Resample(calWavelength, multiplyR, wavelength) if len(multiplyR) else None,
+                      'calWavelength', 'multiplyR', 'wavelength')
+    pipeline.AddStage('corrected', _Corrected, 'intensity', 'response')
+    pipeline.AddStage('filterCurve',
+                      lambda wavelength, filter:
+                      SuperGaussianFilter(wavelength, *filter) if filter is not None else None,
+                      'wavelength', 'filter')
+    pipeline.AddStage('calibrated', _Calibrated, 'corrected', 'filterCurve')
+    pipeline.AddStage('normalised', lambda calibrated: calibrated / np.max(calibrated), 'calibrated')
+    pipeline.AddStage('fwhm', CalculateFWHM, 'wavelength', 'calibrated')
+    pipeline.Set('calWavelength', np.zeros(0))
+    pipeline.Set('multiplyR', np.zeros(0))
+    pipeline.Set('filter', None)
+    return pipeline
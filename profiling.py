@@ -0,0 +1,158 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import time as tm
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+
+# Profiles, memory snapshots and exported timings are written here
+profileDir = 'profiles'
+
+
+class Timings:
+    # Latest durations of named stages. Recording is a perf_counter call and a
+    # deque append, cheap enough to leave on in the hot paths; statistics are
+    # only computed when asked for.
+
+    def __init__(self, size=2048):
+        self.size = size
+        self.enabled = True
+        self._samples = {}
+
+    def Record(self, name, start, end=None):
+        if end is None:
+            end = tm.perf_counter()
+        samples = self._samples.get(name)
+        if samples is None:
+            samples = self._samples.setdefault(name, deque(maxlen=self.size))
+        samples.append((end, end - start))
+
+    @contextmanager
+    def Measure(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = tm.perf_counter()
+        try:
+            yield
+        finally:
+            self.Record(name, start)
+
+    def Timed(self, name=None):
+        # Decorator version of Measure, named after the function by default
+        def Decorator(function):
+            stage = name or function.__name__
+
+            @functools.wraps(function)
+            def Wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = tm.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.Record(stage, start)
+            return Wrapper
+        return Decorator
+
+    def Names(self):
+        return sorted(self._samples)
+
+    def Samples(self, name):
+        # (end times in perf_counter seconds, durations in ms)
+        # deque.copy is atomic, so reading while another thread records is safe
+        samples = self._samples.get(name)
+        samples = np.array(samples.copy() if samples is not None else (), dtype=float).reshape(-1, 2)
+        return samples[:, 0], samples[:, 1] * 1e3
+
+    def Stats(self, name):
+        durations = self.Samples(name)[1]
+        if not len(durations):
+            return None
+        p50, p90, p99 = np.percentile(durations, (50, 90, 99))
+        return {'count': len(durations), 'mean': float(np.mean(durations)), 'p50': float(p50),
+                'p90': float(p90), 'p99': float(p99), 'max': float(np.max(durations))}
+
+    def Histogram(self, name, bins=8):
+        # Counts over log-spaced duration bins, so one slow outlier does not squash the rest
+        durations = self.Samples(name)[1]
+        if not len(durations):
+            return np.zeros(bins, dtype=int), np.zeros(bins + 1)
+        low, high = max(np.min(durations), 1e-3), max(np.max(durations), 2e-3)
+        edges = np.geomspace(low, high * 1.0001, bins + 1)
+        return np.histogram(np.clip(durations, low, None), edges)
+
+    def Rate(self, name, window=1.0):
+        # Calls per second over the last window seconds
+        ends = self.Samples(name)[0]
+        return np.count_nonzero(ends > tm.perf_counter() - window) / window
+
+    def Clear(self):
+        self._samples.clear()
+
+    def Export(self, filename):
+        data = {}
+        for name in self.Names():
+            ends, durations = self.Samples(name)
+            data[name] = dict(self.Stats(name), ends=ends.tolist(), durations=durations.tolist())
+        with open(filename, 'w') as f:
+            json.dump({'created': tm.strftime('%Y-%m-%d %H:%M:%S'), 'units': 'ms', 'stages': data}, f)
+
+
+timings = Timings()
+Measure = timings.Measure
+Timed = timings.Timed
+
+
+def ProfileName(suffix):
+    os.makedirs(profileDir, exist_ok=True)
+    return os.path.join(profileDir, tm.strftime('%Y%m%d_%H%M%S') + suffix)
+
+
+_profile = None
+
+
+def StartProfile():
+    global _profile
+    _profile = cProfile.Profile()
+    _profile.enable()
+
+
+def StopProfile(lines=25):
+    # Saves the profile for snakeviz/pstats and returns (filename, top functions)
+    global _profile
+    profile, _profile = _profile, None
+    profile.disable()
+    filename = ProfileName('.prof')
+    profile.dump_stats(filename)
+    text = io.StringIO()
+    pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(lines)
+    return filename, text.getvalue()
+
+
+def Profiling():
+    return _profile is not None
+
+
+def StartMemory(frames=10):
+    tracemalloc.start(frames)
+
+
+def StopMemory(lines=25):
+    # Saves the largest allocation sites still alive and returns (filename, text)
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    text = '\n'.join(str(stat) for stat in snapshot.statistics('lineno')[:lines])
+    filename = ProfileName('_memory.txt')
+    with open(filename, 'w') as f:
+        f.write(text + '\n')
+    return filename, text
+
+
+def TracingMemory():
+    return tracemalloc.is_tracing()
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time as tm
+import numpy as np
+from calibration import CalibrateStack
+from decimation import FrequencyBinner, RoiSlice
+from fwhm import FWHMEngine
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class RawStore:
+    # Directory of append-only binary columns plus meta.json. Every column can be
+    # opened as a memory-mapped array with OpenRecording while or after recording.
+
+    def __init__(self, path, wavelengths, metadata):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.pixels = len(wavelengths)
+        self._files = {}
+        np.save(os.path.join(path, 'wavelengths.npy'), wavelengths)
+        self._meta = dict(metadata, pixels=self.pixels, columns={})
+
+    def Append(self, columns):
+        for name, values in columns.items():
+            if name not in self._files:
+                self._files[name] = open(os.path.join(self.path, name + '.bin'), 'ab')
+                self._meta['columns'][name] = [values.dtype.str, list(values.shape[1:])]
+                self._WriteMeta()
+            self._files[name].write(np.ascontiguousarray(values).tobytes())
+
+    def _WriteMeta(self):
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(self._meta, f, indent=1)
+
+    def Close(self):
+        for f in self._files.values():
+            f.close()
+        self._WriteMeta()
+
+
+class HDF5Store:
+    # Same columns as RawStore, as resizable chunked datasets in one HDF5 file
+
+    def __init__(self, path, wavelengths, metadata, chunk=64):
+        self.file = h5py.File(path, 'w')
+        self.file.create_dataset('wavelengths', data=wavelengths)
+        self.file.attrs.update(metadata)
+        self.chunk = chunk
+
+    def Append(self, columns):
+        for name, values in columns.items():
+            if name not in self.file:
+                self.file.create_dataset(name, shape=(0,) + values.shape[1:], dtype=values.dtype,
+                                         maxshape=(None,) + values.shape[1:],
+                                         chunks=(self.chunk,) + values.shape[1:])
+            dataset = self.file[name]
+            start = dataset.shape[0]
+            dataset.resize(start + len(values), axis=0)
+            dataset[start:] = values
+
+    def Close(self):
+        self.file.close()
+
+
+def OpenRecording(path):
+    if os.path.isfile(path):
+        if h5py is None:
+            raise ImportError('h5py is needed to read HDF5 recordings')
+        with h5py.File(path, 'r') as f:
+            return {name: f[name][()] for name in f}, dict(f.attrs)
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    data = {'wavelengths': np.load(os.path.join(path, 'wavelengths.npy'))}
+    for name, (dtype, shape) in meta['columns'].items():
+        data[name] = np.memmap(os.path.join(path, name + '.bin'), dtype=dtype, mode='r').reshape([-1] + shape)
+    return data, meta
+
+
+class Recorder(threading.Thread):
+    # Drains an acquisition RingBuffer to disk in blocks from its own thread.
+    # Only frames acquired after start() are recorded; frames the writer overwrote
+    # before they could be saved are counted in dropped. With roi = (low, high)
+    # in nm only the pixels in between are stored, and calibrated spectra are
+    # normalised to their maximum inside it. frequencyPoints rebins the
+    # calibrated spectra onto that many uniform frequency bins for the FWHM
+    # column, which is cheaper than resampling every pixel. A write error ends
+    # the recording early; the store is closed either way and the error is kept
+    # in exception.
+
+    def __init__(self, worker, path, multiplyR=None, blockSize=32, interval=0.02, roi=None,
+                 frequencyPoints=None):
+        threading.Thread.__init__(self, daemon=True)
+        self.worker = worker
+        self.ring = worker.ring
+        self.crop = RoiSlice(worker.wavelengths, roi)
+        self.wavelengths = worker.wavelengths[self.crop]
+        self.multiplyR = multiplyR[self.crop] if multiplyR is not None else None
+        self.blockSize = blockSize
+        self.interval = interval
+        self.recorded = 0
+        self.dropped = 0
+        self.exception = None
+        self._engine = FWHMEngine()
+        self._binner = FrequencyBinner(self.wavelengths, frequencyPoints) if frequencyPoints else None
+        self._stopEvent = threading.Event()
+
+        metadata = {'start': tm.time(), 'device': str(getattr(worker.device, 'serial_number', ''))}
+        if roi is not None:
+            metadata['roi'] = [float(min(roi)), float(max(roi))]
+        if frequencyPoints:
+            metadata['frequencyPoints'] = int(frequencyPoints)
+        if path.endswith(('.h5', '.hdf5')):
+            if h5py is None:
+                raise ImportError('h5py is needed to record to HDF5')
+            self.store = HDF5Store(path, self.wavelengths, metadata, chunk=blockSize)
+        else:
+            self.store = RawStore(path, self.wavelengths, metadata)
+        self._next = self.ring.count
+
+    def _Block(self, count):
+        capacity = self.ring.capacity
+        if count - self._next >= capacity:
+            self.dropped += count - self._next - capacity + 1
+            self._next = count - capacity + 1
+        frames = min(count - self._next, self.blockSize)
+        slots = np.arange(self._next, self._next + frames) % capacity
+        raw = self.ring.frames[slots, self.crop]
+        timestamps = self.ring.timestamps[slots]
+        # Frames the writer started overwriting while we copied are unusable
+        lost = max(0, self.ring.count - capacity + 1 - self._next)
+        self._next += frames
+        if lost:
+            self.dropped += min(lost, frames)
+            raw, timestamps = raw[lost:], timestamps[lost:]
+        return raw, timestamps
+
+    def _Write(self, raw, timestamps):
+        if not len(raw):
+            return
+        columns = {'raw': raw, 'timestamps': timestamps,
+                   'integration': np.full(len(raw), self.worker.integrationTime or 0, dtype=np.int64)}
+        if self.multiplyR is not None:
+            calibrated = CalibrateStack(raw, self.multiplyR, normalise=True)
+            columns['calibrated'] = calibrated
+            if self._binner is not None:
+                columns['fwhm'] = self._engine.Uniform(self._binner.frequency, self._binner(calibrated))
+            else:
+                columns['fwhm'] = self._engine.Batch(self.wavelengths, calibrated)
+        self.store.Append(columns)
+        self.recorded += len(raw)
+
+    def run(self):
+        try:
+            self._Drain()
+        except Exception as error:
+            self.exception = error
+        finally:
+            try:
+                self.store.Close()
+            except Exception as error:
+                self.exception = self.exception or error
+
+    def _Drain(self):
+        stopAt = None
+        while True:
+            count = self.ring.count
+            if stopAt is None and self._stopEvent.is_set():
+                stopAt = count
+            if stopAt is not None:
+                count = min(count, stopAt)
+            pending = count - self._next
+            if pending >= self.blockSize or (stopAt is not None and pending > 0):
+                self._Write(*self._Block(count))
+            elif stopAt is not None:
+                break
+            else:
+                tm.sleep(self.interval)
+
+    def Stop(self):
+        self._stopEvent.set()
+        self.join()
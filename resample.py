@@ -0,0 +1,76 @@
+from collections import OrderedDict
+import numpy as np
+
+
+class Resampler:
+    # Linear interpolation from a source axis onto a target axis, same results as
+    # np.interp (values are held constant beyond the ends). The bracketing indices
+    # and weights are computed once, so each call is two gathers and a multiply-add
+    # and works on any leading dimensions. The source axis does not need to be sorted.
+
+    def __init__(self, source, target):
+        source = np.asarray(source, dtype=float)
+        target = np.asarray(target, dtype=float)
+        order = np.argsort(source, kind='stable')
+        sortedSource = source[order]
+        index = np.clip(np.searchsorted(sortedSource, target, side='right') - 1, 0, len(source) - 2)
+        step = sortedSource[index + 1] - sortedSource[index]
+        weight = np.divide(target - sortedSource[index], step, out=np.zeros(len(target)), where=step != 0)
+        self.lower = order[index]
+        self.upper = order[index + 1]
+        self.weight = np.clip(weight, 0, 1)
+        self.shape = (len(target), len(source))
+
+    def __call__(self, values):
+        lower = np.take(values, self.lower, axis=-1)
+        result = np.take(values, self.upper, axis=-1)
+        result -= lower
+        result *= self.weight
+        result += lower
+        return result
+
+    def Into(self, values, out, scratch):
+        # 1-D version of __call__ writing to out, with scratch (same length) as
+        # temporary storage, for per-frame use without allocations
+        np.take(values, self.lower, out=scratch)
+        np.take(values, self.upper, out=out)
+        out -= scratch
+        out *= self.weight
+        out += scratch
+        return out
+
+    def Matrix(self):
+        # The same operator as a sparse (target x source) matrix
+        from scipy.sparse import csr_matrix
+        rows = np.arange(self.shape[0])
+        return csr_matrix((np.concatenate((1 - self.weight, self.weight)),
+                           (np.concatenate((rows, rows)), np.concatenate((self.lower, self.upper)))),
+                          shape=self.shape)
+
+
+def AxisFingerprint(axis):
+    axis = np.ascontiguousarray(axis, dtype=float)
+    return len(axis), hash(axis.tobytes())
+
+
+_resamplers = OrderedDict()
+_maxResamplers = 16
+
+
+def GetResampler(source, target):
+    key = (AxisFingerprint(source), AxisFingerprint(target))
+    resampler = _resamplers.get(key)
+    if resampler is None:
+        resampler = _resamplers[key] = Resampler(source, target)
+        if len(_resamplers) > _maxResamplers:
+            _resamplers.popitem(last=False)
+    else:
+        _resamplers.move_to_end(key)
+    return resampler
+
+
+def Resample(source, values, target):
+    # values defined on source, returned on target; no copy when the axes are equal
+    if source is target or (len(source) == len(target) and np.array_equal(source, target)):
+        return values
+    return GetResampler(source, target)(values)
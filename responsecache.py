@@ -0,0 +1,75 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from profiling import Timed
+from calibration import ComputeResponse, calibrationDir, responseSmoothers
+from spectrumio import ReadSpectrum
+
+cacheDir = os.path.join(calibrationDir, '.cache')
+
+_hashes = {}
+
+
+def FileHash(filename):
+    # Content hash, remembered while the file's size and mtime stay the same
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    if key not in _hashes:
+        with open(filename, 'rb') as f:
+            _hashes[key] = hashlib.sha1(f.read()).hexdigest()
+    return _hashes[key]
+
+
+class ResponseCache:
+    # Instrument responses keyed by the content of the lamp and theoretical files
+    # plus the response smoothing. Recently used entries stay in memory, all of
+    # them are stored as .npz files so they survive restarts.
+
+    def __init__(self, directory=cacheDir, maxsize=8):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._memory = OrderedDict()
+        # Responses are loaded from the GUI's compute pool as well
+        self._lock = threading.RLock()
+
+    def Key(self, expFile, theoFile, smoothing=None):
+        smoothing = responseSmoothers[smoothing].key if smoothing else 'raw'
+        return '%s-%s-%s' % (FileHash(expFile)[:16], FileHash(theoFile)[:16], smoothing)
+
+    @Timed('response')
+    def Get(self, expFile, theoFile, smoothing=None):
+        with self._lock:
+            return self._Get(expFile, theoFile, smoothing)
+
+    def _Get(self, expFile, theoFile, smoothing):
+        key = self.Key(expFile, theoFile, smoothing)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        path = os.path.join(self.directory, key + '.npz')
+        try:
+            with np.load(path) as data:
+                response = dict(data)
+        except (OSError, ValueError):
+            response = ComputeResponse(ReadSpectrum(expFile), ReadSpectrum(theoFile), smoothing)
+            self._Store(path, response)
+
+        self._memory[key] = response
+        if len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+        return response
+
+    def _Store(self, path, response):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp = path + '.tmp.npz'
+            np.savez(temp, **response)
+            os.replace(temp, path)
+        except OSError:
+            pass
+
+    def Clear(self):
+        self._memory.clear()
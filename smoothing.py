@@ -0,0 +1,133 @@
+import time as tm
+from functools import lru_cache
+import numpy as np
+
+# Linear smoothing filters with one definition and several backends. A filter
+# is a symmetric interior kernel plus edge matrices for the first and last
+# half-window samples, which only see samples inside the spectrum. Backends
+# only differ in how the interior correlation is computed, so they agree to
+# rounding error and the choice between them is purely a matter of speed.
+
+
+def _Direct(values, kernel):
+    # Shift-and-add, fastest for short kernels
+    m = values.shape[-1] - len(kernel) + 1
+    out = values[..., :m] * kernel[0]
+    for j in range(1, len(kernel)):
+        out += kernel[j] * values[..., j:j + m]
+    return out
+
+
+def _Cumsum(values, kernel):
+    # Running sums: cost independent of the width, box kernels only
+    sums = np.zeros(values.shape[:-1] + (values.shape[-1] + 1,))
+    np.cumsum(values, axis=-1, out=sums[..., 1:])
+    out = sums[..., len(kernel):] - sums[..., :-len(kernel)]
+    out *= kernel[0]
+    return out
+
+
+@lru_cache(maxsize=32)
+def _KernelSpectrum(kernel, size):
+    from scipy.fft import rfft
+    return rfft(np.array(kernel[::-1]), size)
+
+
+def _FFT(values, kernel):
+    # Zero-padded FFT convolution, for wide kernels
+    from scipy.fft import irfft, next_fast_len, rfft
+    w = len(kernel)
+    size = next_fast_len(values.shape[-1] + w - 1, True)
+    product = rfft(values, size, axis=-1)
+    product *= _KernelSpectrum(tuple(kernel), size)
+    return irfft(product, size, axis=-1)[..., w - 1:values.shape[-1]]
+
+
+def _NDImage(values, kernel):
+    # scipy's C correlation; the edge samples it computes are replaced
+    from scipy.ndimage import correlate1d
+    h = len(kernel) // 2
+    return correlate1d(values, kernel, axis=-1, mode='constant')[..., h:values.shape[-1] - h]
+
+
+backends = {'direct': _Direct, 'cumsum': _Cumsum, 'fft': _FFT, 'ndimage': _NDImage}
+# Fastest backend per filter and input size class, measured on first use
+_fastest = {}
+
+
+class Smoother:
+    # Applies a filter along the last axis of 1-D spectra or (spectra x pixels)
+    # stacks. backend 'auto' times every backend once per filter and size class
+    # and keeps the fastest.
+
+    def __init__(self, key, kernel, left, right):
+        self.key = key
+        self.kernel = np.asarray(kernel, dtype=float)
+        self.left = np.asarray(left, dtype=float)
+        self.right = np.asarray(right, dtype=float)
+        self.window = len(self.kernel)
+        self.box = bool(np.all(self.kernel == self.kernel[0]))
+
+    def Backends(self):
+        return [name for name in backends if name != 'cumsum' or self.box]
+
+    def __call__(self, values, backend='auto'):
+        values = np.asarray(values, dtype=float)
+        pixels = values.shape[-1]
+        if pixels < self.window:
+            raise ValueError('%d-point %s filter on a %d-point spectrum' % (self.window, self.key, pixels))
+        stack = values.reshape(-1, pixels)
+        if backend == 'auto':
+            backend = self.Fastest(stack)
+        h = self.window // 2
+        out = np.empty(stack.shape)
+        out[:, h:pixels - h] = backends[backend](stack, self.kernel)
+        out[:, :h] = stack[:, :self.window] @ self.left.T
+        out[:, pixels - h:] = stack[:, pixels - self.window:] @ self.right.T
+        return out.reshape(values.shape)
+
+    def Fastest(self, stack):
+        # Size classes are powers of two in rows and pixels
+        rows, pixels = stack.shape
+        key = (self.key, int(rows).bit_length(), int(pixels).bit_length())
+        if key not in _fastest:
+            _fastest[key] = min(self.Backends(), key=lambda name: self.Cost(name, stack))
+        return _fastest[key]
+
+    def Cost(self, backend, stack, repeat=3):
+        # Best of repeat timings, after one warm-up call for imports and caches
+        function = backends[backend]
+        function(stack, self.kernel)
+        best = np.inf
+        for _ in range(repeat):
+            start = tm.perf_counter()
+            function(stack, self.kernel)
+            best = min(best, tm.perf_counter() - start)
+        return best
+
+
+@lru_cache(maxsize=None)
+def Savgol(window=21, order=3):
+    # Savitzky-Golay: least-squares polynomial of the given order over each
+    # window. The edges use the polynomial fitted to the first and last window,
+    # as scipy's savgol_filter(mode='interp').
+    if window % 2 == 0 or order >= window:
+        raise ValueError('Savitzky-Golay window must be odd and longer than the order')
+    h = window // 2
+    positions = np.arange(-h, h + 1, dtype=float)
+    vander = np.vander(positions, order + 1)
+    projection = vander @ np.linalg.pinv(vander)
+    return Smoother('savgol%d-%d' % (window, order), projection[h], projection[:h], projection[h + 1:])
+
+
+@lru_cache(maxsize=None)
+def Box(width=11):
+    # Moving average; the edge samples average over the part of the window
+    # inside the spectrum instead of treating the outside as zeros
+    if width % 2 == 0:
+        raise ValueError('Box width must be odd')
+    h = width // 2
+    left = np.zeros((h, width))
+    for i in range(h):
+        left[i, :i + h + 1] = 1 / (i + h + 1)
+    return Smoother('box%d' % width, np.full(width, 1 / width), left, left[::-1, ::-1])
@@ -0,0 +1,165 @@
+import weakref
+import numpy as np
+from resample import AxisFingerprint
+from spectrumio import ReadSpectrum
+
+# Interned wavelength axes, one read-only array per device and axis. Entries go
+# away with the last spectrum using them.
+_axes = weakref.WeakValueDictionary()
+
+
+def InternAxis(wavelength, device=None):
+    # The shared read-only copy of wavelength: spectra from the same device and
+    # axis hold the same array, so the axis is stored once and comparing axes is
+    # an identity check
+    key = (device, AxisFingerprint(wavelength))
+    axis = _axes.get(key)
+    if axis is wavelength:
+        return axis
+    if axis is None or not np.array_equal(axis, wavelength):
+        axis = np.array(wavelength, dtype=float)
+        axis.flags.writeable = False
+        _axes[key] = axis
+    return axis
+
+
+def _Frozen(values):
+    view = values.view()
+    view.flags.writeable = False
+    return view
+
+
+class Spectrum:
+    # Intensities on an interned wavelength axis, with the integration time (ms)
+    # and device they were measured with. The intensity seen from outside is
+    # read-only; Copy shares the buffer and Edit copies it before the first
+    # write (copy-on-write), so a spectrum derived from another can never change
+    # it. dtype float32 halves the intensity storage for large sets.
+    __slots__ = ('wavelength', '_intensity', '_shared', 'integrationTime', 'device', '__weakref__')
+
+    def __init__(self, wavelength, intensity, integrationTime=None, device=None, dtype=float):
+        self.wavelength = InternAxis(wavelength, device)
+        intensity = np.array(intensity, dtype=dtype)
+        if intensity.shape != self.wavelength.shape:
+            raise ValueError('%d intensities for %d wavelengths' % (intensity.size, self.wavelength.size))
+        self._intensity = intensity
+        self._shared = False
+        self.integrationTime = integrationTime
+        self.device = device
+
+    @classmethod
+    def FromArray(cls, spectrum, integrationTime=None, device=None, dtype=float):
+        # From the (n, 2) wavelength/intensity arrays used by spectrumio
+        spectrum = np.asarray(spectrum)
+        return cls(spectrum[:, 0], spectrum[:, 1], integrationTime, device, dtype)
+
+    @classmethod
+    def Load(cls, filename, integrationTime=None, device=None, dtype=float):
+        return cls.FromArray(ReadSpectrum(filename), integrationTime, device, dtype)
+
+    @property
+    def intensity(self):
+        # The view handed out shares the buffer, so the next Edit copies it
+        self._shared = True
+        return _Frozen(self._intensity)
+
+    @property
+    def nbytes(self):
+        # Intensity storage only; the axis is shared
+        return self._intensity.nbytes
+
+    def __len__(self):
+        return len(self.wavelength)
+
+    def _Like(self, intensity):
+        spectrum = Spectrum.__new__(Spectrum)
+        spectrum.wavelength = self.wavelength
+        spectrum._intensity = intensity
+        spectrum._shared = False
+        spectrum.integrationTime = self.integrationTime
+        spectrum.device = self.device
+        return spectrum
+
+    def Copy(self):
+        # Shares the intensity buffer until one of the two is edited
+        spectrum = self._Like(self._intensity)
+        spectrum._shared = self._shared = True
+        return spectrum
+
+    def WithIntensity(self, intensity):
+        # Same axis and metadata, new intensities
+        intensity = np.array(intensity, dtype=self._intensity.dtype)
+        if intensity.shape != self.wavelength.shape:
+            raise ValueError('%d intensities for %d wavelengths' % (intensity.size, self.wavelength.size))
+        return self._Like(intensity)
+
+    def Shares(self, other):
+        # Same axis, metadata and intensity buffer, so the same data unless one was edited
+        return (self.wavelength is other.wavelength and self._intensity is other._intensity
+                and self.integrationTime == other.integrationTime and self.device == other.device)
+
+    def Edit(self):
+        # Writable intensities, copied first if the buffer is shared
+        if self._shared:
+            self._intensity = self._intensity.copy()
+            self._shared = False
+        return self._intensity
+
+    def Array(self):
+        # (n, 2) float64 copy for code that takes the spectrumio layout
+        return np.stack((self.wavelength, self._intensity), axis=1)
+
+
+class SpectrumSet:
+    # Spectra of one device on one axis as a (spectra x pixels) matrix, for
+    # batches: the axis is stored once instead of once per spectrum. Indexing
+    # gives Spectrum objects that share the row until they are edited.
+    __slots__ = ('wavelength', 'intensities', 'integrationTimes', 'device', 'names')
+
+    def __init__(self, wavelength, intensities, integrationTimes=None, device=None, names=None, dtype=float):
+        self.wavelength = InternAxis(wavelength, device)
+        self.intensities = np.array(intensities, dtype=dtype, ndmin=2)
+        if self.intensities.shape[1] != len(self.wavelength):
+            raise ValueError('%d pixels for %d wavelengths' % (self.intensities.shape[1], len(self.wavelength)))
+        rows = len(self.intensities)
+        self.integrationTimes = np.full(rows, np.nan) if integrationTimes is None else np.asarray(
+            integrationTimes, dtype=float)
+        self.device = device
+        self.names = list(names) if names is not None else [None] * rows
+
+    @classmethod
+    def Stack(cls, spectra, names=None, dtype=None):
+        # Spectra on another axis than the first one are rejected, not resampled
+        spectra = list(spectra)
+        if not spectra:
+            raise ValueError('No spectra')
+        first = spectra[0]
+        for spectrum in spectra:
+            if spectrum.wavelength is not first.wavelength and not np.array_equal(spectrum.wavelength,
+                                                                                 first.wavelength):
+                raise ValueError('Spectra do not share one wavelength axis')
+        times = [np.nan if s.integrationTime is None else s.integrationTime for s in spectra]
+        return cls(first.wavelength, [s._intensity for s in spectra], times, first.device, names,
+                   dtype or first._intensity.dtype)
+
+    @classmethod
+    def Load(cls, filenames, device=None, dtype=np.float32):
+        filenames = list(filenames)
+        return cls.Stack([Spectrum.Load(name, device=device, dtype=dtype) for name in filenames], filenames)
+
+    @property
+    def nbytes(self):
+        return self.intensities.nbytes + self.integrationTimes.nbytes
+
+    def __len__(self):
+        return len(self.intensities)
+
+    def __getitem__(self, index):
+        time = self.integrationTimes[index]
+        spectrum = Spectrum.__new__(Spectrum)
+        spectrum.wavelength = self.wavelength
+        spectrum._intensity = self.intensities[index]
+        spectrum._shared = True
+        spectrum.integrationTime = None if np.isnan(time) else float(time)
+        spectrum.device = self.device
+        return spectrum
@@ -0,0 +1,115 @@
+import os
+import warnings
+import numpy as np
+from profiling import Timed
+
+# From numpy 1.23 np.loadtxt has a C parser that beats np.fromstring on files;
+# before that it is a Python loop and np.fromstring is much faster
+_fastLoadtxt = tuple(int(part) for part in np.__version__.split('.')[:2]) >= (1, 23)
+
+
+def _SplitHeader(text):
+    # Skip leading lines that do not start with a number (instrument headers)
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start)
+        if end == -1:
+            end = len(text)
+        line = text[start:end].strip()
+        if line:
+            token = line.replace(';', ' ').replace(',', ' ').split()[0]
+            try:
+                float(token)
+                return text[start:], line
+            except ValueError:
+                pass
+        start = end + 1
+    return '', ''
+
+
+def _DecimalComma(firstLine):
+    # Tab or space separated columns with commas only inside the numbers,
+    # e.g. 345,33<tab>16,38
+    fields = firstLine.split()
+    return ',' in firstLine and len(fields) > 1 and all(field.strip(',') == field for field in fields)
+
+
+def ParseSpectrumText(text):
+    body, firstLine = _SplitHeader(text)
+    if not firstLine:
+        raise ValueError('No numeric data found')
+    if ';' in firstLine:
+        # Semicolon-separated exports use decimal commas
+        body = body.replace(',', '.').replace(';', ' ')
+        columns = len(firstLine.replace(';', ' ').split())
+    elif _DecimalComma(firstLine):
+        body = body.replace(',', '.')
+        columns = len(firstLine.split())
+    else:
+        body = body.replace(',', ' ')
+        columns = len(firstLine.replace(',', ' ').split())
+    rows = body.count('\n') + (not body.endswith('\n'))
+    try:
+        with warnings.catch_warnings():
+            # Older numpy only warns when it stops early, the length check catches that
+            warnings.simplefilter('ignore', DeprecationWarning)
+            values = np.fromstring(body, sep=' ')
+    except ValueError:
+        values = []
+    if len(values) % columns or len(values) < columns * rows:
+        # Ragged or non-numeric rows: let np.loadtxt parse or report them
+        return np.loadtxt(body.splitlines(), ndmin=2)
+    return values.reshape(-1, columns)
+
+
+def SidecarName(filename):
+    return filename + '.npy'
+
+
+@Timed('read file')
+def ReadSpectrum(filename, mmap=False, sidecar=False):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.npy':
+        return np.load(filename, mmap_mode='r' if mmap else None)
+    if ext == '.npz':
+        with np.load(filename) as data:
+            return data['spectrum']
+
+    if sidecar:
+        binary = SidecarName(filename)
+        try:
+            if os.path.getmtime(binary) >= os.path.getmtime(filename):
+                return np.load(binary, mmap_mode='r' if mmap else None)
+        except OSError:
+            pass
+
+    with open(filename, 'r') as f:
+        text = f.read()
+    body, firstLine = _SplitHeader(text)
+    if _fastLoadtxt and firstLine and ';' not in firstLine and not _DecimalComma(firstLine):
+        header = text.count('\n', 0, len(text) - len(body))
+        spectrum = np.loadtxt(filename, delimiter=',' if ',' in firstLine else None,
+                              skiprows=header, ndmin=2)
+    else:
+        spectrum = ParseSpectrumText(text)
+
+    if sidecar:
+        try:
+            np.save(binary, spectrum)
+        except OSError:
+            pass
+    return spectrum
+
+
+def WriteSpectrum(filename, spectrum, fmt='%.2f'):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.npy':
+        np.save(filename, spectrum)
+    elif ext == '.npz':
+        np.savez_compressed(filename, spectrum=spectrum)
+    else:
+        # One C-level format call instead of np.savetxt's per-row Python loop
+        rows, columns = spectrum.shape
+        line = ' '.join([fmt] * columns) + '\n'
+        with open(filename, 'w') as f:
+            f.write((line * rows) % tuple(spectrum.ravel()))
@@ -0,0 +1,332 @@
+import argparse
+import asyncio
+import json
+import os
+import struct
+import sys
+import threading
+import time as tm
+import numpy as np
+from fwhm import FWHMEngine
+from tracking import Tracker, fields
+
+# Framing, all little-endian. Every message is a header followed by its payload:
+#   header  '<4sBI'  magic b'SPEC', kind, payload length in bytes
+#   AXIS    float64[pixels]  wavelengths in nm, sent on subscribe and when they change
+#   FRAME   '<QddI' sequence, timestamp (s since epoch), FWHM (fs, NaN if not found),
+#           pixels, followed by float32[pixels] intensities
+#   METRICS float64[records x 7] rows of tracking.fields, every tracked frame
+# Clients send one JSON line to subscribe, e.g. {"rate": 10, "spectra": true}.
+# rate is the maximum frames per second, 0 for none; spectra false sends
+# FWHM-only frames; metrics true adds the per-frame records of the source's
+# Tracker while tracking is on.
+magic = b'SPEC'
+header = struct.Struct('<4sBI')
+frameHeader = struct.Struct('<QddI')
+AXIS = 1
+FRAME = 2
+METRICS = 3
+
+
+class SpectrumServer:
+    # Publishes the newest processed frame of an AcquisitionWorker (anything with
+    # wavelengths and a processed RingBuffer) over TCP or a Unix socket. The
+    # server only ever copies the latest frame from the ring, and a client whose
+    # socket buffer is full has frames dropped, so neither slow clients nor the
+    # network can hold up acquisition.
+
+    def __init__(self, source, host='127.0.0.1', port=8765, path=None, maxRate=100.0, bufferLimit=1 << 20):
+        self.source = source
+        self.host = host
+        self.port = port
+        self.path = path
+        self.maxRate = maxRate
+        self.bufferLimit = bufferLimit
+        self.clients = 0
+        self.published = 0
+        self._engine = FWHMEngine()
+        self._frame = np.empty(len(source.wavelengths))
+        self._latest = None
+        self._metrics = None
+        self._axis = None
+        self._newFrame = None
+        self._loop = None
+        self._stopped = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+        # Client task -> its stream writer
+        self._tasks = {}
+
+    def Start(self):
+        self._thread = threading.Thread(target=asyncio.run, args=(self._Serve(),), daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def Stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+            self._thread.join()
+            self._loop = None
+
+    async def _Serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._newFrame = asyncio.Condition()
+        try:
+            if self.path:
+                server = await asyncio.start_unix_server(self._Client, self.path)
+            else:
+                server = await asyncio.start_server(self._Client, self.host, self.port)
+                self.port = server.sockets[0].getsockname()[1]
+        except OSError as error:
+            self._error = error
+            self._loop = None
+            self._ready.set()
+            return
+        publisher = asyncio.ensure_future(self._Publish())
+        self._ready.set()
+        async with server:
+            await self._stopped.wait()
+        publisher.cancel()
+        for writer in self._tasks.values():
+            # Clients see a disconnect and end on their own
+            writer.transport.abort()
+        await asyncio.gather(publisher, *self._tasks, return_exceptions=True)
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _AxisMessage(self):
+        wavelengths = np.ascontiguousarray(self.source.wavelengths, dtype='<f8').tobytes()
+        return header.pack(magic, AXIS, len(wavelengths)) + wavelengths
+
+    async def _Publish(self):
+        # Encodes each new frame once, whatever the number of clients
+        seen = -1
+        tracked = {}
+        while True:
+            await asyncio.sleep(1 / self.maxRate)
+            if not self.clients:
+                continue
+            batch = self._TrackerBatch(tracked)
+            if self.source.processed.count - 1 == seen:
+                if batch:
+                    async with self._newFrame:
+                        self._newFrame.notify_all()
+                continue
+            latest = self.source.processed.Latest(self._frame)
+            if latest is None:
+                continue
+            seen, timestamp = latest
+            fwhm = self._engine(self.source.wavelengths, self._frame)
+            pixels = len(self._frame)
+            spectrum = frameHeader.pack(seen, timestamp, fwhm, pixels) + self._frame.astype('<f4').tobytes()
+            summary = frameHeader.pack(seen, timestamp, fwhm, 0)
+            self._latest = (seen,
+                            header.pack(magic, FRAME, len(spectrum)) + spectrum,
+                            header.pack(magic, FRAME, len(summary)) + summary)
+            self.published += 1
+            async with self._newFrame:
+                self._newFrame.notify_all()
+
+    def _TrackerBatch(self, tracked):
+        # Packs the tracker records added since the last call into one METRICS
+        # message; tracked remembers the position per tracker, which changes
+        # whenever tracking is switched back on
+        tracker = getattr(self.source, 'tracker', None)
+        if tracker is None:
+            return False
+        records, tracked[id(tracker)] = tracker.Since(tracked.get(id(tracker), 0))
+        if not len(records):
+            return False
+        batch = self._metrics[0] + 1 if self._metrics else 0
+        self._metrics = (batch, records.astype('<f8').tobytes())
+        return True
+
+    async def _NextFrame(self):
+        async with self._newFrame:
+            await self._newFrame.wait()
+
+    async def _Client(self, reader, writer):
+        self.clients += 1
+        self._tasks[asyncio.current_task()] = writer
+        following = waiter = None
+        try:
+            request = json.loads((await reader.readline()) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError('request must be a JSON object')
+            rate = float(request.get('rate', self.maxRate))
+            interval = 1 / min(max(rate, 0.01), self.maxRate)
+            spectra = bool(request.get('spectra', True))
+            metrics = bool(request.get('metrics', False))
+            if spectra and rate > 0:
+                writer.write(self._AxisMessage())
+            sent = -1
+            batchSent = self._metrics[0] if self._metrics else -1
+            # Metrics records not written yet, at most bufferLimit bytes of the newest
+            pending = b''
+            keep = max(1, self.bufferLimit // (8 * len(fields))) * 8 * len(fields)
+            due = self._loop.time()
+            # Completes when the client disconnects, which ends the wait at once
+            following = asyncio.ensure_future(reader.read())
+            while True:
+                waiter = asyncio.ensure_future(self._NextFrame())
+                await asyncio.wait({following, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                if following.done():
+                    break
+                if metrics and self._metrics and self._metrics[0] != batchSent:
+                    batchSent, payload = self._metrics
+                    pending = (pending + payload)[-keep:]
+                # Metrics skip the rate limit, every record counts. While the client
+                # is behind they are coalesced into one message, dropping the oldest.
+                if pending and writer.transport.get_write_buffer_size() < self.bufferLimit:
+                    writer.write(header.pack(magic, METRICS, len(pending)) + pending)
+                    pending = b''
+                if rate <= 0 or self._latest is None:
+                    continue
+                seq, spectrum, summary = self._latest
+                if seq == sent or self._loop.time() < due:
+                    continue
+                # A full socket buffer means the client is behind: skip this frame
+                if writer.transport.get_write_buffer_size() < self.bufferLimit:
+                    writer.write(spectrum if spectra else summary)
+                    sent = seq
+                due = max(due + interval, self._loop.time() - interval)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            for task in (following, waiter):
+                if task is not None:
+                    task.cancel()
+            self.clients -= 1
+            self._tasks.pop(asyncio.current_task(), None)
+            writer.close()
+
+
+async def _ReadMessage(reader):
+    magicBytes, kind, length = header.unpack(await reader.readexactly(header.size))
+    if magicBytes != magic:
+        raise ValueError('not a spectrum stream')
+    return kind, await reader.readexactly(length)
+
+
+async def _Subscribe(host, port, path, request):
+    if path:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    writer.write((json.dumps(request) + '\n').encode())
+    return reader, writer
+
+
+async def Frames(host='127.0.0.1', port=8765, path=None, rate=10.0, spectra=True):
+    # Client side: yields (seq, timestamp, fwhm, wavelengths, intensities) as they
+    # arrive; wavelengths and intensities are None for FWHM-only subscriptions
+    reader, writer = await _Subscribe(host, port, path, {'rate': rate, 'spectra': spectra})
+    wavelengths = None
+    try:
+        while True:
+            kind, payload = await _ReadMessage(reader)
+            if kind == AXIS:
+                wavelengths = np.frombuffer(payload, dtype='<f8')
+            elif kind == FRAME:
+                seq, timestamp, fwhm, pixels = frameHeader.unpack_from(payload)
+                intensities = np.frombuffer(payload, dtype='<f4', offset=frameHeader.size) if pixels else None
+                yield seq, timestamp, fwhm, wavelengths, intensities
+    finally:
+        writer.close()
+
+
+async def Metrics(host='127.0.0.1', port=8765, path=None):
+    # Client side: yields arrays of tracking records (rows of tracking.fields)
+    # for every frame the server's tracker processes
+    reader, writer = await _Subscribe(host, port, path, {'rate': 0, 'metrics': True})
+    try:
+        while True:
+            kind, payload = await _ReadMessage(reader)
+            if kind == METRICS:
+                yield np.frombuffer(payload, dtype='<f8').reshape(-1, len(fields))
+    finally:
+        writer.close()
+
+
+async def _ListenMetrics(args, count):
+    received = 0
+    async for records in Metrics(args.host, args.port, args.unix):
+        for seq, timestamp, fwhm, centroid, rms, peak, latency in records:
+            print('frame %6d  FWHM %7.2f fs  centroid %7.2f nm  rms %6.2f nm  peak %7.2f nm  %.2f ms'
+                  % (seq, fwhm, centroid, rms, peak, latency))
+        received += len(records)
+        if count and received >= count:
+            break
+    return received
+
+
+async def _Listen(args, count):
+    start = tm.perf_counter()
+    received = 0
+    async for seq, timestamp, fwhm, wavelengths, intensities in Frames(args.host, args.port, args.unix,
+                                                                       args.rate, not args.fwhm_only):
+        received += 1
+        latency = (tm.time() - timestamp) * 1e3
+        print('frame %6d  FWHM %7.2f fs  latency %6.1f ms%s'
+              % (seq, fwhm, latency, '' if intensities is None else '  %d pixels' % len(intensities)))
+        if count and received >= count:
+            break
+    elapsed = tm.perf_counter() - start
+    print('%d frames in %.2f s, %.1f frames/s' % (received, elapsed, received / elapsed), file=sys.stderr)
+    return received
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stream calibrated spectra to other programs, or listen to a stream.')
+    parser.add_argument('mode', choices=['serve', 'client', 'loopback'],
+                        help='loopback serves a mock device and reads it back in the same process')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='Unix socket path instead of TCP')
+    parser.add_argument('--device', choices=['mock', 'replay'], default='mock', help='device to serve')
+    parser.add_argument('--rate', type=float, default=10.0, help='client frame rate')
+    parser.add_argument('--fwhm-only', action='store_true', help='client receives FWHM without spectra')
+    parser.add_argument('--count', type=int, default=0, help='client stops after this many frames')
+    parser.add_argument('--metrics', action='store_true',
+                        help='track every frame on the server and receive the per-frame metrics')
+    args = parser.parse_args(argv)
+    listen = _ListenMetrics if args.metrics else _Listen
+
+    if args.mode == 'client':
+        asyncio.run(listen(args, args.count))
+        return 0
+
+    from acquisition import AcquisitionWorker, MockSpectrometer, ReplaySpectrometer
+    device = MockSpectrometer(noise=0.01, rate=50.0) if args.device == 'mock' else ReplaySpectrometer()
+    worker = AcquisitionWorker(device)
+    if args.metrics:
+        worker.tracker = Tracker(worker.wavelengths)
+    worker.start()
+    server = SpectrumServer(worker, args.host, 0 if args.mode == 'loopback' and not args.unix else args.port,
+                            args.unix).Start()
+    try:
+        if args.mode == 'loopback':
+            args.port = server.port
+            received = asyncio.run(listen(args, args.count or 20))
+            return 0 if received else 1
+        print('Serving on %s' % (args.unix or '%s:%d' % (args.host, server.port)), file=sys.stderr)
+        while True:
+            tm.sleep(1)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        server.Stop()
+        worker.Stop()
+        if worker.tracker is not None:
+            print('tracking latency %s' % worker.tracker.LatencyStats(), file=sys.stderr)
+        if worker.exception is not None:
+            print('acquisition stopped: %s' % worker.exception, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
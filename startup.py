@@ -0,0 +1,74 @@
+import importlib
+import os
+import sys
+import time as tm
+from PyQt5 import QtCore, QtWidgets
+
+# Compiled .ui modules are kept here, next to the .ui files
+uiCacheDir = '.uicache'
+
+
+def CompiledUi(uiFile):
+    # Python module generated from uiFile with pyuic, regenerated when the .ui file
+    # changes. Importing it is much cheaper than parsing the XML with loadUi.
+    name = 'ui_' + os.path.splitext(os.path.basename(uiFile))[0]
+    target = os.path.join(uiCacheDir, name + '.py')
+    if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(uiFile):
+        from PyQt5.uic import compileUi
+        os.makedirs(uiCacheDir, exist_ok=True)
+        temporary = target + '.tmp'
+        with open(uiFile, 'r') as source, open(temporary, 'w') as f:
+            compileUi(source, f)
+        os.replace(temporary, target)
+        importlib.invalidate_caches()
+        sys.modules.pop(name, None)
+    if uiCacheDir not in sys.path:
+        sys.path.append(uiCacheDir)
+    return importlib.import_module(name)
+
+
+def LoadUi(uiFile, widget):
+    # Same result as PyQt5.uic.loadUi(uiFile, widget): child widgets become attributes
+    module = CompiledUi(uiFile)
+    form = next(getattr(module, name) for name in dir(module) if name.startswith('Ui_'))()
+    form.setupUi(widget)
+    for name, value in vars(form).items():
+        setattr(widget, name, value)
+    return widget
+
+
+class StartupProfiler(QtCore.QObject):
+    # Prints the time since start for named moments of the startup; Watch adds
+    # a mark when a window paints for the first time.
+
+    def __init__(self, start, stream=sys.stderr):
+        QtCore.QObject.__init__(self)
+        self.start = start
+        self.stream = stream
+        self.marks = []
+        self.window = None
+
+    def Mark(self, name):
+        self.marks.append((name, tm.perf_counter() - self.start))
+        self.stream.write('%-24s %8.1f ms\n' % (name, self.marks[-1][1] * 1e3))
+        self.stream.flush()
+
+    def Watch(self, window):
+        # Child widgets cover the window, so paints are caught application wide
+        self.window = window
+        QtWidgets.QApplication.instance().installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if (event.type() == QtCore.QEvent.Paint and isinstance(watched, QtWidgets.QWidget)
+                and watched.window() is self.window):
+            QtWidgets.QApplication.instance().removeEventFilter(self)
+            self.Mark('first paint')
+        return False
+
+
+if __name__ == '__main__':
+    # Compile every .ui file ahead of time, e.g. when packaging
+    import glob
+    for uiFile in glob.glob('*.ui'):
+        CompiledUi(uiFile)
+        print(uiFile, '->', uiCacheDir)
@@ -0,0 +1,194 @@
+import sys
+import numpy as np
+from PyQt5 import QtCore, QtWidgets
+import profiling
+from profiling import timings
+
+bars = ' ▁▂▃▄▅▆▇█'
+
+
+def Sparkline(counts):
+    if not np.any(counts):
+        return ''
+    levels = np.ceil(counts / np.max(counts) * (len(bars) - 1)).astype(int)
+    return ''.join(bars[level] for level in levels)
+
+
+class StatusPanel(QtWidgets.QWidget):
+    # Status bar strip with the FPS of rateStage, the median and p99 latency of
+    # the busiest stages, and buttons for cProfile (GUI thread), tracemalloc and
+    # the JSON export of all timings. Per-stage histograms are in the tooltip.
+
+    def __init__(self, window, rateStage='draw', interval=500, parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+        self.window = window
+        self.rateStage = rateStage
+        layout = QtWidgets.QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.label = QtWidgets.QLabel(self)
+        layout.addWidget(self.label)
+        self.profileButton = self._Button('Profile', 'Record a cProfile of the GUI thread', self.ToggleProfile)
+        self.memoryButton = self._Button('Memory', 'Trace allocations with tracemalloc', self.ToggleMemory)
+        self.exportButton = self._Button('Export timings', 'Save all stage timings as JSON', self.ExportTimings)
+        self.exportButton.setCheckable(False)
+        for button in (self.profileButton, self.memoryButton, self.exportButton):
+            layout.addWidget(button)
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.Update)
+        self.timer.start(interval)
+
+    def _Button(self, text, tooltip, slot):
+        button = QtWidgets.QToolButton(self)
+        button.setText(text)
+        button.setToolTip(tooltip)
+        button.setCheckable(True)
+        button.clicked.connect(slot)
+        return button
+
+    def Message(self, text, timeout=8000):
+        self.window.statusBar().showMessage(text, timeout)
+
+    def Update(self):
+        names = timings.Names()
+        parts = ['%.1f FPS' % timings.Rate(self.rateStage)]
+        tooltip = []
+        stats = [(name, timings.Stats(name)) for name in names]
+        stats = [(name, s) for name, s in stats if s is not None]
+        # The three stages with the largest typical cost go in the bar
+        for name, s in sorted(stats, key=lambda item: -item[1]['p50'])[:3]:
+            parts.append('%s %.1f/%.1f ms' % (name, s['p50'], s['p99']))
+        for name, s in stats:
+            counts, edges = timings.Histogram(name)
+            tooltip.append('%-18s p50 %7.2f  p99 %7.2f  max %7.2f ms  %.2f %s %.2f ms'
+                           % (name, s['p50'], s['p99'], s['max'], edges[0], Sparkline(counts), edges[-1]))
+        self.label.setText('   '.join(parts))
+        self.label.setToolTip('<pre>' + '\n'.join(tooltip) + '</pre>')
+
+    def ToggleProfile(self):
+        if profiling.Profiling():
+            filename, text = profiling.StopProfile()
+            sys.stderr.write(text)
+            self.Message('Profile saved to ' + filename)
+        else:
+            profiling.StartProfile()
+            self.Message('Profiling the GUI thread...', 0)
+
+    def ToggleMemory(self):
+        if profiling.TracingMemory():
+            filename, text = profiling.StopMemory()
+            sys.stderr.write(text + '\n')
+            self.Message('Allocation report saved to ' + filename)
+        else:
+            profiling.StartMemory()
+            self.Message('Tracing allocations...', 0)
+
+    def ExportTimings(self):
+        filename = profiling.ProfileName('_timings.json')
+        timings.Export(filename)
+        self.Message('Timings saved to ' + filename)
+
+
+class TrackingPanel(QtWidgets.QWidget):
+    # Track toggle and readout of the per-frame metrics of a tracking.Tracker
+    # running on the acquisition thread. The label refreshes at a fixed low
+    # rate whatever the frame rate; Apply(worker) attaches or detaches the
+    # tracker and is called again whenever a new worker starts.
+
+    def __init__(self, window, interval=100, parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+        self.window = window
+        self.worker = None
+        layout = QtWidgets.QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.check = QtWidgets.QCheckBox('Track', self)
+        self.check.setToolTip('Compute FWHM, centroid, RMS bandwidth and peak for every frame')
+        self.check.toggled.connect(lambda: self.Apply(self.worker))
+        self.label = QtWidgets.QLabel(self)
+        layout.addWidget(self.check)
+        layout.addWidget(self.label)
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.Update)
+        self.timer.setInterval(interval)
+
+    def Tracking(self):
+        return self.worker is not None and self.worker.tracker is not None
+
+    def Apply(self, worker):
+        from tracking import Tracker
+        self.worker = worker
+        if worker is not None:
+            worker.tracker = Tracker(worker.wavelengths) if self.check.isChecked() else None
+        if self.Tracking():
+            self.timer.start()
+        else:
+            self.timer.stop()
+            self.label.clear()
+
+    def Update(self):
+        if not self.Tracking():
+            return
+        tracker = self.worker.tracker
+        latest = tracker.Latest()
+        if latest is None:
+            return
+        stats = tracker.LatencyStats()
+        self.label.setText('FWHM %.2f fs  centroid %.2f nm  RMS %.2f nm  peak %.2f nm  latency %.2f/%.2f ms'
+                           % (latest['fwhm'], latest['centroid'], latest['rms'], latest['peak'],
+                              stats['p50'], stats['p99']))
+
+
+class RoiPanel(QtWidgets.QWidget):
+    # Region of interest in nm: when checked, plots, exports and new recordings
+    # only keep the pixels between the two wavelengths. changed is emitted with
+    # the (low, high) tuple, or None when the ROI is off.
+    changed = QtCore.pyqtSignal(object)
+
+    def __init__(self, low=400.0, high=1100.0, parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+        layout = QtWidgets.QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.check = QtWidgets.QCheckBox('ROI', self)
+        self.check.setToolTip('Only plot, export and record this wavelength range')
+        self.check.toggled.connect(self.Changed)
+        layout.addWidget(self.check)
+        self.edges = []
+        for value in (low, high):
+            box = QtWidgets.QDoubleSpinBox(self)
+            box.setRange(100.0, 3000.0)
+            box.setDecimals(1)
+            box.setSuffix(' nm')
+            box.setValue(value)
+            box.setKeyboardTracking(False)
+            box.valueChanged.connect(lambda: self.check.isChecked() and self.Changed())
+            layout.addWidget(box)
+            self.edges.append(box)
+
+    def Roi(self):
+        if not self.check.isChecked():
+            return None
+        return tuple(sorted(box.value() for box in self.edges))
+
+    def Changed(self):
+        self.changed.emit(self.Roi())
+
+
+def InstallRoiPanel(window):
+    panel = RoiPanel(parent=window.statusBar())
+    window.statusBar().addWidget(panel)
+    return panel
+
+
+def InstallTrackingPanel(window):
+    panel = TrackingPanel(window, parent=window.statusBar())
+    window.statusBar().addWidget(panel)
+    return panel
+
+
+def InstallStatusPanel(window, rateStage='draw'):
+    # Adds the panel to the window status bar, growing the window so the
+    # fixed-geometry widgets above keep their room
+    bar = window.statusBar()
+    panel = StatusPanel(window, rateStage, parent=bar)
+    bar.addPermanentWidget(panel)
+    window.resize(window.width(), window.height() + bar.sizeHint().height())
+    return panel
@@ -0,0 +1,220 @@
+import argparse
+import os
+import sys
+import time as tm
+import warnings
+from itertools import islice
+import numpy as np
+from calibration import CalibrateStack, SuperGaussianFilter
+from fwhm import CalculateFWHMBatch
+from recorder import HDF5Store, OpenRecording, RawStore, h5py
+from spectrumio import ParseSpectrumText
+
+# Spectra per chunk. The FWHM batch holds a complex (rows x 4 pixels) array, so
+# 128 rows of a 3648-pixel spectrometer stay below 32 MB.
+chunkRows = 128
+
+
+def _FirstValue(line):
+    # Wavelength of a data line, None for headers and blank lines
+    line = line.strip()
+    if ';' in line:
+        token = line.split(';')[0].replace(',', '.')
+    else:
+        token = line.replace(',', ' ').split()[0] if line else ''
+    try:
+        return float(token)
+    except ValueError:
+        return None
+
+
+def _ScanLog(filename):
+    # Header lines to skip and pixels per spectrum of a text log made of
+    # two-column spectra written one after another: a spectrum ends where the
+    # wavelength stops increasing. A file without a reset is a single spectrum.
+    header = 0
+    pixels = 0
+    previous = None
+    with open(filename, 'r') as f:
+        for line in f:
+            value = _FirstValue(line)
+            if value is None:
+                if pixels:
+                    break
+                header += 1
+                continue
+            if previous is not None and value <= previous:
+                break
+            previous = value
+            pixels += 1
+    if not pixels:
+        raise ValueError('No numeric data found')
+    return header, pixels
+
+
+def TextChunks(filename, rows=chunkRows):
+    # (wavelength, rows x pixels intensities) for a concatenated text log, reading
+    # only rows spectra worth of lines at a time
+    header, pixels = _ScanLog(filename)
+    wavelength = None
+    with open(filename, 'r') as f:
+        for _ in range(header):
+            next(f)
+        data = (line for line in f if line.strip())
+        while True:
+            lines = list(islice(data, rows * pixels))
+            if not lines:
+                return
+            complete = len(lines) - len(lines) % pixels
+            if complete < len(lines):
+                warnings.warn('%s ends with an incomplete spectrum of %d lines, skipped'
+                              % (filename, len(lines) - complete))
+            if not complete:
+                return
+            block = ParseSpectrumText(''.join(lines[:complete])).reshape(-1, pixels, 2)
+            if wavelength is None:
+                wavelength = block[0, :, 0].copy()
+            if not np.allclose(block[:, :, 0], wavelength):
+                raise ValueError('%s: spectra do not share one wavelength axis' % filename)
+            yield wavelength, block[:, :, 1]
+            if complete < len(lines):
+                return
+
+
+def RecordingChunks(path, rows=chunkRows, column='raw'):
+    # Blocks of a recording column. Directory recordings are memory-mapped and
+    # HDF5 datasets are sliced, so only the current block is read from disk.
+    if os.path.isfile(path):
+        if h5py is None:
+            raise ImportError('h5py is needed to read HDF5 recordings')
+        with h5py.File(path, 'r') as f:
+            wavelength = f['wavelengths'][()]
+            dataset = f[column]
+            for start in range(0, dataset.shape[0], rows):
+                yield wavelength, dataset[start:start + rows]
+        return
+    data, meta = OpenRecording(path)
+    frames = data[column]
+    for start in range(0, len(frames), rows):
+        yield data['wavelengths'], np.array(frames[start:start + rows], dtype=float)
+
+
+def ReadChunks(source, rows=chunkRows, column='raw'):
+    if os.path.isdir(source) or source.endswith(('.h5', '.hdf5')):
+        return RecordingChunks(source, rows, column)
+    return TextChunks(source, rows)
+
+
+def CalibrateChunks(chunks, calibration, normalise=False, fwhm=True):
+    # Calibrates block by block as in main_batch: response correction, optional
+    # smoothing and filter, then scaled back to the raw maximum of each spectrum
+    # or normalised. The response and filter are only resampled when the axis changes.
+    axis = None
+    for wavelength, block in chunks:
+        if axis is None or len(axis) != len(wavelength) or not np.array_equal(axis, wavelength):
+            axis = np.array(wavelength)
+            response = calibration.ResponseFor(axis)
+            filter = None
+            if calibration.filterParameters is not None:
+                filter = SuperGaussianFilter(axis, *calibration.filterParameters)
+        calibrated = CalibrateStack(block, response, filter, smooth=calibration.smooth, normalise=normalise)
+        if not normalise:
+            calibrated *= np.max(block, axis=1, keepdims=True)
+        widths = CalculateFWHMBatch(axis, calibrated) if fwhm else None
+        yield axis, calibrated, widths
+
+
+class TextWriter:
+    # Calibrated spectra appended to a text log in the input layout, one format
+    # call per block; the FWHM of each spectrum goes to <name>_fwhm.txt
+
+    def __init__(self, filename, fmt='%.4f'):
+        self.file = open(filename, 'w')
+        self.fwhmName = os.path.splitext(filename)[0] + '_fwhm.txt'
+        self.fwhmFile = None
+        self.fmt = fmt
+
+    def Append(self, wavelength, calibrated, widths=None):
+        rows, pixels = calibrated.shape
+        block = np.empty((rows, pixels, 2))
+        block[:, :, 0] = wavelength
+        block[:, :, 1] = calibrated
+        line = '%s %s\n' % (self.fmt, self.fmt)
+        self.file.write((line * (rows * pixels)) % tuple(block.ravel()))
+        if widths is not None:
+            if self.fwhmFile is None:
+                self.fwhmFile = open(self.fwhmName, 'w')
+            self.fwhmFile.write(('%.2f\n' * rows) % tuple(widths))
+
+    def Close(self):
+        self.file.close()
+        if self.fwhmFile is not None:
+            self.fwhmFile.close()
+
+
+class StoreWriter:
+    # Calibrated spectra and their FWHM as columns of a recording (directory or HDF5)
+
+    def __init__(self, path, metadata):
+        self.path = path
+        self.metadata = metadata
+        self.store = None
+
+    def Append(self, wavelength, calibrated, widths=None):
+        if self.store is None:
+            if self.path.endswith(('.h5', '.hdf5')):
+                self.store = HDF5Store(self.path, wavelength, self.metadata)
+            else:
+                self.store = RawStore(self.path, wavelength, self.metadata)
+        columns = {'calibrated': calibrated}
+        if widths is not None:
+            columns['fwhm'] = widths
+        self.store.Append(columns)
+
+    def Close(self):
+        if self.store is not None:
+            self.store.Close()
+
+
+def StreamFile(source, output, calibration, rows=chunkRows, normalise=False, fwhm=True, column='raw'):
+    # Calibrates source into output without holding more than one block of
+    # spectra in memory. Returns the number of spectra written.
+    if output.endswith('.txt'):
+        writer = TextWriter(output)
+    else:
+        writer = StoreWriter(output, {'source': os.path.abspath(source), 'normalised': normalise,
+                                      'filter': list(calibration.filterParameters or ()), 'smooth': calibration.smooth})
+    count = 0
+    try:
+        for wavelength, calibrated, widths in CalibrateChunks(ReadChunks(source, rows, column),
+                                                              calibration, normalise, fwhm):
+            writer.Append(wavelength, calibrated, widths)
+            count += len(calibrated)
+    finally:
+        writer.Close()
+    return count
+
+
+def main(argv=None):
+    from main_batch import AddCalibrationArguments, CalibrationFromArguments
+    parser = argparse.ArgumentParser(description='Calibrate a long spectrum log or recording chunk by chunk.')
+    parser.add_argument('source', help='concatenated text log, recording directory or HDF5 recording')
+    parser.add_argument('output', help='.txt for a text log, .h5 or a directory for a recording')
+    AddCalibrationArguments(parser)
+    parser.add_argument('--rows', type=int, default=chunkRows, help='spectra per chunk')
+    parser.add_argument('--normalise', action='store_true', help='normalise every spectrum to 1')
+    parser.add_argument('--no-fwhm', action='store_true', help='skip the FWHM column')
+    parser.add_argument('--column', default='raw', help='recording column to calibrate')
+    args = parser.parse_args(argv)
+
+    calibration = CalibrationFromArguments(args)
+    start = tm.perf_counter()
+    count = StreamFile(args.source, args.output, calibration, args.rows, args.normalise,
+                       not args.no_fwhm, args.column)
+    elapsed = tm.perf_counter() - start
+    print('Calibrated %d spectra in %.2f s, %.1f spectra/s' % (count, elapsed, count / elapsed), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,24 @@
+import numpy as np
+from benchmarks import SyntheticSpectrum
+from decimation import FrequencyBinner, MinMaxBinner
+from fwhm import CalculateFWHM, CalculateFWHMUniform
+
+
+def test_frequency_binner_descending_axis():
+    wavelength, intensity = SyntheticSpectrum(2048, duration=30.0)
+    ascending = FrequencyBinner(wavelength, 512)
+    descending = FrequencyBinner(wavelength[::-1], 512)
+    density = descending(intensity[::-1])
+    assert np.min(density) >= 0
+    np.testing.assert_allclose(density, ascending(intensity), rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(CalculateFWHMUniform(descending.frequency, density),
+                               CalculateFWHM(wavelength, intensity), rtol=1e-3)
+
+
+def test_min_max_binner_keeps_extremes():
+    wavelength, intensity = SyntheticSpectrum(4096)
+    intensity[1234] = 10.0
+    binner = MinMaxBinner(wavelength, 500, roi=(700.0, 900.0))
+    binned = binner(intensity)
+    assert len(binned) == len(binner.x) <= 1000
+    assert np.max(binned) == 10.0
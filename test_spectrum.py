@@ -0,0 +1,27 @@
+import numpy as np
+from benchmarks import SyntheticSpectrum
+from pipeline import SpectrumPipeline
+from spectrum import Spectrum
+
+
+def test_edit_leaves_handed_out_intensity_unchanged():
+    wavelength, intensity = SyntheticSpectrum(1024)
+    spectrum = Spectrum(wavelength, intensity)
+    view = spectrum.intensity
+    spectrum.Edit()[:] = 0
+    np.testing.assert_array_equal(view, intensity)
+    assert not spectrum.intensity.any()
+
+
+def test_pipeline_recomputes_fwhm_after_edit():
+    wavelength, narrow = SyntheticSpectrum(2048, duration=10.0)
+    broad = SyntheticSpectrum(2048, duration=30.0)[1]
+    spectrum = Spectrum(wavelength, narrow)
+    pipeline = SpectrumPipeline()
+    before = pipeline.Evaluate({'spectrum': spectrum}, ('fwhm', 'intensity'))
+    spectrum.Edit()[:] = broad
+    after = pipeline.Evaluate({'spectrum': spectrum}, ('fwhm',))['fwhm']
+    np.testing.assert_array_equal(before['intensity'], narrow)
+    np.testing.assert_allclose(after, SpectrumPipeline().Evaluate({'spectrum': spectrum}, ('fwhm',))['fwhm'])
+    np.testing.assert_allclose(after, 30.0, rtol=0.01)
+    assert abs(after - before['fwhm']) > 10
@@ -0,0 +1,12 @@
+import numpy as np
+from spectrumio import ParseSpectrumText, ReadSpectrum
+
+
+def test_decimal_comma_tab_separated(tmp_path):
+    filename = tmp_path / 'spectrum.txt'
+    filename.write_text('Wavelength\tIntensity\n345,33\t16,38\n346,10\t17,5\n')
+    np.testing.assert_allclose(ReadSpectrum(str(filename)), [[345.33, 16.38], [346.1, 17.5]])
+
+
+def test_comma_delimiter():
+    np.testing.assert_allclose(ParseSpectrumText('345.3,16.4\n346, 17\n'), [[345.3, 16.4], [346.0, 17.0]])
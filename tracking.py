@@ -0,0 +1,85 @@
+import time as tm
+import numpy as np
+from fwhm import FWHMEngine
+
+# Columns of Tracker.records
+fields = ('seq', 'timestamp', 'fwhm', 'centroid', 'rms', 'peak', 'latency')
+
+
+class Tracker:
+    # Per-frame pulse metrics for feedback loops: transform-limited FWHM (fs),
+    # spectral centroid, RMS bandwidth and peak wavelength (nm). Runs on the
+    # acquisition thread on preallocated buffers; results go to a lock-free
+    # ring of records read like RingBuffer, so rendering never delays them.
+    # latency is the time in ms from the frame arriving to its metrics being ready.
+
+    def __init__(self, wavelengths, capacity=4096):
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.capacity = capacity
+        self.records = np.full((capacity, len(fields)), np.nan)
+        self.count = 0
+        self._engine = FWHMEngine()
+        self._step = np.abs(np.gradient(self.wavelengths))
+        self._weights = np.empty(len(self.wavelengths))
+        self._offset = np.empty(len(self.wavelengths))
+        # Run the engine once so scipy imports and buffer setup are not charged to the first frame
+        self._engine(self.wavelengths, np.exp(-np.linspace(-4, 4, len(self.wavelengths)) ** 2))
+
+    def Update(self, intensity, seq, timestamp, arrival):
+        # arrival is the perf_counter time the frame came off the device
+        weights = self._weights
+        np.maximum(intensity, 0, out=weights)
+        peak = self._Peak(weights)
+        weights *= self._step
+        total = np.sum(weights)
+        if total > 0:
+            centroid = np.dot(weights, self.wavelengths) / total
+            np.subtract(self.wavelengths, centroid, out=self._offset)
+            np.square(self._offset, out=self._offset)
+            rms = np.sqrt(np.dot(weights, self._offset) / total)
+        else:
+            centroid = rms = np.nan
+        fwhm = self._engine(self.wavelengths, intensity)
+        slot = self.count % self.capacity
+        self.records[slot] = (seq, timestamp, fwhm, centroid, rms, peak, (tm.perf_counter() - arrival) * 1e3)
+        self.count += 1
+
+    def _Peak(self, intensity):
+        # Peak wavelength refined with a parabola through the three highest samples
+        k = int(np.argmax(intensity))
+        if 0 < k < len(intensity) - 1:
+            left, centre, right = intensity[k - 1], intensity[k], intensity[k + 1]
+            curvature = left - 2 * centre + right
+            if curvature < 0:
+                shift = 0.5 * (left - right) / curvature
+                return np.interp(k + shift, np.arange(len(intensity)), self.wavelengths)
+        return self.wavelengths[k]
+
+    def Latest(self):
+        # Newest record as a dict, None before the first frame
+        while True:
+            seq = self.count - 1
+            if seq < 0:
+                return None
+            record = self.records[seq % self.capacity].copy()
+            if self.count - seq < self.capacity:
+                return dict(zip(fields, record.tolist()))
+
+    def Since(self, count):
+        # Records with sequence numbers from count on, oldest first, and the next count
+        end = self.count
+        start = max(count, end - self.capacity + 1)
+        records = self.records[np.arange(start, end) % self.capacity].copy()
+        if self.count - start >= self.capacity:
+            # The writer lapped the first rows while they were copied
+            lost = self.count - start - self.capacity + 1
+            records = records[lost:]
+        return records, end
+
+    def LatencyStats(self):
+        records = self.Since(0)[0]
+        latency = records[:, fields.index('latency')]
+        if not len(latency):
+            return None
+        p50, p99 = np.percentile(latency, (50, 99))
+        return {'frames': self.count, 'p50': float(p50), 'p99': float(p99), 'max': float(np.max(latency))}